@@ -16,7 +16,9 @@ MS_TO_S = 0.001
 # packet sizes
 DATA_PACKET_SIZE = 1024.0 * BYTE_TO_BIT
 ACK_PACKET_SIZE = 64.0 * BYTE_TO_BIT
-ROUT_PACKET_SIZE = 128.0 * BYTE_TO_BIT
+# Routing packets carry a header and one (node id, cost) entry per route
+ROUT_HEADER_SIZE = 64.0 * BYTE_TO_BIT
+ROUT_ENTRY_SIZE = 8.0 * BYTE_TO_BIT
 
 # How many seconds a flow waits before resending unacknowledged packets
 TIMEOUT_DELAY = 1000.0 * MS_TO_S
@@ -24,9 +26,121 @@ TIMEOUT_DELAY = 1000.0 * MS_TO_S
 # How often a router dynamically routes in seconds
 REROUTE_PERIOD = 5.0
 
+# Minimum time between two triggered routing updates of a router, and the
+# maximum random jitter added to each, in seconds
+TRIGGERED_UPDATE_INTERVAL = 50 * MS_TO_S
+TRIGGERED_UPDATE_JITTER = 10 * MS_TO_S
+
+# Paths whose costs differ by less than this are equal cost for ECMP. Link
+# costs count the packets queued on the link, so this is in packets: a
+# smaller tolerance changes the equal-cost paths with every queued packet.
+ECMP_COST_TOLERANCE = 8
+
+# Weighted ECMP also uses loop-free next hops whose path costs at most this
+# many times the best path
+ECMP_MAX_STRETCH = 1.5
+
+# How long a route that got worse is held before the router switches it to
+# an alternative that is no better than the route was, in seconds
+ROUTE_HOLD_DOWN = 1.0
+
 # The length of time between each FAST TCP window size update in seconds
 FAST_WINDOW_UPDATE_PERIOD = 20 * MS_TO_S
 
 # parameters for FAST TCP window size calculation
 FAST_GAMMA = 0.5
 FAST_ALPHA = 15
+
+# ECN codepoints carried by packets
+ECN_NOT_ECT = 0
+ECN_ECT = 1
+ECN_CE = 3
+
+# Default parameters of the active queue management disciplines
+RED_MIN_THRESHOLD = 5.0
+RED_MAX_THRESHOLD = 15.0
+RED_MAX_PROBABILITY = 0.1
+RED_QUEUE_WEIGHT = 0.002
+
+CODEL_TARGET = 5.0 * MS_TO_S
+CODEL_INTERVAL = 100.0 * MS_TO_S
+
+PIE_TARGET = 15.0 * MS_TO_S
+PIE_UPDATE_PERIOD = 15.0 * MS_TO_S
+PIE_ALPHA = 0.125
+PIE_BETA = 1.25
+PIE_MAX_BURST = 150.0 * MS_TO_S
+PIE_MAX_ECN_PROBABILITY = 0.1
+
+# Bits each flow may send per round of the fair queueing scheduler
+FQ_QUANTUM = DATA_PACKET_SIZE
+
+# CUBIC window growth (RFC 8312): the scaling constant in packets/s^3 and the
+# window reduction factor after a loss
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+# BBR: the pacing and window gain used to find the bottleneck bandwidth
+# (2/ln 2), the pacing gain cycle of the bandwidth probing state, the number
+# of round trips covered by the bandwidth filter, how long a min RTT sample
+# stays valid and how long the window is held low to remeasure it (seconds),
+# and the smallest window in packets
+BBR_HIGH_GAIN = 2.885
+BBR_CWND_GAIN = 2.0
+BBR_PROBE_BW_GAINS = [1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+BBR_BW_FILTER_ROUNDS = 10
+BBR_MIN_RTT_WINDOW = 10.0
+BBR_PROBE_RTT_DURATION = 200.0 * MS_TO_S
+BBR_MIN_WINDOW = 4.0
+
+# BBR leaves startup once the bandwidth estimate has grown by less than this
+# factor for this many round trips
+BBR_FULL_BW_THRESHOLD = 1.25
+BBR_FULL_BW_ROUNDS = 3
+
+# Weight of each new sample in the smoothed round trip time (RFC 6298)
+RTT_SMOOTHING = 0.125
+
+# Sender pacing: the packets a flow's token bucket may hold, and the factor
+# applied to the window per RTT to get the pacing rate in slow start and in
+# congestion avoidance
+PACING_BURST = 1.0
+PACING_SS_GAIN = 2.0
+PACING_CA_GAIN = 1.2
+
+# Fraction of a token the bucket may be short of when the pacing timer fires
+PACING_TOLERANCE = 1e-9
+
+# Points a DataMetrics series has room for before its columns first grow,
+# and the number of new points staged before they are moved into the columns
+SERIES_INITIAL_CAPACITY = 16
+SERIES_BLOCK_SIZE = 1024
+
+# Capacity of the top compactor of the quantile sketches; the rank error of
+# the quantiles is about 1.7 / SKETCH_K. The quantiles DataMetrics.summary
+# reports.
+SKETCH_K = 200
+SUMMARY_QUANTILES = [0.5, 0.9, 0.99]
+
+# Points of a series held in memory before they are written to a metric
+# sink, and points an NpzSink gathers from all the series into one segment
+SINK_CHUNK_SIZE = 8192
+SINK_SEGMENT_SIZE = 262144
+
+# Points DataMetrics bins into plot windows at a time
+WINDOW_BLOCK_SIZE = 1 << 20
+
+# Size in inches and resolution of the plots, and the points a line is
+# downsampled to when plots are rendered to files
+PLOT_FIGURE_SIZE = (30, 9)
+PLOT_DPI = 100
+PLOT_MAX_POINTS = 5000
+
+# Links a heatmap shows by default, the hottest first, and the most rows a
+# heatmap labels by id
+HEATMAP_TOP_LINKS = 50
+HEATMAP_MAX_LABELS = 50
+
+# Bytes of results a ResultCache keeps before deleting the least recently
+# used ones
+RESULT_CACHE_SIZE = 1 << 30
@@ -1,62 +1,304 @@
+from collections import defaultdict
+from functools import partial
+from itertools import izip
+import os
+
 from matplotlib import pyplot as plt
 import numpy as np
 
 from constants import *
+from series import Series, BinnedSeries, SUM, MEAN, LEVEL
+from sampling import SampledSeries, SeriesTable
+from rendering import downsample, draw_heatmap, render_heatmap, \
+    render_plot, render_plots
+from sketch import QuantileSketch
+from trace import read_trace, write_trace
 
 class DataMetrics(object):
     """A class that holds all statistical measurements generated by the
     network simulation.
 
+    Every measurement is a Series of (time, value) points, kept in NumPy
+    columns that the plots and analyses read without copying. The series
+    of each measurement are kept in a SeriesTable, so a series is created
+    the first time it is recorded to.
+
+    Given a bin width, DataMetrics aggregates the points online instead of
+    keeping them, in a BinnedSeries per series: rates, losses and routing
+    counts are summed over each bin, delays and hop counts averaged, and
+    buffer occupancies and window sizes averaged over time. The plots and
+    analyses then work on the bins, which should be no wider than the plot
+    windows.
+
+    A SamplingPolicy set on a measurement, or on some of its series, makes
+    them record only some of their points; see set_sampling().
+
+    Given a MetricSink, DataMetrics streams the points of every series to
+    it in chunks as they are recorded, and only keeps the latest chunk in
+    memory. Reading a series loads it back from the sink.
+
+    save() writes every series to a trace file, and DataMetrics.open()
+    memory-maps one back for analysis, so that runs with more points than
+    fit in memory can still be plotted and queried.
+
+    Round trip times, queueing delays and flow completion times also go
+    into QuantileSketches, which summary() and link_summary() report
+    percentiles from in fixed memory, and which merge_sketches() combines
+    across runs.
+
     Attributes:
         buffer_occupancy (dict): holds buffer occupancy data for each link.
-            The key is the link_id and the value is an array of
-            (time, buffer_occupancy) tuples.
+            The key is the link_id and the value is a Series of
+            (time, buffer_occupancy) points. Duplex links have one key per
+            direction, "link_id:src->dest"; the same holds for packet_loss and
+            link_rate.
         packet_loss (dict): holds packet loss data for each link.
-            The key is the link_id and the value is an array of
-            (time, packet_loss) tuples.
+            The key is the link_id and the value is a Series of
+            (time, packet_loss) points.
         link_rate (dict): holds link rate data for each link.
-            The key is the link_id and the value is an array of
-            (time, amount of data sent) tuples.
+            The key is the link_id and the value is a Series of
+            (time, amount of data sent) points.
         flow_rate (dict): holds flow rate data for each flow.
-            The key is the flow_id and the value is an array of
-            (time, amount of data sent) tuples.
+            The key is the flow_id and the value is a Series of
+            (time, amount of data sent) points.
         window_size (dict): holds window size data for each flow.
-            The key is the flow_id and the value is an array of
-            (time, window size) tuples.
+            The key is the flow_id and the value is a Series of
+            (time, window size) points.
         flow_packet_delay (dict): holds roundtrip time data for each flow
-            The key is the flow_id and the value is an array of
-            (time of acknowledgement, roundtrip time) tuples.
+            The key is the flow_id and the value is a Series of
+            (time of acknowledgement, roundtrip time) points.
+        flow_queueing_delay (dict): holds the queueing delay of each flow in
+            each fair queueing link buffer. The key is "link_id/flow_id" and
+            the value is a Series of (time of dequeue, queueing delay)
+            points.
+        flow_link_rate (dict): holds the data of each flow sent by each fair
+            queueing link. The key is "link_id/flow_id" and the value is a
+            Series of (time, amount of data sent) points.
+        routing_packets_sent (dict): holds the number of routing packets each
+            router sent. The key is the router_id and the value is a Series
+            of (time, packets sent) points. The routing series are only
+            recorded when the simulator records routing metrics.
+        routing_data_sent (dict): holds the routing data each router sent.
+            The key is the router_id and the value is a Series of
+            (time, amount of data sent) points.
+        routing_packets_received (dict): holds the number of routing packets
+            each router received, as (time, packets received) points.
+        routing_table_changes (dict): holds the number of routes each router
+            changed, as (time, routes changed) points.
+        routing_loops (dict): holds the packets found in a forwarding loop
+            by each router, as (time, looping packets) points. A packet is
+            looping once it has been forwarded by more routers than there
+            are in the network.
+        flow_hop_count (dict): holds the number of routers each delivered
+            data packet of a flow went through, as (time of delivery, hops)
+            points.
+        flow_types (dict): the congestion control algorithm of each flow,
+            such as "reno" or "bbr", used to label the flow plots.
+        bin_width (float): the width of the bins in seconds, None when every
+            point is kept.
+        sink (MetricSink): where the points are streamed to, None to keep
+            them in memory.
+        rtt_sketches (dict): a QuantileSketch of the round trip times of
+            each flow, keyed by flow_id.
+        queueing_delay_sketches (dict): a QuantileSketch of the time packets
+            waited in each link buffer, keyed by link series id. Fair
+            queueing links also have one per flow, keyed by
+            "link_id/flow_id".
+        flow_completion_times (dict): the time each completed flow took from
+            its start time to its last acknowledgement, keyed by flow_id.
+        completion_time_sketch (QuantileSketch): the completion times of all
+            the flows.
+        disabled (set): the names of the measurements whose every series is
+            disabled by its sampling policy. The simulator does not send
+            them points at all.
 
     """
 
-    def __init__(self):
-        self.buffer_occupancy = {}
-        self.packet_loss = {}
-        self.link_rate = {}
-        self.flow_rate = {}
-        self.window_size = {}
-        self.flow_packet_delay = {}
+    def __init__(self, bin_width=None, sink=None):
+        if bin_width is not None and sink is not None:
+            raise Exception("Binned metrics cannot be streamed to a sink")
+        self.bin_width = bin_width
+        self.sink = sink
+        self.buffer_occupancy = self.make_table(LEVEL)
+        self.packet_loss = self.make_table(SUM)
+        self.link_rate = self.make_table(SUM)
+        self.flow_rate = self.make_table(SUM)
+        self.window_size = self.make_table(LEVEL)
+        self.flow_packet_delay = self.make_table(MEAN)
+        self.flow_queueing_delay = self.make_table(MEAN)
+        self.flow_link_rate = self.make_table(SUM)
+        self.routing_packets_sent = self.make_table(SUM)
+        self.routing_data_sent = self.make_table(SUM)
+        self.routing_packets_received = self.make_table(SUM)
+        self.routing_table_changes = self.make_table(SUM)
+        self.routing_loops = self.make_table(SUM)
+        self.flow_hop_count = self.make_table(MEAN)
+        self.flow_types = {}
+        self.rtt_sketches = defaultdict(QuantileSketch)
+        self.queueing_delay_sketches = defaultdict(QuantileSketch)
+        self.flow_completion_times = {}
+        self.completion_time_sketch = QuantileSketch()
+        self.disabled = set()
+        for name, table in self.tables().iteritems():
+            table.name = name
+            table.sink = sink
+
+    def make_table(self, kind):
+        """Returns an empty table of series.
+
+        Args:
+            kind (str): how the series are binned when there is a bin width,
+                and sampled: SUM, MEAN or LEVEL. See BinnedSeries.
+
+        """
+        if self.bin_width is None:
+            return SeriesTable(kind, Series)
+        return SeriesTable(kind, partial(BinnedSeries, self.bin_width, kind))
+
+    def tables(self):
+        """Returns the table of series of each measurement by name."""
+        return dict((name, table) for name, table in vars(self).iteritems()
+            if isinstance(table, SeriesTable))
+
+    def set_sampling(self, metric, policy, series_id=None):
+        """Sets the sampling policy of a measurement or of one of its series.
+        Series that already exist get the new policy from then on.
+
+        Args:
+            metric (str): the name of the measurement, such as
+                "buffer_occupancy" or "window_size".
+            policy (SamplingPolicy): the policy, None to record every point.
+            series_id (str): the link, flow or router id of the series, None
+                to set the policy of every series that has none of its own.
+
+        """
+        table = self.tables().get(metric)
+        if table is None:
+            raise Exception("Unknown metric %s" % metric)
+        if series_id is None:
+            table.policy = policy
+        elif policy is None:
+            table.policies.pop(series_id, None)
+        else:
+            table.policies[series_id] = policy
+
+        if table.policy is not None and not table.policy.enabled and \
+            not any(p.enabled for p in table.policies.itervalues()):
+            self.disabled.add(metric)
+        else:
+            self.disabled.discard(metric)
+
+        for key, series in table.items():
+            if isinstance(series, SampledSeries):
+                series.flush()
+                series = series.series
+            table[key] = table.wrap(key, series)
+
+    def save(self, path):
+        """Writes every series, the flow types, the completion times and
+        the sketches to a trace file, see trace.py. Series streamed to a
+        sink are read back one at a time.
+
+        Args:
+            path (str): the path of the trace file.
+
+        """
+        self.flush()
+
+        def series():
+            for name, table in sorted(self.tables().iteritems()):
+                for series_id in sorted(table):
+                    times, values = table[series_id].columns()
+                    yield name, series_id, table.kind, times, values
+
+        metadata = {
+            "bin_width": self.bin_width,
+            "flow_types": self.flow_types,
+            "flow_completion_times": self.flow_completion_times,
+            "rtt_sketches": dict((key, sketch.state())
+                for key, sketch in self.rtt_sketches.iteritems()),
+            "queueing_delay_sketches": dict((key, sketch.state())
+                for key, sketch in self.queueing_delay_sketches.iteritems()),
+            "completion_time_sketch": self.completion_time_sketch.state(),
+        }
+        write_trace(path, series(), metadata)
+
+    @classmethod
+    def open(cls, path):
+        """Loads the data metrics saved in a trace file. The series are
+        Series whose columns are memory-mapped from the file, so they are
+        only read from disk as they are used: between() finds a time range
+        by binary search, and the plots read the windows they plot.
+
+        Args:
+            path (str): the path of the trace file.
+
+        Returns:
+            The DataMetrics of the trace.
+
+        """
+        index, series = read_trace(path)
+        data_metrics = cls()
+        data_metrics.bin_width = index.get("bin_width")
+        tables = data_metrics.tables()
+        for name, series_id, kind, times, values in series:
+            if name not in tables:
+                raise ValueError("Unknown metric %s in %s" % (name, path))
+            tables[name][series_id] = Series.from_columns(times, values,
+                ordered=True)
+        data_metrics.flow_types.update(index.get("flow_types", {}))
+        data_metrics.flow_completion_times.update(
+            index.get("flow_completion_times", {}))
+        for key, state in index.get("rtt_sketches", {}).iteritems():
+            data_metrics.rtt_sketches[key] = QuantileSketch.from_state(state)
+        for key, state in index.get("queueing_delay_sketches", {}).iteritems():
+            data_metrics.queueing_delay_sketches[key] = \
+                QuantileSketch.from_state(state)
+        if "completion_time_sketch" in index:
+            data_metrics.completion_time_sketch = QuantileSketch.from_state(
+                index["completion_time_sketch"])
+        return data_metrics
+
+    def flush(self):
+        """Records the amounts that sampled series carried forward, moves
+        staged points into the columns, and writes every point held in
+        memory to the sink if there is one. Called at the end of a run.
+
+        """
+        for table in self.tables().itervalues():
+            for series in table.itervalues():
+                series.flush()
+                if self.sink is not None:
+                    series.write()
+        if self.sink is not None:
+            self.sink.flush()
+
+    def set_flow_type(self, flow_id, flowtype):
+        """Records the congestion control algorithm of a flow."""
+        self.flow_types[flow_id] = flowtype
+
+    def flow_label(self, flow_id):
+        """Returns the legend label of a flow, with its algorithm if known."""
+        if flow_id in self.flow_types:
+            return "%s (%s)" % (flow_id, self.flow_types[flow_id])
+        return flow_id
 
     def update_buffer_occupancy(self, link_id, buffer_occupancy, time):
         """Add a buffer occupancy data point, or modify a previously added
         point.
 
+        A point at the same time as the previous one is added to it, which
+        is how buffer occupancies have always been coalesced. Binned series
+        coalesce them the same way, so plot_buffer_occupancy shows the same
+        values with or without a bin width.
+
         Args:
             link_id (str): the id of the link with the buffer occupancy.
             buffer_occupancy (int): the buffer occupancy of the link in bits.
             time (float): the time of this data point.
 
         """
-        prev_buffer_occupancy = 0
-        if link_id not in self.buffer_occupancy:
-            self.buffer_occupancy[link_id] = []
-        # If there is a previous data point with the same time, update
-        # the point.
-        elif self.buffer_occupancy[link_id][-1][0] == time:
-            prev_buffer_occupancy = self.buffer_occupancy[link_id][-1][1]
-            self.buffer_occupancy[link_id].pop()
-        data_point = (time, prev_buffer_occupancy + buffer_occupancy)
-        self.buffer_occupancy[link_id].append(data_point)
+        self.buffer_occupancy[link_id].add(time, buffer_occupancy)
 
     def update_packet_loss(self, link_id, time):
         """Add a packet loss data point, or modify a previously added point.
@@ -66,16 +308,7 @@ class DataMetrics(object):
             time (float): the time of this data point.
 
         """
-        prev_dropped_packets = 0
-        if link_id not in self.packet_loss:
-            self.packet_loss[link_id] = []
-        # If there is a previous data point with the same time, update
-        # the point.
-        elif self.packet_loss[link_id][-1][0] == time:
-            prev_dropped_packets = self.packet_loss[link_id][-1][1]
-            self.packet_loss[link_id].pop()
-        data_point = (time, prev_dropped_packets + 1)
-        self.packet_loss[link_id].append(data_point)
+        self.packet_loss[link_id].add(time, 1)
 
     def update_link_rate(self, link_id, amt_sent, time):
         """Add a link rate data point, or modify a previously added point.
@@ -86,16 +319,7 @@ class DataMetrics(object):
             time (float): the time of this data point.
 
         """
-        prev_amt_sent = 0
-        if link_id not in self.link_rate:
-            self.link_rate[link_id] = []
-        # If there is a previous data point with the same time, update
-        # the point.
-        elif self.link_rate[link_id][-1][0] == time:
-            prev_amt_sent = self.link_rate[link_id][-1][1]
-            self.link_rate[link_id].pop()
-        data_point = (time, prev_amt_sent + amt_sent)
-        self.link_rate[link_id].append(data_point)
+        self.link_rate[link_id].add(time, amt_sent)
 
     def update_flow_rate(self, flow_id, amt_sent, time):
         """Add a flow rate data point, or modify a previously added point.
@@ -106,16 +330,7 @@ class DataMetrics(object):
             time (float): the time of this data point.
 
         """
-        prev_amt_sent = 0
-        if flow_id not in self.flow_rate:
-            self.flow_rate[flow_id] = []
-        # If there is a previous data point with the same time, update
-        # the point.
-        elif self.flow_rate[flow_id][-1][0] == time:
-            prev_amt_sent = self.flow_rate[flow_id][-1][1]
-            self.flow_rate[flow_id].pop()
-        data_point = (time, prev_amt_sent + amt_sent)
-        self.flow_rate[flow_id].append(data_point)
+        self.flow_rate[flow_id].add(time, amt_sent)
 
     def update_window_size(self, flow_id, window_size, time):
         """Add a window size data point, or modify a previously added point.
@@ -126,16 +341,7 @@ class DataMetrics(object):
             time (float): the time of this data point.
 
         """
-        prev_window_size = 0
-        if flow_id not in self.window_size:
-            self.window_size[flow_id] = []
-        # If there is a previous data point with the same time, update
-        # the point.
-        elif self.window_size[flow_id][-1][0] == time:
-            prev_window_size = self.window_size[flow_id][-1][1]
-            self.window_size[flow_id].pop()
-        data_point = (time, prev_window_size + window_size)
-        self.window_size[flow_id].append(data_point)
+        self.window_size[flow_id].add(time, window_size)
 
     def record_flow_packet_delay(self, flow_id, packet_delay, time):
         """Records the roundtrip time for a packet in a flow.
@@ -146,14 +352,443 @@ class DataMetrics(object):
             time (float): the time the packet was acknowledged.
 
         """
-        if flow_id not in self.flow_packet_delay:
-            self.flow_packet_delay[flow_id] = []
-        data_point = (time, packet_delay)
-        self.flow_packet_delay[flow_id].append(data_point)
+        if "flow_packet_delay" not in self.disabled:
+            self.flow_packet_delay[flow_id].append(time, packet_delay)
+        self.rtt_sketches[flow_id].update(packet_delay)
+
+    def record_queueing_delay(self, link_id, delay):
+        """Records how long a packet waited in a link buffer.
+
+        Args:
+            link_id (str): the id of the link series.
+            delay (float): the queueing delay of the packet.
+
+        """
+        self.queueing_delay_sketches[link_id].update(delay)
+
+    def record_flow_completion(self, flow_id, duration):
+        """Records how long a flow took to complete.
+
+        Args:
+            flow_id (str): the id of the flow.
+            duration (float): the time from the start of the flow to its
+                last acknowledgement in seconds.
+
+        """
+        self.flow_completion_times[flow_id] = duration
+        self.completion_time_sketch.update(duration)
+
+    def record_flow_queueing_delay(self, link_id, flow_id, delay, time):
+        """Records how long a packet of a flow waited in a link buffer.
+
+        Args:
+            link_id (str): the id of the link series.
+            flow_id (str): the id of the flow that the packet belongs to.
+            delay (float): the queueing delay of the packet.
+            time (float): the time the packet left the buffer.
+
+        """
+        key = "%s/%s" % (link_id, flow_id)
+        if "flow_queueing_delay" not in self.disabled:
+            self.flow_queueing_delay[key].append(time, delay)
+        self.queueing_delay_sketches[link_id].update(delay)
+        self.queueing_delay_sketches[key].update(delay)
+
+    def update_flow_link_rate(self, link_id, flow_id, amt_sent, time):
+        """Add a per-flow link rate data point, or modify a previously added
+        point.
+
+        Args:
+            link_id (str): the id of the link series.
+            flow_id (str): the id of the flow the data belongs to.
+            amt_sent (float): the amount of data sent in bits.
+            time (float): the time of this data point.
+
+        """
+        key = "%s/%s" % (link_id, flow_id)
+        self.flow_link_rate[key].add(time, amt_sent)
+
+    def update_routing_packets_sent(self, router_id, amt_sent, time):
+        """Records a routing packet sent by a router.
+
+        Args:
+            router_id (str): the id of the router.
+            amt_sent (float): the size of the packet in bits.
+            time (float): the time of this data point.
+
+        """
+        self.routing_packets_sent[router_id].add(time, 1)
+        self.routing_data_sent[router_id].add(time, amt_sent)
+
+    def update_routing_packets_received(self, router_id, time):
+        """Records a routing packet received by a router."""
+        self.routing_packets_received[router_id].add(time, 1)
+
+    def update_routing_table_changes(self, router_id, num_changes, time):
+        """Records routes changed by a router.
+
+        Args:
+            router_id (str): the id of the router.
+            num_changes (int): the number of routes that changed.
+            time (float): the time of this data point.
+
+        """
+        self.routing_table_changes[router_id].add(time, num_changes)
+
+    def update_routing_loops(self, router_id, time):
+        """Records a packet found looping by a router."""
+        self.routing_loops[router_id].add(time, 1)
+
+    def record_flow_hop_count(self, flow_id, hops, time):
+        """Records the number of routers a delivered data packet went
+        through.
+
+        Args:
+            flow_id (str): the id of the flow that the packet belongs to.
+            hops (int): the number of routers that forwarded the packet.
+            time (float): the time the packet was delivered.
+
+        """
+        self.flow_hop_count[flow_id].append(time, hops)
+
+    def routing_convergence(self, period=REROUTE_PERIOD, start_time=0.0):
+        """Measures how long routing takes to converge after each routing
+        cycle.
+
+        Distance-vector routers all start their routing cycles at start_time
+        and every period after. The routing of a cycle converges when the
+        last routing table in the network stops changing before the next
+        cycle.
+
+        Args:
+            period (float): the time between routing cycles in seconds.
+            start_time (float): the time of the first routing cycle.
+
+        Returns:
+            An array of (cycle start time, convergence time) tuples, one per
+            cycle in which a route changed.
+
+        """
+        last_change = {}
+        for series in self.routing_table_changes.itervalues():
+            cycles = ((series.times - start_time) // period).astype(int)
+            for cycle, time in izip(cycles.tolist(), series.times.tolist()):
+                last_change[cycle] = max(last_change.get(cycle, time), time)
+        return [(start_time + cycle * period,
+                 last_change[cycle] - (start_time + cycle * period))
+                for cycle in sorted(last_change)]
+
+    def flow_isolation(self, link_id):
+        """Summarizes how well a fair queueing link isolates its flows.
+
+        Args:
+            link_id (str): the id of the link, or of one direction of a duplex
+                link.
+
+        Returns:
+            (stats, fairness) tuple. stats maps each flow id to a
+            (mean queueing delay in s, max queueing delay in s, throughput in
+            bits / s) tuple, where the throughput is measured while the flow
+            was sending. fairness is Jain's fairness index of the
+            throughputs, 1 when every flow gets the same share.
+
+        """
+        stats = {}
+        for key in self.flow_queueing_delay:
+            series_id, flow_id = key.rsplit("/", 1)
+            if not self.is_selected(series_id, [link_id]):
+                continue
+            delays = self.flow_queueing_delay[key]
+            if delays.count() == 0:
+                continue
+            sent = self.flow_link_rate.get(key)
+            throughput = 0.0
+            if sent is not None and len(sent) > 1 and \
+                sent.times[-1] > sent.times[0]:
+                throughput = sent.values[1:].sum() / \
+                    (sent.times[-1] - sent.times[0])
+            prev = stats.get(flow_id, (0.0, 0.0, 0.0, 0))
+            stats[flow_id] = (prev[0] + delays.total(),
+                max(prev[1], delays.maximum()), prev[2] + throughput,
+                prev[3] + delays.count())
+
+        stats = dict((flow_id, (total / count, worst, throughput))
+            for flow_id, (total, worst, throughput, count) in stats.iteritems())
+        throughputs = np.array([s[2] for s in stats.values()])
+        fairness = 0.0
+        if len(throughputs) > 0 and (throughputs ** 2).sum() > 0:
+            fairness = throughputs.sum() ** 2 / \
+                (len(throughputs) * (throughputs ** 2).sum())
+        return stats, fairness
+
+    def summarize_sketches(self, sketches, quantiles=SUMMARY_QUANTILES):
+        """Returns the quantiles and maximum of each sketch in a dict.
+
+        Args:
+            sketches (dict): QuantileSketches keyed by id.
+            quantiles (list): the quantiles to report, between 0 and 1.
+
+        Returns:
+            A dict mapping each id to a dict with a "p<percent>" key per
+            quantile, such as "p99", plus "max" and "samples".
+
+        """
+        summary = {}
+        for key, sketch in sketches.iteritems():
+            row = dict(("p%g" % (fraction * 100), value) for fraction, value
+                in zip(quantiles, sketch.quantiles(quantiles)))
+            row["max"] = sketch.max if sketch.count else None
+            row["samples"] = sketch.count
+            summary[key] = row
+        return summary
+
+    def summary(self, quantiles=SUMMARY_QUANTILES):
+        """Summarizes the round trip times and completion time of each
+        flow from the sketches, without going through the stored samples.
+
+        Args:
+            quantiles (list): the quantiles to report, between 0 and 1.
+
+        Returns:
+            A dict mapping each flow_id to a dict of round trip time
+            quantiles in seconds ("p50", "p90" and "p99" by default), the
+            largest round trip time ("max"), the number of round trip times
+            ("samples") and the completion time in seconds ("fct"), None if
+            the flow did not complete.
+
+        """
+        summary = self.summarize_sketches(self.rtt_sketches, quantiles)
+        for flow_id, row in summary.iteritems():
+            row["fct"] = self.flow_completion_times.get(flow_id)
+        return summary
+
+    def link_summary(self, quantiles=SUMMARY_QUANTILES):
+        """Summarizes the queueing delay of each link series the same way
+        summary() does the round trip times of flows.
+
+        """
+        return self.summarize_sketches(self.queueing_delay_sketches,
+            quantiles)
+
+    def merge_sketches(self, other):
+        """Merges the sketches of another DataMetrics, e.g. from another
+        run of a sweep, into this one's. Flows and links with the same id
+        are merged together.
+
+        Args:
+            other (DataMetrics): the metrics to merge in.
+
+        """
+        for mine, theirs in ((self.rtt_sketches, other.rtt_sketches),
+            (self.queueing_delay_sketches, other.queueing_delay_sketches)):
+            for key, sketch in theirs.iteritems():
+                mine[key].merge(sketch)
+        self.completion_time_sketch.merge(other.completion_time_sketch)
+
+    def is_selected(self, series_id, ids):
+        """Returns true if a link series should be plotted.
+
+        Duplex links record one series per direction, with ids of the form
+        "link_id:src->dest". Such a series is selected by its own id or by
+        the id of its link.
+
+        Args:
+            series_id (str): the id of the series.
+            ids (arr[str]): the ids to plot, or None to plot everything.
+
+        """
+        return ids is None or series_id in ids or \
+            series_id.split(":", 1)[0] in ids
+
+    # The plots render_plots() draws, in order, with the label of their y
+    # axis.
+    PLOTS = [
+        ("link_rate", 'Link Rate (Mbps)'),
+        ("buffer_occupancy", 'Buffer Occupancy (pkts)'),
+        ("packet_loss", 'Packet loss (pkts)'),
+        ("flow_rate", 'Flow Rate (Mbps)'),
+        ("flow_window_size", 'Window Size (packets)'),
+        ("flow_packet_delay", 'Packet Delay (ms)'),
+    ]
+
+    def draw(self, name, lines, path=None):
+        """Shows a plot, or writes it to a file with its lines downsampled.
+
+        Args:
+            name (str): the name of the plot in PLOTS.
+            lines (list): the (label, time, value) lines to draw.
+            path (str): if given, the file to write the plot to instead of
+                showing it, e.g. "link_rate.png" or "link_rate.svg".
+
+        """
+        ylabel = dict(self.PLOTS)[name]
+        if path is not None:
+            render_plot((path, ylabel, downsample(lines)))
+            return
+        plt.figure(figsize=PLOT_FIGURE_SIZE)
+        for _, avg_time, avg_data in lines:
+            plt.plot(avg_time, avg_data, '--', \
+                linewidth=2.0, dashes=(4, 1.5))
+        plt.legend([label for label, _, _ in lines], fontsize=30)
+        plt.xlabel('Time (s)', fontsize=30)
+        plt.ylabel(ylabel, fontsize=30)
+        plt.tick_params(labelsize=25)
+        plt.show()
+
+    def render_plots(self, directory, format="png", processes=None, \
+        max_points=PLOT_MAX_POINTS, **options):
+        """Writes the six plots to files without a display, e.g. in batch
+        jobs. The lines of every plot are computed here and downsampled to
+        max_points points each with LTTB, then the figures are drawn with
+        the Agg backend in a pool of processes.
+
+        Args:
+            directory (str): the directory to write the plots to, as
+                link_rate.png, buffer_occupancy.png, and so on.
+            format (str): the file format, e.g. "png" or "svg".
+            processes (int): the number of processes drawing the plots, by
+                default one per CPU.
+            max_points (int): the most points drawn per line, None to draw
+                every point.
+            options (dict): the arguments of each plot method by plot name,
+                e.g. link_rate={"links": ["L1", "L2"]}.
+
+        Returns:
+            The paths of the files written.
+
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        jobs = []
+        for name, ylabel in self.PLOTS:
+            lines = getattr(self, name + "_lines")(**options.get(name, {}))
+            path = os.path.join(directory, "%s.%s" % (name, format))
+            jobs.append((path, ylabel, downsample(lines, max_points)))
+        return render_plots(jobs, processes)
+
+    # The link measurements link_heatmap() can bin.
+    HEATMAP_METRICS = ("link_rate", "buffer_occupancy", "packet_loss")
+
+    def link_heatmap(self, metric="link_rate", links=None, bin_width=0.1, \
+        top=None, start=0.0, end=None):
+        """Bins a link measurement into a matrix with a row per link series
+        and a column per time bin, for topologies with too many links to
+        plot a line each.
+
+        The points of many series are binned together, up to
+        WINDOW_BLOCK_SIZE at a time, with one np.bincount over their
+        (row, bin) cells, so the cost is O(points + links x bins). Link
+        rates are in Mbps over each bin and packet losses are totals. Buffer
+        occupancies are the mean of the points in each bin, and carry over
+        the last value into bins without points, since they are only
+        recorded when they change.
+
+        Args:
+            metric (str): "link_rate", "buffer_occupancy" or "packet_loss".
+            links (arr[Link]): if links is given, only the links in the array
+                are binned.
+            bin_width (float): the width of the time bins in seconds.
+            top (int): if given, only the top links with the highest mean
+                are kept, the hottest first.
+            start (float): the start of the first bin.
+            end (float): the end of the last bin, by default the time of the
+                last point.
+
+        Returns:
+            (series_ids, edges, matrix) tuple: the series id of each row,
+            the num_bins + 1 edges of the bins and the matrix.
+
+        """
+        if metric not in self.HEATMAP_METRICS:
+            raise Exception("No heatmap of %s" % metric)
+        table = getattr(self, metric)
+        series_ids = [series_id for series_id in sorted(table)
+            if self.is_selected(series_id, links) and len(table[series_id])]
+        columns = [table[series_id].columns() for series_id in series_ids]
+        if end is None:
+            end = max([times[-1] for times, _ in columns] + [start])
+        num_bins = max(int(np.ceil((end - start) / bin_width)), 1)
+        edges = start + np.arange(num_bins + 1) * bin_width
+        size = len(series_ids) * num_bins
+        sums = np.zeros(size)
+        counts = np.zeros(size)
+
+        def add(rows, batch):
+            times = np.concatenate([column for column, _ in batch])
+            values = np.concatenate([column for _, column in batch])
+            rows = np.repeat(rows, [len(column) for column, _ in batch])
+            inside = (times >= start) & (times <= end)
+            # Floor division puts some times on an edge in the bin before.
+            bins = np.minimum(np.searchsorted(edges, times[inside],
+                side='right') - 1, num_bins - 1)
+            cells = rows[inside] * num_bins + bins
+            sums[:] += np.bincount(cells, values[inside], size)
+            counts[:] += np.bincount(cells, minlength=size)
+
+        rows = []
+        batch = []
+        num_points = 0
+        for row, (times, values) in enumerate(columns):
+            rows.append(row)
+            batch.append((times, values))
+            num_points += len(times)
+            if num_points >= WINDOW_BLOCK_SIZE:
+                add(rows, batch)
+                rows = []
+                batch = []
+                num_points = 0
+        if batch:
+            add(rows, batch)
+
+        matrix = sums.reshape(len(series_ids), num_bins)
+        if metric == "link_rate":
+            matrix *= BIT_TO_MEGABIT / bin_width
+        elif metric == "buffer_occupancy":
+            counts = counts.reshape(matrix.shape)
+            means = matrix / np.maximum(counts, 1)
+            # The last bin with points at or before each bin. Bins before
+            # the first point take the empty bin 0, whose mean is 0.
+            last = np.where(counts > 0, np.arange(num_bins), 0)
+            last = np.maximum.accumulate(last, axis=1)
+            matrix = means[np.arange(len(series_ids))[:, np.newaxis], last]
+
+        if top is not None and top < len(series_ids):
+            scores = matrix.mean(axis=1)
+            hot = np.argpartition(-scores, top - 1)[:top]
+            hot = hot[np.argsort(-scores[hot], kind='mergesort')]
+            series_ids = [series_ids[row] for row in hot]
+            matrix = matrix[hot]
+        return series_ids, edges, matrix
+
+    def plot_link_heatmap(self, metric="link_rate", links=None, \
+        bin_width=0.1, top=HEATMAP_TOP_LINKS, path=None):
+        """Plots a link measurement as a link x time heatmap, see
+        link_heatmap().
+
+        Args:
+            metric (str): "link_rate", "buffer_occupancy" or "packet_loss".
+            links (arr[Link]): if links is given, only the links in the array
+            will be plotted.
+            bin_width (float): the width of the time bins in seconds.
+            top (int): the number of links with the highest mean to plot,
+            None to plot every link.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
+
+        """
+        series_ids, edges, matrix = \
+            self.link_heatmap(metric, links, bin_width, top)
+        label = dict(self.PLOTS)[metric]
+        if path is not None:
+            render_heatmap((path, series_ids, edges, matrix, label))
+            return
+        figure = plt.figure(figsize=PLOT_FIGURE_SIZE)
+        draw_heatmap(figure, series_ids, edges, matrix, label)
+        plt.show()
 
     # Tip: Do window_size = 0.1 for test case 2.
     def plot_buffer_occupancy(self, links=None, window_size=0.1, \
-        sliding_window=10):
+        sliding_window=10, path=None):
         """Plots the buffer occupancy of packets in link buffers.
 
         Args:
@@ -161,31 +796,32 @@ class DataMetrics(object):
             will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+        self.draw("buffer_occupancy", self.buffer_occupancy_lines(links, \
+            window_size, sliding_window), path)
+
+    def buffer_occupancy_lines(self, links=None, window_size=0.1, \
+        sliding_window=10):
+        """Returns the (label, time, value) lines of plot_buffer_occupancy."""
+        lines = []
         for link_id in sorted(self.buffer_occupancy):
-            if links is None or link_id in links:
-                all_data = np.array(sorted(self.buffer_occupancy[link_id]))
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+            if self.is_selected(link_id, links):
+                series = self.buffer_occupancy[link_id]
+                if len(series) > 0:
+                    time, data = series.columns()
                     avg_time, avg_data = \
                         self.window_average(time, data, window_size)
                     if sliding_window > 1:
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_data = self.moving_average(avg_data, sliding_window)
-                    plt.plot(avg_time, avg_data, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(link_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Buffer Occupancy (pkts)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((link_id, avg_time, avg_data))
+        return lines
 
-    def plot_flow_rate(self, flows=None, window_size=0.1, sliding_window=5):
+    def plot_flow_rate(self, flows=None, window_size=0.1, sliding_window=5, \
+        path=None):
         """Plots the flow rate of flows in the simulation.
 
         Args:
@@ -193,32 +829,32 @@ class DataMetrics(object):
             will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+        self.draw("flow_rate", self.flow_rate_lines(flows, window_size, \
+            sliding_window), path)
+
+    def flow_rate_lines(self, flows=None, window_size=0.1, sliding_window=5):
+        """Returns the (label, time, value) lines of plot_flow_rate."""
+        lines = []
         for flow_id in sorted(self.flow_rate):
             if flows is None or flow_id in flows:
-                all_data = np.array(sorted(self.flow_rate[flow_id]))
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+                series = self.flow_rate[flow_id]
+                if len(series) > 0:
+                    time, data = series.columns()
                     avg_time, avg_rate = \
                         self.window_rate(time, data, window_size)
                     if sliding_window > 1:
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_rate = self.moving_average(avg_rate, sliding_window)
                     avg_rate *= BIT_TO_MEGABIT
-                    plt.plot(avg_time, avg_rate, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(flow_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Flow Rate (Mbps)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((self.flow_label(flow_id), avg_time, avg_rate))
+        return lines
 
-    def plot_link_rate(self, links=None, window_size=0.1, sliding_window=5):
+    def plot_link_rate(self, links=None, window_size=0.1, sliding_window=5, \
+        path=None):
         """Plots the link rate of links in the simulation.
 
         Args:
@@ -226,17 +862,21 @@ class DataMetrics(object):
             will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
+        self.draw("link_rate", self.link_rate_lines(links, window_size, \
+            sliding_window), path)
 
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+    def link_rate_lines(self, links=None, window_size=0.1, sliding_window=5):
+        """Returns the (label, time, value) lines of plot_link_rate."""
+        lines = []
         for link_id in sorted(self.link_rate):
-            if links is None or link_id in links:
-                all_data = np.array(sorted(self.link_rate[link_id]))
-
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+            if self.is_selected(link_id, links):
+                series = self.link_rate[link_id]
+                if len(series) > 0:
+                    time, data = series.columns()
 
                     avg_time, avg_rate = \
                         self.window_rate(time, data, window_size)
@@ -244,17 +884,11 @@ class DataMetrics(object):
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_rate = self.moving_average(avg_rate, sliding_window)
                     avg_rate *= BIT_TO_MEGABIT
-                    plt.plot(avg_time, avg_rate, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(link_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Link Rate (Mbps)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((link_id, avg_time, avg_rate))
+        return lines
 
-    def plot_packet_loss(self, links=None, window_size=0.01, sliding_window=10):
+    def plot_packet_loss(self, links=None, window_size=0.01, \
+        sliding_window=10, path=None):
         """Plots the packet loss on each link in the simulation.
 
         Args:
@@ -262,32 +896,32 @@ class DataMetrics(object):
             the array will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+        self.draw("packet_loss", self.packet_loss_lines(links, window_size, \
+            sliding_window), path)
+
+    def packet_loss_lines(self, links=None, window_size=0.01, \
+        sliding_window=10):
+        """Returns the (label, time, value) lines of plot_packet_loss."""
+        lines = []
         for link_id in sorted(self.packet_loss):
-            if links is None or link_id in links:
-                all_data = np.array(sorted(self.packet_loss[link_id]))
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+            if self.is_selected(link_id, links):
+                series = self.packet_loss[link_id]
+                if len(series) > 0:
+                    time, data = series.columns()
                     avg_time, avg_data = \
                         self.window_sum(time, data, window_size)
                     if sliding_window > 1:
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_data = self.moving_average(avg_data, sliding_window)
-                    plt.plot(avg_time, avg_data, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(link_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Packet loss (pkts)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((link_id, avg_time, avg_data))
+        return lines
 
     def plot_flow_packet_delay(self, flows=None, window_size=0.02, \
-        sliding_window=10):
+        sliding_window=10, path=None):
         """Plots the round trip time of packets on each of the flows in the
         simulation.
 
@@ -296,33 +930,33 @@ class DataMetrics(object):
             will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+        self.draw("flow_packet_delay", self.flow_packet_delay_lines(flows, \
+            window_size, sliding_window), path)
+
+    def flow_packet_delay_lines(self, flows=None, window_size=0.02, \
+        sliding_window=10):
+        """Returns the (label, time, value) lines of plot_flow_packet_delay."""
+        lines = []
         for flow_id in sorted(self.flow_rate):
-            if flows is None or flow_id in links:
-                all_data = np.array(sorted(self.flow_packet_delay[flow_id]))
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+            if flows is None or flow_id in flows:
+                series = self.flow_packet_delay[flow_id]
+                if len(series) > 0:
+                    time, data = series.columns()
                     avg_time, avg_data = self.window_average(time, data, \
                         window_size, zero_fill=False)
                     if sliding_window > 1:
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_data = self.moving_average(avg_data, sliding_window)
                     avg_data *= S_TO_MS
-                    plt.plot(avg_time, avg_data, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(flow_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Packet Delay (ms)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((self.flow_label(flow_id), avg_time, avg_data))
+        return lines
 
     def plot_flow_window_size(self, flows=None, window_size=0.1, \
-        sliding_window=5):
+        sliding_window=5, path=None):
         """Plots the window size of flows in the simulation.
 
         Args:
@@ -330,77 +964,118 @@ class DataMetrics(object):
             will be plotted.
             window_size (float): The window size of the graph in seconds.
             sliding_window (int): Number of points in each sliding window.
+            path (str): if given, the plot is written to this file instead of
+            being shown.
 
         """
-        legend_labels = []
-        plt.figure(figsize=(30, 9))
+        self.draw("flow_window_size", self.flow_window_size_lines(flows, \
+            window_size, sliding_window), path)
+
+    def flow_window_size_lines(self, flows=None, window_size=0.1, \
+        sliding_window=5):
+        """Returns the (label, time, value) lines of plot_flow_window_size."""
+        lines = []
         for flow_id in sorted(self.flow_rate):
-            if flows is None or flow_id in links:
-                all_data = np.array(sorted(self.window_size[flow_id]))
-                if len(all_data) > 0:
-                    time, data = np.array(zip(*all_data))
+            if flows is None or flow_id in flows:
+                series = self.window_size[flow_id]
+                if len(series) > 0:
+                    time, data = series.columns()
                     avg_time, avg_data = \
                         self.window_average(time, data, window_size)
                     if sliding_window > 1:
                         avg_time = self.moving_average(avg_time, sliding_window)
                         avg_data = self.moving_average(avg_data, sliding_window)
-                    plt.plot(avg_time, avg_data, '--', \
-                        linewidth=2.0, dashes=(4, 1.5))
-                    legend_labels.append(flow_id)
-
-        plt.legend(legend_labels, fontsize=30)
-        plt.xlabel('Time (s)', fontsize=30)
-        plt.ylabel('Window Size (packets)', fontsize=30)
-        plt.tick_params(labelsize=25)
-        plt.show()
+                    lines.append((self.flow_label(flow_id), avg_time, avg_data))
+        return lines
 
     def prep_data(self, time, data, window_size, zero_fill):
-        """ Prep the time and data arrays such that each row of the resulting
-        arrays represents all the points in each window.
+        """Splits the time and data arrays into windows, returning for each
+        window the average time, the sum of the data and the number of data
+        points in it, as three arrays.
+
+        The first point is returned on its own so that it is plotted without
+        taking the average, and also counts towards the first window. Windows
+        start at the first point and are closed on the right. A window with
+        no data points is left out, or becomes a data point with value 0 at
+        the middle of the window if zero_fill is true.
 
         Args:
-            time (arr): the time array of the data.
+            time (arr): the time array of the data, sorted.
             data (arr): the data array.
             window_size (float): the window size of the graph in seconds.
             zero_fill (bool): if true, windows with no data points will be
                 augmented with a data point with value 0.
 
         """
-        reshaped_time = []
-        reshaped_data = []
-
-        times_in_window = []
-        data_in_window = []
-
+        time = np.asarray(time, dtype=float)
+        data = np.asarray(data, dtype=float)
         min_time = time[0]
         max_time = time[-1]
 
-        cur_window = min_time
+        # Window edges are accumulated one window at a time, so that points
+        # fall on the same side of an edge as they always have.
+        num_edges = int((max_time - min_time) / window_size) + 2
+        edges = None
+        while edges is None or edges[-1] < max_time:
+            steps = np.empty(num_edges + 1)
+            steps[0] = min_time
+            steps[1:] = window_size
+            edges = np.cumsum(steps)
+            num_edges *= 2
+
+        # Long series, such as memory-mapped ones, are binned a block of
+        # whole windows at a time, so that no temporary array is as long as
+        # the series.
+        blocks = []
+        start = 0
+        num_points = len(time)
+        while start < num_points:
+            stop = min(start + WINDOW_BLOCK_SIZE, num_points)
+            if stop < num_points:
+                window = np.searchsorted(edges[1:], time[stop - 1])
+                stop = np.searchsorted(time, edges[window + 1], side='right')
+            blocks.append(self._window_sums(time[start:stop],
+                data[start:stop], edges))
+            start = stop
+        window_ids, time_sums, data_sums, counts = \
+            [np.concatenate(column) for column in zip(*blocks)]
+
+        if zero_fill:
+            num_windows = window_ids[-1] + 1
+            avg_time = edges[1:num_windows + 1] - window_size / 2
+            avg_time[window_ids] = time_sums / counts
+            sums = np.zeros(num_windows)
+            sums[window_ids] = data_sums
+            window_counts = np.ones(num_windows, dtype=int)
+            window_counts[window_ids] = counts
+        else:
+            avg_time = time_sums / counts
+            sums = data_sums
+            window_counts = counts
 
         # plot first point without taking the average.
-        reshaped_time.append(time[0])
-        reshaped_data.append(data[0])
-
-        for i in range(len(time)):
-            while time[i] > cur_window + window_size:
-                cur_window += window_size
-                if len(data_in_window) == 0 and zero_fill:
-                    times_in_window.append(cur_window - window_size / 2)
-                    data_in_window.append(0)
-
-                if len(data_in_window) > 0:
-                    reshaped_time.append(times_in_window)
-                    reshaped_data.append(data_in_window)
+        avg_time = np.concatenate(([time[0]], avg_time))
+        sums = np.concatenate(([data[0]], sums))
+        window_counts = np.concatenate(([1], window_counts))
+        return avg_time, sums, window_counts
 
-                times_in_window = []
-                data_in_window = []
+    def _window_sums(self, time, data, edges):
+        """Returns the window number, time sum, data sum and number of points
+        of each window of a block of points that has points in it.
 
-            times_in_window.append(time[i])
-            data_in_window.append(data[i])
-        reshaped_time.append(times_in_window)
-        reshaped_data.append(data_in_window)
-
-        return reshaped_time, reshaped_data
+        """
+        windows = np.searchsorted(edges[1:], time)
+        starts = np.flatnonzero(np.diff(windows)) + 1
+        starts = np.concatenate(([0], starts))
+        counts = np.diff(np.append(starts, len(time)))
+        # Each window is summed from 0 like np.sum does, which gives the
+        # same rounding as summing the windows one at a time.
+        padded_starts = starts + np.arange(len(starts))
+        time_sums = np.add.reduceat(np.insert(time, starts, 0.0),
+            padded_starts)
+        data_sums = np.add.reduceat(np.insert(data, starts, 0.0),
+            padded_starts)
+        return windows[starts], time_sums, data_sums, counts
 
     def window_average(self, time, data, window_size, zero_fill=True):
         """Transforms the time and data arrays into averages over each
@@ -414,11 +1089,9 @@ class DataMetrics(object):
                 augmented with a data point with value 0.
 
         """
-        reshaped_time, reshaped_data = \
+        avg_time, sums, counts = \
             self.prep_data(time, data, window_size, zero_fill)
-        avg_time = np.array([np.mean(a) for a in reshaped_time])
-        avg_data = np.array([np.mean(a) for a in reshaped_data])
-        return avg_time, avg_data
+        return avg_time, sums / counts
 
     def window_sum(self, time, data, window_size, zero_fill=True):
         """Transforms the time and data arrays into sums over each
@@ -432,11 +1105,9 @@ class DataMetrics(object):
                 augmented with a data point with value 0.
 
         """
-        reshaped_time, reshaped_data = \
+        avg_time, sums, counts = \
             self.prep_data(time, data, window_size, zero_fill)
-        avg_time = np.array([np.mean(a) for a in reshaped_time])
-        window_data = np.array([np.sum(a) for a in reshaped_data])
-        return avg_time, window_data
+        return avg_time, sums
 
     def window_rate(self, time, data, window_size, zero_fill=True):
         """Transforms the time and data arrays into rates (sums over change
@@ -450,15 +1121,9 @@ class DataMetrics(object):
                 augmented with a data point with value 0.
 
         """
-        reshaped_time, reshaped_data = \
+        avg_time, sums, counts = \
             self.prep_data(time, data, window_size, zero_fill)
-        sum_data = np.array([np.sum(a) for a in reshaped_data])
-
-        max_time = time[-1]
-        avg_rate = sum_data * 1.0 / window_size
-        avg_time = np.array([np.mean(a) for a in reshaped_time])
-
-        return avg_time, avg_rate
+        return avg_time, sums * 1.0 / window_size
 
     def moving_average(self, x, sliding_window=10):
         """Transforms the data into moving averages over the specified sliding
@@ -0,0 +1,269 @@
+from collections import deque
+
+from constants import *
+from indexedheap import IndexedMinHeap
+from queuedisc import ACCEPT, MARK, make_queue_discipline
+
+class FlowQueue(object):
+    """The sub-queue of a single flow in a FairQueue.
+
+    Attributes:
+        flow_id (string): the flow whose packets are queued
+        refs (Deque): packet references in arrival order
+        enqueue_times (Deque): the arrival time of each queued packet
+        size (float): the amount of data queued in bits
+        deficit (float): how many bits the flow may still send this round
+        discipline (QueueDiscipline): the flow's own queue discipline
+        listed (bool): true while the flow is in the new or old flow list
+
+    """
+
+    __slots__ = ('flow_id', 'refs', 'enqueue_times', 'size', 'deficit',
+                 'discipline', 'listed')
+
+    def __init__(self, flow_id, discipline):
+        self.flow_id = flow_id
+        self.refs = deque()
+        self.enqueue_times = deque()
+        self.size = 0.0
+        self.deficit = 0.0
+        self.discipline = discipline
+        self.listed = False
+
+
+class FairQueue(object):
+    """A deficit round robin scheduler over per-flow sub-queues, keyed by
+    packet.flow_id, following FQ-CoDel (RFC 8290).
+
+    Flows that just became active are served from the new flow list before
+    the flows in the old flow list, so sparse flows see little queueing
+    delay. Each visit gives a flow a quantum of bits to send. The size of
+    every flow is also kept in an indexed heap, which enqueueing and
+    dequeueing update in O(log flows), so that when the whole buffer
+    overflows the fattest flow is found in constant time and its head
+    packet dropped.
+
+    A flow's sub-queue is reclaimed as soon as it is empty and leaves the old
+    flow list, so idle flows hold no state.
+
+    Attributes:
+        link (Link): the link whose buffer is scheduled
+        packets (PacketStore): the simulator's packet backend
+        drop (func): called as drop(packet, reason) with every queued packet
+            the scheduler drops
+        quantum (float): the bits a flow may send each round
+        queue (string or dict): the description of the queue discipline
+            given to each flow, see make_queue_discipline
+        discipline_name (string): the class name of that queue discipline
+        flows (dict): the sub-queue of every active flow
+        sizes (IndexedMinHeap): the negated size of every active flow, by
+            flow_id, so that its minimum is the fattest flow
+        new_flows (Deque): flows that became active this round
+        old_flows (Deque): the other active flows
+        size (float): the amount of data queued in bits
+        num_packets (int): the number of packets queued
+
+    """
+
+    def __init__(self, link, drop, quantum=FQ_QUANTUM, queue=None):
+        self.link = link
+        self.packets = link.packets
+        self.drop = drop
+        self.quantum = quantum
+        self.queue = queue
+        self.discipline_name = \
+            type(make_queue_discipline(link, queue)).__name__
+
+        self.flows = {}
+        self.sizes = IndexedMinHeap()
+        self.new_flows = deque()
+        self.old_flows = deque()
+        self.size = 0.0
+        self.num_packets = 0
+
+    def __len__(self):
+        return self.num_packets
+
+    def enqueue(self, packet, destination, now, limit):
+        """Adds a packet to the sub-queue of its flow.
+
+        Args:
+            packet (Packet): the arriving packet
+            destination (Node): the node the packet is travelling to
+            now (float): the current time
+            limit (float): the amount of data the scheduler may hold in bits
+
+        Returns:
+            accepted (bool): false if the flow's queue discipline rejects the
+                packet, which the caller must then drop.
+
+        """
+        flow = self.flows.get(packet.flow_id)
+        if flow is None:
+            flow = FlowQueue(packet.flow_id,
+                make_queue_discipline(self.link, self.queue))
+            self.flows[packet.flow_id] = flow
+            self.sizes[packet.flow_id] = 0.0
+
+        verdict = flow.discipline.enqueue(packet, flow.size, len(flow.refs),
+            now)
+        if verdict == MARK and packet.ecn != ECN_NOT_ECT:
+            packet.ecn = ECN_CE
+        elif verdict != ACCEPT:
+            if not flow.listed:
+                del self.flows[flow.flow_id]
+                del self.sizes[flow.flow_id]
+            return False
+
+        # The store may recycle the packet, so read it before.
+        packet_size = packet.packet_size
+        flow.refs.append(self.packets.put(packet, destination))
+        flow.enqueue_times.append(now)
+        flow.size += packet_size
+        self.sizes[flow.flow_id] = -flow.size
+        self.size += packet_size
+        self.num_packets += 1
+
+        if not flow.listed:
+            flow.listed = True
+            flow.deficit = self.quantum
+            self.new_flows.append(flow)
+
+        while self.size > limit:
+            self.drop_fattest()
+        return True
+
+    def drop_reason(self, packet):
+        """Returns "full" if enqueue() rejected the packet because it did
+        not fit in the sub-queue of its flow, or the name of the queue
+        discipline otherwise. A flow without a sub-queue had nothing queued.
+
+        """
+        flow = self.flows.get(packet.flow_id)
+        if flow is not None and not flow.discipline.fits(packet, flow.size):
+            return "full"
+        return self.discipline_name
+
+    def drop_fattest(self):
+        """Drops the head packet of the flow with the most queued data."""
+        flow_id, _ = self.sizes.min()
+        self._remove_head(self.flows[flow_id], "full")
+
+    def _remove_head(self, flow, reason):
+        """Removes and drops the head packet of a flow."""
+        ref = flow.refs.popleft()
+        flow.enqueue_times.popleft()
+        packet_size = self.packets.packet_size(ref)
+        flow.size -= packet_size
+        self.sizes[flow.flow_id] = -flow.size
+        self.size -= packet_size
+        self.num_packets -= 1
+        packet, destination = self.packets.take(ref)
+        self.drop(packet, reason)
+
+    def dequeue(self, now):
+        """Picks the next packet to transmit.
+
+        Args:
+            now (float): the current time
+
+        Returns:
+            None if no packet is queued, otherwise a (ref, flow_id,
+            sojourn_time) tuple for the packet to transmit.
+
+        """
+        new_flows = self.new_flows
+        old_flows = self.old_flows
+        while True:
+            if new_flows:
+                flows = new_flows
+            elif old_flows:
+                flows = old_flows
+            else:
+                return None
+            flow = flows[0]
+
+            if flow.deficit <= 0:
+                flow.deficit += self.quantum
+                flows.popleft()
+                old_flows.append(flow)
+                continue
+
+            item = self._dequeue_flow(flow, now)
+            if item is None:
+                flows.popleft()
+                if flows is new_flows:
+                    # Keep the flow for one more round so that a flow
+                    # alternating between empty and active cannot stay in
+                    # the new flow list.
+                    old_flows.append(flow)
+                else:
+                    flow.listed = False
+                    del self.flows[flow.flow_id]
+                    del self.sizes[flow.flow_id]
+                continue
+
+            flow.deficit -= self.packets.packet_size(item[0])
+            return item
+
+    def _dequeue_flow(self, flow, now):
+        """Pops the head packet of a flow, letting the flow's queue
+        discipline drop or mark it first.
+
+        """
+        discipline = flow.discipline
+        while flow.refs:
+            sojourn_time = now - flow.enqueue_times[0]
+            ref = flow.refs[0]
+            packet_size = self.packets.packet_size(ref)
+            if discipline.decides_on_dequeue:
+                verdict = discipline.dequeue(sojourn_time,
+                    flow.size - packet_size, now)
+                if verdict != ACCEPT and \
+                    not (verdict == MARK and self.packets.mark_ecn(ref)):
+                    self._remove_head(flow, type(discipline).__name__)
+                    continue
+
+            flow.refs.popleft()
+            flow.enqueue_times.popleft()
+            flow.size -= packet_size
+            self.sizes[flow.flow_id] = -flow.size
+            self.size -= packet_size
+            self.num_packets -= 1
+            return ref, flow.flow_id, sojourn_time
+        return None
+
+
+def scheduler_type(spec):
+    """Returns the name of the scheduler described by spec, see
+    make_fair_queue.
+
+    """
+    if isinstance(spec, dict):
+        spec = spec.get("type")
+    name = (spec or "fifo").lower()
+    if name not in ("fifo", "drr", "fq_codel"):
+        raise Exception("Unknown scheduler %s" % name)
+    return name
+
+def make_fair_queue(link, drop, spec, queue=None):
+    """Creates the scheduler of a link buffer from its description.
+
+    Args:
+        link (Link): the link whose buffer is scheduled.
+        drop (func): called as drop(packet, reason) with every dropped packet.
+        spec (str or dict): the name of the scheduler, "drr" or "fq_codel",
+            or a dict with the name under "type" and an optional "quantum"
+            in bytes. "fq_codel" is "drr" with a CoDel discipline on each
+            flow unless queue says otherwise.
+        queue (str or dict): the queue discipline given to each flow.
+
+    """
+    name = scheduler_type(spec)
+    assert name != "fifo"
+    if name == "fq_codel" and queue is None:
+        queue = "codel"
+    quantum = FQ_QUANTUM
+    if isinstance(spec, dict) and "quantum" in spec:
+        quantum = spec["quantum"] * BYTE_TO_BIT
+    return FairQueue(link, drop, quantum, queue)
@@ -11,6 +11,9 @@ class FAST_TCP(Flow):
         last_rtt (float): The round trip time of the last acknowledged packet
         base_rtt (float): The shortest round trip time of all acknowledged
                            packets
+        slot (int): The flow's slot in the simulator's FastTcpTicker, which
+            holds the flow's window size, last_rtt and base_rtt while the
+            flow is active. None once the flow is done.
 
     Inherited Attributes:
         ns (NetworkSimulator): Instance of the NetworkSimulator class
@@ -30,14 +33,56 @@ class FAST_TCP(Flow):
 
     """
 
-    def __init__(self, ns, flow_id, src, dest, data_amount, start_time):
-        Flow.__init__(self, ns, flow_id, src, dest, data_amount, start_time)
-        self._gamma = FAST_GAMMA
-        self._alpha = FAST_ALPHA
+    def __init__(self, ns, flow_id, src, dest, data_amount, start_time,
+                 pacing=False):
+        self.slot = None
         self.last_rtt = float('inf')
         self.base_rtt = float('inf')
+        Flow.__init__(self, ns, flow_id, src, dest, data_amount, start_time,
+            pacing)
+        self._gamma = FAST_GAMMA
+        self._alpha = FAST_ALPHA
 
-        self.schedule_next_update()
+        self.ns.fast_tcp_ticker.register(self)
+
+    @property
+    def window_size(self):
+        if self.slot is None:
+            return self._window_size
+        return float(self.ns.fast_tcp_ticker.window_size[self.slot])
+
+    @window_size.setter
+    def window_size(self, window_size):
+        if self.slot is None:
+            self._window_size = window_size
+        else:
+            self.ns.fast_tcp_ticker.window_size[self.slot] = window_size
+
+    @property
+    def last_rtt(self):
+        if self.slot is None:
+            return self._last_rtt
+        return float(self.ns.fast_tcp_ticker.last_rtt[self.slot])
+
+    @last_rtt.setter
+    def last_rtt(self, rtt):
+        if self.slot is None:
+            self._last_rtt = rtt
+        else:
+            self.ns.fast_tcp_ticker.last_rtt[self.slot] = rtt
+
+    @property
+    def base_rtt(self):
+        if self.slot is None:
+            return self._base_rtt
+        return float(self.ns.fast_tcp_ticker.base_rtt[self.slot])
+
+    @base_rtt.setter
+    def base_rtt(self, rtt):
+        if self.slot is None:
+            self._base_rtt = rtt
+        else:
+            self.ns.fast_tcp_ticker.base_rtt[self.slot] = rtt
 
     @property
     def gamma(self):
@@ -67,7 +112,7 @@ class FAST_TCP(Flow):
         rtt = self.ns.cur_time - a_packet.timestamp
         self.last_rtt = rtt
         self.base_rtt = min(self.base_rtt, rtt)
-        self.ns.record_packet_rtt_time(self.flow_id, rtt)
+        self.measure_rtt(rtt)
 
         if a_packet.packet_id > self.first_unacknowledged:
             self.first_unacknowledged = a_packet.packet_id
@@ -75,39 +120,15 @@ class FAST_TCP(Flow):
             self.check_flow_completion()
             self.send_packets()
 
-    def time_out(self, packet_id):
-        """Method where, if sent packet is still unacknowledged after a period
-        of time, packet is considered lost.  Packet is then resent.
+    def check_flow_completion(self):
+        """Checks if all packets have been acknowledged, and if so stops the
+        flow's window size updates.
 
-        Args:
-            packet_id (int): packet_id of packet checking if timed out.
-                                    
         """
-        if packet_id in self.canceled_timeouts:
-            self.canceled_timeouts.remove(packet_id)
-        elif packet_id in self.unacknowledged_packets:
-            self.create_packet(packet_id)
-
-    def update_window_size(self):
-        """Updates the window size periodically according to the FAST-TCP 
-        algorithm.
+        Flow.check_flow_completion(self)
+        if self.is_done() and self.slot is not None:
+            self.ns.fast_tcp_ticker.deregister(self)
 
-        """
-        if self.last_rtt < float('inf'):
-            self.window_size = min(2 * self.window_size, \
-                (1 - self.gamma) * self.window_size + \
-                self.gamma * (self.base_rtt / self.last_rtt * self.window_size \
-                    + self.alpha))
-            self.record_window_size()
-
-        self.schedule_next_update()
-
-    def schedule_next_update(self):
-        """Schedules the next window size update in the network simulator."""
-
-        next_update_event = lambda: self.update_window_size()
-        next_description = \
-            "FAST_TCP.update_window_size on flow %s" % self.flow_id
-        self.ns.add_event(next_update_event,
-            next_description,
-            delay=FAST_WINDOW_UPDATE_PERIOD)
\ No newline at end of file
+    def react_to_ecn(self):
+        """FAST TCP is delay based, so ECN echoes do not change its window."""
+        pass
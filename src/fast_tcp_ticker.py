@@ -0,0 +1,118 @@
+import numpy as np
+
+from constants import *
+
+class FastTcpTicker(object):
+    """A single periodic event that updates the window size of every active
+    FAST TCP flow at once.
+
+    The window size, base RTT and last RTT of each registered flow live in
+    NumPy arrays, and each FAST_TCP reads and writes its own slot in them, so
+    a tick updates all the windows with a few vectorized operations. A flow
+    is deregistered when it completes: its state is copied back into the
+    flow and the last flow is moved into its slot. The ticker stops when no
+    flow is left and restarts when the next one registers.
+
+    Attributes:
+        ns (NetworkSimulator): the simulator the flows belong to
+        period (float): the time between window size updates in seconds
+        flows (list): the registered flows, indexed by slot
+        window_size (ndarray): the window size of each slot
+        base_rtt (ndarray): the shortest RTT of each slot
+        last_rtt (ndarray): the RTT of the last acknowledgement of each slot
+        running (bool): true while a tick is scheduled
+
+    """
+
+    def __init__(self, ns, period=FAST_WINDOW_UPDATE_PERIOD, capacity=16):
+        self.ns = ns
+        self.period = period
+        self.flows = []
+        self.window_size = np.empty(capacity)
+        self.base_rtt = np.empty(capacity)
+        self.last_rtt = np.empty(capacity)
+        self.running = False
+
+    def __len__(self):
+        return len(self.flows)
+
+    def _grow(self):
+        """Doubles the capacity of the state arrays."""
+        capacity = 2 * len(self.window_size)
+        for name in ("window_size", "base_rtt", "last_rtt"):
+            column = getattr(self, name)
+            grown = np.empty(capacity)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def register(self, flow):
+        """Moves a flow's window state into a free slot and starts ticking if
+        the ticker was idle.
+
+        Args:
+            flow (FAST_TCP): the flow to update every period.
+
+        """
+        assert flow.slot is None
+        slot = len(self.flows)
+        if slot == len(self.window_size):
+            self._grow()
+        self.window_size[slot] = flow.window_size
+        self.base_rtt[slot] = flow.base_rtt
+        self.last_rtt[slot] = flow.last_rtt
+        self.flows.append(flow)
+        flow.slot = slot
+
+        if not self.running:
+            self.running = True
+            self.schedule_next_tick()
+
+    def deregister(self, flow):
+        """Hands a flow's window state back to the flow and frees its slot.
+
+        Args:
+            flow (FAST_TCP): a registered flow.
+
+        """
+        slot = flow.slot
+        flow.slot = None
+        flow.window_size = float(self.window_size[slot])
+        flow.base_rtt = float(self.base_rtt[slot])
+        flow.last_rtt = float(self.last_rtt[slot])
+
+        last = len(self.flows) - 1
+        moved = self.flows.pop()
+        if slot != last:
+            self.flows[slot] = moved
+            moved.slot = slot
+            self.window_size[slot] = self.window_size[last]
+            self.base_rtt[slot] = self.base_rtt[last]
+            self.last_rtt[slot] = self.last_rtt[last]
+
+    def schedule_next_tick(self):
+        """Schedules the next window size update in the network simulator."""
+        event = lambda: self.tick()
+        self.ns.add_event(event, "FastTcpTicker.tick", delay=self.period)
+
+    def tick(self):
+        """Updates the window size of every registered flow that has measured
+        an RTT according to the FAST TCP algorithm, records the new window
+        sizes, and schedules the next tick while flows remain.
+
+        """
+        num_flows = len(self.flows)
+        if num_flows == 0:
+            self.running = False
+            return
+
+        slots = np.flatnonzero(self.last_rtt[:num_flows] < float('inf'))
+        if len(slots):
+            window_size = self.window_size[slots]
+            self.window_size[slots] = np.minimum(2 * window_size,
+                (1 - FAST_GAMMA) * window_size +
+                FAST_GAMMA * (self.base_rtt[slots] / self.last_rtt[slots] *
+                    window_size + FAST_ALPHA))
+            for slot in slots:
+                self.flows[slot].record_window_size()
+
+        self.schedule_next_tick()
@@ -27,9 +27,20 @@ class Flow(object):
         ssthreshold (float): The slow-start threshold
         unreceived_packets (list): List of ids of packets that haven't been
             received yet
+        ecn_recover (int): The packet id that must be acknowledged before the
+            flow reacts to another ECN echo, so it reacts once per window
+        srtt (float): The smoothed round trip time, None until the first
+            acknowledgement
+        pacing (bool): True if packets are released through a token bucket
+            at the pacing rate instead of a window at a time
+        tokens (float): The packets the token bucket may release right away
+        tokens_time (float): When the token bucket was last refilled
+        pacing_timer (float): The time of the pending event that releases the
+            next paced packet, None if there is none
 
     """
-    def __init__(self, ns, flow_id, src, dest, data_amount, start_time):
+    def __init__(self, ns, flow_id, src, dest, data_amount, start_time,
+                 pacing=False):
         self.ns = ns
         self._flow_id = flow_id
         self._src = src
@@ -44,6 +55,12 @@ class Flow(object):
         self.canceled_timeouts = []
         self.ssthreshold = sys.maxint
         self.unreceived_packets = [i for i in range(self.num_packets)]
+        self.ecn_recover = 0
+        self.srtt = None
+        self.pacing = pacing
+        self.tokens = PACING_BURST
+        self.tokens_time = start_time
+        self.pacing_timer = None
 
         self.send_packets(self.start_time)
 
@@ -86,6 +103,13 @@ class Flow(object):
         """
         return self.window_size < self.ssthreshold
 
+    def multiplicative_decrease(self):
+        """Returns the slow-start threshold after a congestion event, half of
+        the current window size. Called once per loss or ECN reaction.
+
+        """
+        return max(self.window_size / 2.0, 1)
+
     def update_ack_window_size(self):
         """Updates window size when a packet is acknowledged.
 
@@ -106,7 +130,7 @@ class Flow(object):
         sets window size back to 1, and resets the duplicate counter.
 
         """
-        self.ssthreshold = max(self.window_size / 2.0, 1)
+        self.ssthreshold = self.multiplicative_decrease()
         self.window_size = 1.0
         self.duplicate_counter = 0
         self.record_window_size()
@@ -117,10 +141,27 @@ class Flow(object):
 
         """
         assert(self.duplicate_counter == 3)
-        self.ssthreshold = max(self.window_size / 2.0, 1)
+        self.ssthreshold = self.multiplicative_decrease()
         self.window_size = 1.0
         self.record_window_size()
 
+    def react_to_ecn(self):
+        """Upon an acknowledgement echoing an ECN mark, halves the window like
+        a fast retransmit would, but without retransmitting anything. The flow
+        reacts at most once per window of data.
+
+        """
+        if self.first_unacknowledged < self.ecn_recover:
+            return
+        self.ssthreshold = self.multiplicative_decrease()
+        self.window_size = self.ssthreshold
+        self.record_window_size()
+
+        if self.unacknowledged_packets:
+            self.ecn_recover = max(self.unacknowledged_packets) + 1
+        else:
+            self.ecn_recover = self.first_unacknowledged
+
     def clean_unacknowledged(self):
         """Cleans up unacknowledged packet array by removing all packets with 
         ids preceding the first unacknowledged packet.
@@ -144,8 +185,7 @@ class Flow(object):
                 back from host
         """
 
-        rtt = self.ns.cur_time - a_packet.timestamp
-        self.ns.record_packet_rtt_time(self.flow_id, rtt)
+        self.measure_rtt(self.ns.cur_time - a_packet.timestamp)
 
         if a_packet.packet_id > self.first_unacknowledged:
             self.first_unacknowledged = a_packet.packet_id
@@ -153,7 +193,8 @@ class Flow(object):
             self.clean_unacknowledged()
             self.check_flow_completion()
             self.send_packets()
-        elif a_packet.packet_id == self.first_unacknowledged:
+        elif a_packet.packet_id == self.first_unacknowledged and \
+            not self.is_done():
             self.duplicate_counter += 1
             self.send_packets()
 
@@ -178,24 +219,107 @@ class Flow(object):
             self.unacknowledged_packets.clear()
             self.send_packets()
 
+    def measure_rtt(self, rtt):
+        """Records the round trip time of an acknowledged packet and folds it
+        into the smoothed round trip time.
+
+        Args:
+            rtt (float): the round trip time in seconds
+
+        """
+        self.ns.record_packet_rtt_time(self.flow_id, rtt)
+        if self.srtt is None:
+            self.srtt = rtt
+        else:
+            self.srtt += RTT_SMOOTHING * (rtt - self.srtt)
+
     def send_packets(self, delay=0.0):
         """Sends as many packets as possible, triggering the create_packet 
-        function.
+        function. A pacing flow stops when its token bucket is empty and
+        resumes when the pacing timer fires.
 
         delay (float): delay until sending packets. Should only be used for
             initial send.
         """
+        if self.pacing and delay > 0:
+            self.arm_pacing_timer(self.ns.cur_time + delay)
+            return
+
         cur = self.first_unacknowledged
         effective_window_size = self.get_effective_window_size()
         while len(self.unacknowledged_packets) < int(effective_window_size) \
             and  cur < self.num_packets:
             if cur not in self.unacknowledged_packets:
+                if self.pacing and not self.take_token():
+                    return
                 self.create_packet(cur, delay)
             cur += 1
 
     def get_effective_window_size(self):
         return self.window_size
 
+    def get_pacing_rate(self):
+        """Returns the rate a pacing flow sends at in packets/s: the window
+        size per smoothed RTT, with headroom for the window to grow
+        (PACING_SS_GAIN in slow start, PACING_CA_GAIN otherwise). Infinite
+        until the RTT has been measured.
+
+        """
+        if self.srtt is None or self.srtt <= 0:
+            return float('inf')
+        gain = PACING_SS_GAIN if self.slow_start() else PACING_CA_GAIN
+        return gain * self.get_effective_window_size() / self.srtt
+
+    def take_token(self):
+        """Refills the token bucket at the pacing rate and takes a token for
+        the next packet. If none is left, arms the pacing timer for when the
+        next one will be.
+
+        Returns:
+            True if the packet may be sent now.
+
+        """
+        now = self.ns.cur_time
+        rate = self.get_pacing_rate()
+        if rate == float('inf'):
+            self.tokens = PACING_BURST
+        else:
+            self.tokens = min(PACING_BURST,
+                self.tokens + (now - self.tokens_time) * rate)
+        self.tokens_time = now
+
+        # The bucket may be short of a token by a rounding error when the
+        # timer fires, and waiting for it would not advance the time.
+        next_token_time = now + (1 - self.tokens) / rate
+        if self.tokens >= 1 - PACING_TOLERANCE or next_token_time <= now:
+            self.tokens -= 1
+            return True
+        self.arm_pacing_timer(next_token_time)
+        return False
+
+    def arm_pacing_timer(self, time):
+        """Makes sure the pacing timer fires by the given time. A flow has a
+        single pacing timer: rearming it later than it is set does nothing,
+        and rearming it earlier leaves the old event to be ignored.
+
+        """
+        if self.pacing_timer is not None and self.pacing_timer <= time:
+            return
+        self.pacing_timer = time
+        event = lambda: self.pacing_timeout(time)
+        description = "Flow.pacing_timeout on flow %s" % self.flow_id
+        self.ns.add_event_at(event, description, time)
+
+    def pacing_timeout(self, time):
+        """Sends the packets the token bucket allows, unless the timer was
+        rearmed since this event was scheduled.
+
+        """
+        if self.pacing_timer != time:
+            return
+        self.pacing_timer = None
+        self.send_packets()
+
     def create_packet(self, packet_id, delay=0.0):
         """Creates packet and then adds it to event queue to be sent to the 
         host, along with a timing event to ensure that they are resent if
@@ -208,8 +332,9 @@ class Flow(object):
 
         """
 
-        new_packet = DataPacket(packet_id, self.src.node_id,
-            self.dest.node_id, self.flow_id, self.ns.cur_time + delay)
+        new_packet = self.ns.packet_pool.data_packet(packet_id,
+            self.src.node_id, self.dest.node_id, self.flow_id,
+            self.ns.cur_time + delay, self.dest.index)
 
         self.unacknowledged_packets.add(new_packet.packet_id)
 
@@ -218,17 +343,20 @@ class Flow(object):
             ": made data packet " + str(new_packet.packet_id)
         self.ns.add_event(event1, event1_message, delay=delay)
 
-        event2 = lambda: self.time_out(new_packet.packet_id)
+        # The packet may be recycled before the timeout fires, so only its id
+        # is captured here.
+        event2 = lambda: self.time_out(packet_id)
         event2_message = "flow.create_packet: Adding to time_out_packets, packet " + \
-            str(new_packet.packet_id)
+            str(packet_id)
         self.ns.add_event(event2, event2_message, delay=TIMEOUT_DELAY + delay)
 
-    def make_acknowledgement_packet(self, timestamp):
+    def make_acknowledgement_packet(self, timestamp, ece=False):
         """Method makes the AcknowledgementPacket and triggers the send_packet
         method for the host if applicable.
 
         Args:
             timestamp (float): time the packet to be acknowledged was sent
+            ece (bool): true if the packet to be acknowledged was ECN marked
 
         """
         if len(self.unreceived_packets) > 0:
@@ -238,8 +366,8 @@ class Flow(object):
 
         src = self.dest.node_id
         dest = self.src.node_id
-        new_packet = AcknowledgementPacket(next_expected, src, dest, \
-            self.flow_id, timestamp)
+        new_packet = self.ns.packet_pool.acknowledgement_packet(next_expected, \
+            src, dest, self.flow_id, timestamp, self.src.index, ece)
 
         event = lambda: self.dest.send_packet(new_packet)
         event_message = "flow.make_acknowledgement_packet(): Flow" + \
@@ -248,8 +376,9 @@ class Flow(object):
 
     def receive_packet(self, packet):
         """Receives a given packet. If it's a data packet, sends an 
-        acknowledgement packet. If it's an acknowledgement packet, updates the 
-        flow.
+        acknowledgement packet. If it's an acknowledgement packet, reacts to
+        its ECN echo and updates the flow. The packet is consumed and handed
+        back to the packet pool.
 
         Args:
             packet (Packet): packet object being received
@@ -262,7 +391,10 @@ class Flow(object):
         elif isinstance(packet, AcknowledgementPacket):
             assert packet.src == self.dest.node_id
             assert packet.dest == self.src.node_id
+            if packet.ece:
+                self.react_to_ecn()
             self.update_flow(packet)
+        self.ns.packet_pool.release(packet)
 
     def acknowledge(self, packet):
         """Triggers the send_packet function for the host if applicable by
@@ -276,7 +408,8 @@ class Flow(object):
         if packet.packet_id in self.unreceived_packets:
             self.unreceived_packets.remove(packet.packet_id)
 
-        self.make_acknowledgement_packet(packet.timestamp)
+        self.make_acknowledgement_packet(packet.timestamp,
+            packet.ecn == ECN_CE)
 
     def is_done(self):
         """Checks if a flow is completed. If the first unacknowledged packet is
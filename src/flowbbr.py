@@ -0,0 +1,312 @@
+from collections import deque
+
+from constants import *
+from flow import Flow
+
+STARTUP = "startup"
+DRAIN = "drain"
+PROBE_BW = "probe_bw"
+PROBE_RTT = "probe_rtt"
+
+class FlowBBR(Flow):
+    """A subclass of Flow that implements BBR congestion control. Instead of
+    reacting to losses, the flow keeps a model of the path: the bottleneck
+    bandwidth, the maximum delivery rate over the last BBR_BW_FILTER_ROUNDS
+    round trips, and the minimum round trip time over the last
+    BBR_MIN_RTT_WINDOW seconds. Packets are always paced, through Flow's
+    token bucket, at a gain times the bottleneck bandwidth, and the window
+    is capped at a gain times the bandwidth-delay product.
+
+    The flow starts in STARTUP, doubling its sending rate every round trip
+    until the bandwidth stops growing, then DRAINs the queue it built, and
+    settles in PROBE_BW, cycling its pacing gain to probe for more bandwidth.
+    When the min RTT sample gets too old it spends BBR_PROBE_RTT_DURATION in
+    PROBE_RTT with a small window so that the queue empties and the RTT can
+    be remeasured.
+
+    Every acknowledgement is for exactly one delivered data packet, and
+    echoes the timestamp of that packet, so the delivery rate is sampled
+    from the number of acknowledgements received since the packet was sent.
+    Lost packets are retransmitted after three duplicate acknowledgements or
+    a timeout, without touching the model.
+
+    Attributes:
+        state (str): STARTUP, DRAIN, PROBE_BW or PROBE_RTT
+        pacing_gain (float): The factor applied to btl_bw to pace packets
+        cwnd_gain (float): The factor applied to the bandwidth-delay product
+            to get the window size
+        pacing_rate (float): The rate packets are sent at in packets/s,
+            infinite until the bandwidth has been measured
+        delivered (int): The number of data packets acknowledged so far
+        delivered_time (float): The time delivered was last incremented
+        first_sent_time (float): The sending time of the last acknowledged
+            packet
+        sent (Deque): The (timestamp, delivered, delivered_time,
+            first_sent_time) of the packets waiting for an acknowledgement,
+            in sending order
+        round_count (int): The number of round trips so far
+        next_round_delivered (int): The value delivered must reach to end the
+            current round trip
+        bw_filter (Deque): (round, delivery rate) samples whose rates are
+            decreasing, so that the first one is the maximum of the window
+        btl_bw (float): The bottleneck bandwidth estimate in packets/s
+        min_rtt (float): The minimum round trip time estimate in seconds
+        min_rtt_stamp (float): When min_rtt was measured
+        full_bw (float): The bandwidth estimate startup is trying to exceed
+        full_bw_count (int): The round trips without significant growth
+        filled_pipe (bool): True once startup has found the bandwidth
+        cycle_index (int): The phase of PROBE_BW in BBR_PROBE_BW_GAINS
+        cycle_stamp (float): When the current phase started
+        probe_rtt_done_stamp (float): When PROBE_RTT may end, None until the
+            window has drained
+        prior_window_size (float): The window size before PROBE_RTT
+
+    Inherited Attributes:
+        See Flow. BBR flows always pace, whatever pacing is given.
+
+    """
+
+    def __init__(self, ns, flow_id, src, dest, data_amount, start_time,
+                 pacing=True):
+        self.state = STARTUP
+        self.pacing_gain = BBR_HIGH_GAIN
+        self.cwnd_gain = BBR_HIGH_GAIN
+        self.pacing_rate = float('inf')
+
+        self.delivered = 0
+        self.delivered_time = start_time
+        self.first_sent_time = start_time
+        self.sent = deque()
+        self.round_count = 0
+        self.next_round_delivered = 0
+        self.bw_filter = deque()
+        self.btl_bw = 0.0
+        self.min_rtt = float('inf')
+        self.min_rtt_stamp = start_time
+        self.full_bw = 0.0
+        self.full_bw_count = 0
+        self.filled_pipe = False
+        self.cycle_index = 0
+        self.cycle_stamp = start_time
+        self.probe_rtt_done_stamp = None
+        self.prior_window_size = BBR_MIN_WINDOW
+
+        Flow.__init__(self, ns, flow_id, src, dest, data_amount, start_time,
+            True)
+        self.window_size = BBR_MIN_WINDOW
+        if self.pacing_timer is None:
+            self.send_packets()
+
+    def react_to_ecn(self):
+        """BBR does not use ECN echoes, its model already tracks queueing."""
+        pass
+
+    def update_timeout_window_size(self):
+        """The model survives a timeout, only the lost packets are resent."""
+        self.duplicate_counter = 0
+
+    def update_flow(self, a_packet):
+        """Upon receiving an acknowledgement packet, updates the path model,
+        the window size and the pacing rate, retransmits after three
+        duplicate acknowledgements, and sends more packets.
+
+        Args:
+            a_packet (AcknowledgementPacket): Packet being sent back from host
+
+        """
+        rtt = self.ns.cur_time - a_packet.timestamp
+        self.measure_rtt(rtt)
+
+        if a_packet.packet_id > self.first_unacknowledged:
+            self.first_unacknowledged = a_packet.packet_id
+            self.duplicate_counter = 0
+            self.clean_unacknowledged()
+            self.check_flow_completion()
+        elif a_packet.packet_id == self.first_unacknowledged and \
+            not self.is_done():
+            self.duplicate_counter += 1
+            if self.duplicate_counter == 3:
+                self.create_packet(self.first_unacknowledged)
+                self.canceled_timeouts.append(self.first_unacknowledged)
+
+        self.update_model(a_packet.timestamp, rtt)
+        self.update_window_size()
+        self.send_packets()
+
+    def update_model(self, timestamp, rtt):
+        """Takes a delivery rate and an RTT sample from an acknowledgement and
+        advances the state machine.
+
+        Args:
+            timestamp (float): The sending time of the acknowledged packet
+            rtt (float): The round trip time of the acknowledged packet
+
+        """
+        now = self.ns.cur_time
+        self.delivered += 1
+        self.delivered_time = now
+
+        # Packets sent before the acknowledged one and still waiting are
+        # lost or reordered; they give no sample.
+        sample = None
+        while self.sent and self.sent[0][0] <= timestamp:
+            sample = self.sent.popleft()
+            if sample[0] == timestamp:
+                break
+            sample = None
+
+        round_start = False
+        if sample is not None:
+            sent_time, delivered, delivered_time, first_sent_time = sample
+            self.first_sent_time = sent_time
+            if delivered >= self.next_round_delivered:
+                self.next_round_delivered = self.delivered
+                self.round_count += 1
+                round_start = True
+            # The slower of the sending and acknowledging rates, so that
+            # acknowledgements arriving in a burst do not inflate the rate.
+            # Samples over less than a round trip are too noisy to use.
+            interval = max(sent_time - first_sent_time, now - delivered_time)
+            if interval > 0 and (interval >= self.min_rtt or
+                                 self.min_rtt == float('inf')):
+                self.update_btl_bw((self.delivered - delivered) / interval)
+
+        expired = now > self.min_rtt_stamp + BBR_MIN_RTT_WINDOW
+        if rtt <= self.min_rtt or expired:
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+
+        if self.state == STARTUP and round_start:
+            if self.btl_bw >= self.full_bw * BBR_FULL_BW_THRESHOLD:
+                self.full_bw = self.btl_bw
+                self.full_bw_count = 0
+            else:
+                self.full_bw_count += 1
+                if self.full_bw_count >= BBR_FULL_BW_ROUNDS:
+                    self.filled_pipe = True
+        if self.state == STARTUP and self.filled_pipe:
+            self.enter_state(DRAIN)
+        if self.state == DRAIN and \
+            len(self.unacknowledged_packets) <= self.bdp():
+            self.enter_state(PROBE_BW)
+        if self.state == PROBE_BW:
+            self.update_gain_cycle()
+
+        if expired and self.state != PROBE_RTT:
+            self.prior_window_size = self.window_size
+            self.enter_state(PROBE_RTT)
+        if self.state == PROBE_RTT:
+            self.update_probe_rtt()
+
+        rate = self.pacing_gain * self.btl_bw
+        if rate > 0 and (self.filled_pipe or rate > self.pacing_rate or
+                         self.pacing_rate == float('inf')):
+            self.pacing_rate = rate
+
+    def update_btl_bw(self, rate):
+        """Adds a delivery rate sample to the windowed max filter."""
+        bw_filter = self.bw_filter
+        while bw_filter and bw_filter[-1][1] <= rate:
+            bw_filter.pop()
+        bw_filter.append((self.round_count, rate))
+        while bw_filter[0][0] <= self.round_count - BBR_BW_FILTER_ROUNDS:
+            bw_filter.popleft()
+        self.btl_bw = bw_filter[0][1]
+
+    def bdp(self):
+        """Returns the bandwidth-delay product estimate in packets."""
+        if self.btl_bw == 0 or self.min_rtt == float('inf'):
+            return 0.0
+        return self.btl_bw * self.min_rtt
+
+    def enter_state(self, state):
+        """Switches the state machine to a state and sets its gains."""
+        self.state = state
+        now = self.ns.cur_time
+        if state == STARTUP:
+            self.pacing_gain = BBR_HIGH_GAIN
+            self.cwnd_gain = BBR_HIGH_GAIN
+        elif state == DRAIN:
+            self.pacing_gain = 1.0 / BBR_HIGH_GAIN
+            self.cwnd_gain = BBR_HIGH_GAIN
+        elif state == PROBE_BW:
+            self.cycle_index = 0
+            self.cycle_stamp = now
+            self.pacing_gain = BBR_PROBE_BW_GAINS[0]
+            self.cwnd_gain = BBR_CWND_GAIN
+        else:
+            self.pacing_gain = 1.0
+            self.cwnd_gain = 1.0
+            self.probe_rtt_done_stamp = None
+
+    def update_gain_cycle(self):
+        """Moves PROBE_BW to its next phase after one min RTT. A phase that
+        drains the queue ends early once the data in flight is down to the
+        bandwidth-delay product.
+
+        """
+        now = self.ns.cur_time
+        elapsed = now - self.cycle_stamp > self.min_rtt
+        if self.pacing_gain < 1.0:
+            elapsed = elapsed or \
+                len(self.unacknowledged_packets) <= self.bdp()
+        if elapsed:
+            self.cycle_index = (self.cycle_index + 1) % \
+                len(BBR_PROBE_BW_GAINS)
+            self.cycle_stamp = now
+            self.pacing_gain = BBR_PROBE_BW_GAINS[self.cycle_index]
+
+    def update_probe_rtt(self):
+        """Holds the window at BBR_MIN_WINDOW for BBR_PROBE_RTT_DURATION once
+        the data in flight has drained to it, then restores the window and
+        resumes probing for bandwidth.
+
+        """
+        now = self.ns.cur_time
+        if self.probe_rtt_done_stamp is None:
+            if len(self.unacknowledged_packets) <= BBR_MIN_WINDOW:
+                self.probe_rtt_done_stamp = now + BBR_PROBE_RTT_DURATION
+        elif now >= self.probe_rtt_done_stamp:
+            self.min_rtt_stamp = now
+            self.window_size = max(self.window_size, self.prior_window_size)
+            self.enter_state(PROBE_BW if self.filled_pipe else STARTUP)
+
+    def update_window_size(self):
+        """Sets the window size to cwnd_gain times the bandwidth-delay
+        product. Until the pipe is filled the window only grows, by one
+        packet per acknowledgement, like slow start.
+
+        """
+        if self.state == PROBE_RTT:
+            window_size = BBR_MIN_WINDOW
+        else:
+            target = self.cwnd_gain * self.bdp()
+            window_size = self.window_size
+            if self.filled_pipe:
+                window_size = min(window_size + 1, target)
+            elif target == 0 or window_size < target:
+                window_size += 1
+            window_size = max(window_size, BBR_MIN_WINDOW)
+
+        if window_size != self.window_size:
+            self.window_size = window_size
+            self.record_window_size()
+
+    def get_pacing_rate(self):
+        """Returns the pacing rate of the model in packets/s."""
+        return self.pacing_rate
+
+    def create_packet(self, packet_id, delay=0.0):
+        """Remembers how much had been delivered when the packet was sent,
+        then creates it as Flow does.
+
+        """
+        now = self.ns.cur_time + delay
+        if not self.unacknowledged_packets:
+            # Restarting from idle, the time spent idle is not part of any
+            # delivery rate sample.
+            self.delivered_time = now
+            self.first_sent_time = now
+        self.sent.append((now, self.delivered, self.delivered_time,
+            self.first_sent_time))
+        Flow.create_packet(self, packet_id, delay)
@@ -0,0 +1,88 @@
+from constants import *
+from flowreno import FlowReno
+
+class FlowCubic(FlowReno):
+    """A subclass of FlowReno that implements TCP CUBIC congestion control
+    (RFC 8312). Losses are detected and recovered from as in Reno, but in
+    congestion avoidance the window follows a cubic function of the time
+    since the last reduction: it climbs quickly back towards the window size
+    at which the loss happened, plateaus around it, then probes beyond it.
+    This fills long fat pipes much faster than Reno's linear growth.
+
+    Attributes:
+        w_max (float): The window size just before the last reduction
+        epoch_start (float): The time congestion avoidance started growing the
+            window after the last reduction, None until it does
+        k (float): The time the cubic function takes to climb back to
+            origin_point
+        origin_point (float): The window size at the plateau of the cubic
+            function
+        w_est (float): The window size Reno would have reached in the same
+            epoch. The window never grows slower than it.
+
+    Inherited Attributes:
+        See FlowReno.
+
+    """
+
+    def __init__(self, ns, flow_id, src, dest, data_amount, start_time,
+                 pacing=False):
+        self.w_max = 0.0
+        self.epoch_start = None
+        self.k = 0.0
+        self.origin_point = 0.0
+        self.w_est = 0.0
+        FlowReno.__init__(self, ns, flow_id, src, dest, data_amount,
+            start_time, pacing)
+
+    def multiplicative_decrease(self):
+        """Remembers the window size at the congestion event and returns the
+        slow-start threshold, CUBIC_BETA times the window size. If the window
+        did not get back to the previous w_max, the plateau is lowered
+        further to release bandwidth to newer flows (fast convergence).
+
+        """
+        self.epoch_start = None
+        if self.window_size < self.w_max:
+            self.w_max = self.window_size * (1 + CUBIC_BETA) / 2.0
+        else:
+            self.w_max = self.window_size
+        return max(self.window_size * CUBIC_BETA, 1)
+
+    def update_ack_window_size(self):
+        """Updates window size when a packet is acknowledged. Slow start and
+        the end of fast recovery are handled as in Reno, and congestion
+        avoidance grows the window towards the cubic function one round trip
+        ahead.
+
+        """
+        if self.fast_recovery or self.slow_start():
+            FlowReno.update_ack_window_size(self)
+            return
+
+        now = self.ns.cur_time
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = self.window_size
+            if self.window_size < self.w_max:
+                self.k = ((self.w_max - self.window_size) / CUBIC_C) ** \
+                    (1.0 / 3.0)
+                self.origin_point = self.w_max
+            else:
+                self.k = 0.0
+                self.origin_point = self.window_size
+
+        t = now - self.epoch_start + self.srtt
+        target = self.origin_point + CUBIC_C * (t - self.k) ** 3
+        target = min(target, 1.5 * self.window_size)
+        self.w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) / \
+            self.window_size
+
+        if target > self.window_size:
+            self.window_size += (target - self.window_size) / self.window_size
+        else:
+            self.window_size += 0.01 / self.window_size
+        self.window_size = max(self.window_size, self.w_est)
+
+        self.duplicate_counter = 0
+        self.record_window_size()
@@ -39,9 +39,11 @@ class FlowReno(Flow):
 
     """
 
-    def __init__(self, ns, flow_id, src, dest, data_amount, start_time):
+    def __init__(self, ns, flow_id, src, dest, data_amount, start_time,
+                 pacing=False):
         self.fast_recovery = False
-        Flow.__init__(self, ns, flow_id, src, dest, data_amount, start_time)
+        Flow.__init__(self, ns, flow_id, src, dest, data_amount, start_time,
+            pacing)
 
         self.first_partial_ack = -1
         self.last_partial_ack = -1
@@ -73,13 +75,13 @@ class FlowReno(Flow):
 
     def update_fast_retransmit_window_size(self):
         """Updates window size during fast retransmit. Sets threshold to half of
-        current window size, turns on fast recovery, and records partial
-        acknowledgement packets
+        current window size (see multiplicative_decrease), turns on fast
+        recovery, and records partial acknowledgement packets
 
         """
         assert(self.duplicate_counter == 3)
 
-        self.ssthreshold = max(self.window_size / 2.0, 1)
+        self.ssthreshold = self.multiplicative_decrease()
         self.window_size = self.ssthreshold
         self.record_window_size()
 
@@ -87,6 +89,14 @@ class FlowReno(Flow):
         self.last_partial_ack = max(self.unacknowledged_packets)
         self.first_partial_ack = min(self.unacknowledged_packets)
 
+    def react_to_ecn(self):
+        """Reacts to an ECN echo unless the flow is already recovering from a
+        loss.
+
+        """
+        if not self.fast_recovery:
+            Flow.react_to_ecn(self)
+
     def update_flow(self, a_packet):
         """Upon receiving an acknowledgement packet, updates the flow's
         attributes. Also checks for duplicate acknowledgement packets, and flow
@@ -96,8 +106,7 @@ class FlowReno(Flow):
             a_packet (AcknowledgementPacket): Packet being sent back from host
 
         """
-        rtt = self.ns.cur_time - a_packet.timestamp
-        self.ns.record_packet_rtt_time(self.flow_id, rtt)
+        self.measure_rtt(self.ns.cur_time - a_packet.timestamp)
 
         if a_packet.packet_id > self.first_unacknowledged:
             self.first_unacknowledged = a_packet.packet_id
@@ -116,7 +125,8 @@ class FlowReno(Flow):
 
             self.check_flow_completion()
             self.send_packets()
-        elif a_packet.packet_id == self.first_unacknowledged:
+        elif a_packet.packet_id == self.first_unacknowledged and \
+            not self.is_done():
             self.duplicate_counter += 1
             self.send_packets()
 
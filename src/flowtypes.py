@@ -0,0 +1,34 @@
+from flow import Flow
+from flowreno import FlowReno
+from flowcubic import FlowCubic
+from flowbbr import FlowBBR
+from fast_tcp import FAST_TCP
+
+FLOW_TYPES = {
+    "tahoe": Flow,
+    "reno": FlowReno,
+    "fast": FAST_TCP,
+    "cubic": FlowCubic,
+    "bbr": FlowBBR,
+}
+
+def flow_type_name(flowtype):
+    """Returns the registered name of a flow "type", "tahoe" for None."""
+    name = (flowtype or "tahoe").lower()
+    if name not in FLOW_TYPES:
+        raise Exception("Unknown flow type %s" % flowtype)
+    return name
+
+def make_flow(ns, flow_id, src, dest, data_amount, start_time, flowtype,
+              pacing=False):
+    """Creates a flow of the class registered for its "type".
+
+    Args:
+        flowtype (str): a key of FLOW_TYPES, case insensitive, or None for
+            TCP Tahoe.
+
+    See Flow for the other arguments.
+
+    """
+    flow_class = FLOW_TYPES[flow_type_name(flowtype)]
+    return flow_class(ns, flow_id, src, dest, data_amount, start_time, pacing)
@@ -58,7 +58,7 @@ class Host(Node):
         if isinstance(packet, DataPacket):
             self.ns.record_packet_send(flow_id, packet_id, packet_size)
 
-        event = lambda: self._link.add_packet(packet, self.node_id)
+        event = lambda: self._link.add_packet(packet, self.index)
         description = "Link.add_packet() with packet %d from %s" \
             % (packet.packet_id, self.node_id)
         self.ns.add_event(event, description)
@@ -76,6 +76,9 @@ class Host(Node):
         assert packet.flow_id in self.flows
         assert packet.dest == self.node_id
 
+        if self.ns.routing_metrics and isinstance(packet, DataPacket):
+            self.ns.record_hop_count(packet.flow_id, packet.hops)
+
         event = lambda: self.flows[packet.flow_id].receive_packet(packet)
         description = "Flow.receive_packet() with packet %d" % packet.packet_id
         self.ns.add_event(event, description)
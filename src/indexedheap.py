@@ -0,0 +1,108 @@
+class IndexedMinHeap(object):
+    """A binary min-heap of keys ordered by priority, with an index from each
+    key to its position so that the priority of any key can be changed in
+    O(log n). Ties are broken by key.
+
+    It reads and writes like a dict from keys to priorities, and min()
+    returns the smallest (key, priority) pair in O(1).
+
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        return self._heap[self._index[key]][0]
+
+    def __setitem__(self, key, priority):
+        position = self._index.get(key)
+        if position is None:
+            self._heap.append((priority, key))
+            self._index[key] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+            return
+        old_priority = self._heap[position][0]
+        self._heap[position] = (priority, key)
+        if (priority, key) < (old_priority, key):
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def __delitem__(self, key):
+        position = self._index.pop(key)
+        last = self._heap.pop()
+        if position < len(self._heap):
+            self._heap[position] = last
+            self._index[last[1]] = position
+            self._sift_up(position)
+            self._sift_down(self._index[last[1]])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def iteritems(self):
+        for priority, key in self._heap:
+            yield key, priority
+
+    def min(self):
+        """Returns the (key, priority) pair with the smallest priority."""
+        priority, key = self._heap[0]
+        return key, priority
+
+    def within(self, bound):
+        """Returns the (key, priority) pairs whose priority is at most bound,
+        in O(number of pairs returned).
+
+        """
+        heap = self._heap
+        pairs = []
+        stack = [0] if heap else []
+        while stack:
+            position = stack.pop()
+            if position >= len(heap) or heap[position][0] > bound:
+                continue
+            priority, key = heap[position]
+            pairs.append((key, priority))
+            stack.append(2 * position + 1)
+            stack.append(2 * position + 2)
+        return pairs
+
+    def _sift_up(self, position):
+        heap = self._heap
+        index = self._index
+        item = heap[position]
+        while position > 0:
+            parent = (position - 1) >> 1
+            if heap[parent] <= item:
+                break
+            heap[position] = heap[parent]
+            index[heap[position][1]] = position
+            position = parent
+        heap[position] = item
+        index[item[1]] = position
+
+    def _sift_down(self, position):
+        heap = self._heap
+        index = self._index
+        size = len(heap)
+        item = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if item <= heap[child]:
+                break
+            heap[position] = heap[child]
+            index[heap[position][1]] = position
+            position = child
+        heap[position] = item
+        index[item[1]] = position
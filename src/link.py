@@ -1,5 +1,7 @@
-from collections import deque
 from packet import *
+from queuedisc import make_queue_discipline
+from fairqueue import scheduler_type
+from transmitter import Transmitter, AnalyticTransmitter, FairQueueTransmitter
 
 class Link(object):
     """A link which connects new nodes in the graph.
@@ -12,16 +14,39 @@ class Link(object):
         prop_delay (float): propagation delay of the link in s
         capacity (float): the maximum link rate in bits / s
         nodes (array): an array of the 2 nodes connected with this link
-        link_buffer (Deque): stores packets waiting to be sent on this link
-        packets_in_route (arr[Packet]): stores all packets being sent on the
-                                    link either in transmission or propagation
-        buffer_size (float): the amount of data waiting in the link buffer
+        index (int): the dense integer id of the link, assigned when the
+                     topology is compiled
+        packets (PacketStore): the simulator's packet backend, which turns
+                               packets into the references held by the link
+        engine (string): "event" to schedule every transmission and
+                         propagation, or "analytic" to compute departure
+                         times when packets are enqueued
+        duplex (bool): if true, each direction has its own buffer,
+                       transmitter and data series. Otherwise both directions
+                       share a single buffer and transmitter.
+        queue (string or dict): the description of the queue discipline of
+                                each buffer, e.g. "red" or
+                                {"type": "codel", "ecn": true}. Defaults to
+                                drop-tail.
+        scheduler (string or dict): "fifo" (default) to send packets in
+                                    arrival order, or "drr" or "fq_codel" to
+                                    serve per-flow sub-queues in deficit round
+                                    robin, in which case queue is the
+                                    discipline of each sub-queue. See
+                                    make_fair_queue.
+        transmitters (arr[Transmitter]): the transmitter sending packets from
+                                         nodes[0] to nodes[1] and the one
+                                         sending from nodes[1] to nodes[0].
+                                         Both are the same object unless the
+                                         link is duplex.
+        buffer_size (float): the amount of data waiting in the link buffers
                                 sent on the link
         
     """
 
     def __init__ (self, ns, link_id, max_buffer_size, prop_delay, capacity, 
-                  nodes):
+                  nodes, engine="event", duplex=False, queue=None,
+                  scheduler=None):
         self.ns = ns
         self._link_id = link_id
         self._max_buffer_size = max_buffer_size
@@ -32,10 +57,42 @@ class Link(object):
         if len(nodes) != 2:
             raise AttributeError("Node array should contain two nodes")
         self.nodes = nodes
-        
-        self.link_buffer = deque()
-        self._buffer_size = 0.0
-        self.packets_in_route = deque()
+        self.index = None
+        self._ends = None
+
+        self.packets = ns.packet_store
+        self.engine = engine
+        self.duplex = duplex
+        self.queue = queue
+        self.scheduler = scheduler
+        if duplex:
+            self.transmitters = [
+                self._make_transmitter("%s:%s->%s" % (link_id,
+                    nodes[0].node_id, nodes[1].node_id)),
+                self._make_transmitter("%s:%s->%s" % (link_id,
+                    nodes[1].node_id, nodes[0].node_id))
+            ]
+        else:
+            transmitter = self._make_transmitter(link_id)
+            self.transmitters = [transmitter, transmitter]
+
+    def _make_transmitter(self, series_id):
+        """Creates a transmitter for the link's engine and scheduler. Fair
+        queueing is always event driven.
+
+        Args:
+            series_id (string): the id the transmitter records its data under.
+
+        """
+        if scheduler_type(self.scheduler) != "fifo":
+            return FairQueueTransmitter(self, series_id, self.scheduler,
+                self.queue)
+        queue_discipline = make_queue_discipline(self, self.queue)
+        if self.engine == "event":
+            return Transmitter(self, series_id, queue_discipline)
+        elif self.engine == "analytic":
+            return AnalyticTransmitter(self, series_id, queue_discipline)
+        raise AttributeError("Unknown link engine %s" % self.engine)
         
     @property
     def link_id(self):
@@ -71,130 +128,87 @@ class Link(object):
     
     @property
     def buffer_size(self):
-        return self._buffer_size
+        if self.duplex:
+            return self.transmitters[0].buffer_size + \
+                self.transmitters[1].buffer_size
+        return self.transmitters[0].buffer_size
     
     @buffer_size.setter
     def buffer_size(self, value):
         raise AttributeError("Buffer size should not be changed externally")
 
-    def _get_other_node(self, node_id):
-        """Finds the node that node with id node_id is linked to.
+    def compile(self, index):
+        """Precomputes the direction table of the link once every node has
+        an integer index.
+
+        Args:
+            index (int): the dense integer id of the link.
+
+        """
+        self.index = index
+        self._ends = (self.nodes[0].index, self.nodes[1].index)
+
+    def _get_direction(self, node_index):
+        """Finds the direction in which the node with index node_index sends
+        packets on the link.
         
-        Checks which node of the links has the node_id that was passed in and 
-        returns the other node. If neither node has that node_id, an error is
+        Checks which end of the link the node is on using the direction table.
+        Direction 0 goes from nodes[0] to nodes[1] and direction 1 goes from
+        nodes[1] to nodes[0]. If neither node has that index, an error is
         thrown.
         
         Args:
-            node_id (string): the id of the node whose opposite we wish to find.
+            node_index (int): the index of the sending node.
         
         """
-        destination = None
-        if node_id == self.nodes[0].node_id:
-            destination = self.nodes[1]
-        elif node_id == self.nodes[1].node_id:
-            destination = self.nodes[0]   
-        else:
-            raise Exception("This link is not connected to node with"
-                            "node_id %s" % node_id)
-        return destination        
-        
+        ends = self._ends
+        if node_index == ends[0]:
+            return 0
+        elif node_index == ends[1]:
+            return 1
+        raise Exception("This link is not connected to node with "
+                        "index %s" % node_index)
+
     def get_other_node_id(self, node_id):
         """Finds the id of the node that node with id node_id is linked to.
         
-        Gets the opposite node of the node with id node_id and returns the id.
-        Allowed to be called publicly
+        Compares string ids, so it does not need a compiled topology. Allowed
+        to be called publicly.
           
         Args:
             node_id (string): the id of the node whose opposite we wish to find.
           
           """        
-        other_node = self._get_other_node(node_id)
-        return other_node.node_id 
-    
-    def add_packet(self, packet, node_id):
+        if node_id == self.nodes[0].node_id:
+            return self.nodes[1].node_id
+        elif node_id == self.nodes[1].node_id:
+            return self.nodes[0].node_id
+        raise Exception("This link is not connected to node with "
+                        "node_id %s" % node_id)
+
+    def add_packet(self, packet, node_index):
         """Add a packet to be sent
         
-        Puts the packet in the packet buffer to be sent to to the node with the
-        other id. If no other packets are in the buffer, sends the packet.
-        If the buffer is full, the packet is dropped.
+        Hands the packet to the transmitter of the sending node's direction to
+        be sent to the node on the other end. If the buffer is full, or its
+        queue discipline decides to, the packet is dropped.
         
         Args:
             packet (Packet): the packet being sent
-            node_id (string): the id of the node sending the packet 
+            node_index (int): the index of the node sending the packet
             
         """
+        direction = self._get_direction(node_index)
+        self.transmitters[direction].add_packet(packet,
+            self.nodes[1 - direction])
 
-        destination = self._get_other_node(node_id)
+    def queue_length(self, node_index):
+        """Returns the number of packets in the link buffer that the node
+        with index node_index sends into.
 
-        if self.buffer_size + packet.packet_size <= self.max_buffer_size:
-            self.link_buffer.append((packet, destination))
-            self._buffer_size += packet.packet_size
-            
-            self.ns.record_buffer_occupancy(self.link_id, len(self.link_buffer))
-
-            if len(self.link_buffer) == 1:
-                self.start_packet_transmission()
-        else:
-            print "Link %s is full; packet %s is dropped @ t=%f" \
-                % (self.link_id, packet.packet_id, self.ns.cur_time)
-            self.ns.record_packet_loss(self.link_id)
-    
-    def start_packet_transmission(self):
-        """Transmit a packet into the link
-        
-        Starts transmitting the first packet in link buffer. Calls the 
-        start_packet_propagation function to start propagating the packet after
-         the transmission delay. 
-            
-        """
-        assert len(self.link_buffer) > 0
-        packet, destination = self.link_buffer[0]
-
-        event = lambda: self.start_packet_propagation()
-        trans_delay = 1.0 * packet.packet_size / self.capacity
-        
-        self.ns.add_event(event, "Link.start_packet_propagation() with"
-                              " link_id = %s" % (self.link_id), trans_delay)
-
-
-    def start_packet_propagation(self):
-        """Begin propagating a packet on the wire
-        
-        Starts propagating the packet. If there is another packet on the buffer
-        to be sent, calls start_packet_transmission.
-        Calls finish_packet_transfer after the propagation delay.
-        
-        """
-
-        packet, destination = self.link_buffer.popleft()
-        self._buffer_size -= packet.packet_size
-        self.ns.record_buffer_occupancy(self.link_id, len(self.link_buffer))
-
-        self.packets_in_route.append((packet, destination))
-       
-        event = lambda: self.finish_packet_transfer()
-        self.ns.add_event(event, "Link.finish_packet_transfer() with"
-                          " link_id = %s" % self.link_id, self.prop_delay)
+        Args:
+            node_index (int): the index of the sending node.
 
-        if len(self.link_buffer) > 0:
-            next_destination = self.link_buffer[0][1]
-            self.start_packet_transmission()
-   
-    def finish_packet_transfer(self):
-        """Hand off the packet to the node it was going to. 
-        
-        When this method is called, the packet will be transferred to the 
-        correct node. The link records that it sent the data of this packet.
-        
         """
-        assert len(self.packets_in_route) > 0
-        packet, destination = self.packets_in_route.popleft()
-
-        event = lambda: destination.receive_packet(packet, self.link_id)
-        self.ns.add_event(event, "Node.receive_packet() with node_id = %s, "
-                          "cur_packet = %s, link_id = %s" \
-                          % (destination.node_id, packet.packet_id, 
-                             self.link_id))
-        
-        self.ns.record_link_rate(self.link_id, packet.packet_size)
-    
\ No newline at end of file
+        return self.transmitters[self._get_direction(node_index)] \
+            .queue_length()
@@ -4,13 +4,18 @@ import sys
 
 from constants import *
 
-from flow import Flow
-from flowreno import FlowReno
-from fast_tcp import FAST_TCP
+from fast_tcp_ticker import FastTcpTicker
+from flowtypes import flow_type_name, make_flow
 from host import Host
 from link import Link
 from router import Router
 from datametrics import DataMetrics
+from packet import PacketPool
+from packetstore import ObjectPacketStore, ColumnarPacketStore
+from resultcache import ResultCache
+from routingoracle import RoutingOracle
+from sampling import SamplingPolicy
+from sinks import make_sink
 
 class NetworkSimulator(object):
     """The main class for the network simulator.
@@ -24,6 +29,10 @@ class NetworkSimulator(object):
         flows (dict): all flows with their ids as the keys
         links (dict): all links with their ids as the keys
         nodes (dict): all nodes (hosts and routers) with their ids as the keys
+        node_ids (list): the node ids indexed by the dense integer index of
+            each node
+        link_ids (list): the link ids indexed by the dense integer index of
+            each link, filled in when the topology is compiled
         pq (arr): a heapq priority queue whose elements are a tuple in the
             form (execution_time, event_id, f) where f is the function to be
             run
@@ -32,16 +41,111 @@ class NetworkSimulator(object):
         cur_time (float): a current time counter in seconds
         num_active_flows (int): Number of currently active flows
         event_counter (int): an event counter used to uniquely identify events
+        packet_pool (PacketPool): free list that recycles data and
+            acknowledgement packets once their flow has consumed them
+        packet_store (PacketStore): the backend holding the packets buffered
+            or in flight on links
+        routing (str): "distance_vector" or "link_state"
+        ecmp (str): the ECMP mode of routers that do not specify one
+        routing_metrics (bool): true if routing packets, routing table
+            changes, forwarding loops and hop counts are recorded
+        routing_oracle (RoutingOracle): computes the routes in link-state
+            mode, None otherwise
+        fast_tcp_ticker (FastTcpTicker): updates the window sizes of all
+            active FAST TCP flows every FAST_WINDOW_UPDATE_PERIOD
+        pacing (bool): whether flows that do not specify it pace their
+            packets
+        metrics_bin_width (float): the width of the bins DataMetrics
+            aggregates the data in, None to keep every data point
+        metrics_sink (MetricSink): where DataMetrics streams its points, None
+            to keep them in memory
+        sampling (list): the (metric, series_id, SamplingPolicy) tuples set
+            with set_sampling, which every network's DataMetrics follows
+        result_cache (ResultCache): where the results of runs are cached,
+            None to always simulate
 
     """
 
-    def __init__(self):
+    def __init__(self, packet_pool_size=0, packet_store="object",
+                 link_engine="event", routing="distance_vector", ecmp="off",
+                 routing_metrics=False, pacing=False, metrics_bin_width=None,
+                 metrics_sink=None, result_cache=None):
+        """Creates an empty network simulator.
+
+        Args:
+            packet_pool_size (int): maximum number of consumed packets of each
+                type kept for reuse. 0 disables packet recycling.
+            packet_store (str): "object" to keep packets on links as Python
+                objects, or "columnar" to keep them as integer handles into
+                the columns of a ColumnarPacketStore.
+            link_engine (str): the engine used by links that do not specify
+                one: "event" or "analytic". See Link.
+            routing (str): "distance_vector" to have routers exchange
+                routing packets, or "link_state" to have a RoutingOracle
+                compute shortest paths centrally and install them in the
+                routers.
+            ecmp (str): the ECMP mode of routers that do not specify one:
+                "off", "hash" or "weighted". See Router. Only supported by
+                distance-vector routing.
+            routing_metrics (bool): if True, routers record the routing
+                packets they send and receive, their routing table changes
+                and forwarding loops, and hosts record the hop count of the
+                data packets they receive. Off by default since it adds work
+                to every forwarded packet.
+            pacing (bool): if True, flows that do not specify "pacing"
+                release their packets through a token bucket at the pacing
+                rate instead of a window at a time. See Flow.
+            metrics_bin_width (float): if given, DataMetrics aggregates the
+                data in bins of this many seconds as it is recorded instead
+                of keeping every data point, so that memory does not grow
+                with the number of events. See BinnedSeries.
+            metrics_sink (MetricSink or str): if given, DataMetrics writes
+                the points of its series to this sink in chunks during the
+                run, and flushes it when run() completes. A path is opened
+                with make_sink: a .csv or .sqlite file, or a directory of
+                .npz segments.
+            result_cache (ResultCache or str): if given, run() loads the
+                results of a network that already ran with the same
+                description, options, constants and code from this cache
+                instead of simulating it, and caches the results of the
+                networks it simulates. A path is opened as a ResultCache.
+
+        """
+        if packet_store not in ("object", "columnar"):
+            raise Exception("Unknown packet store %s" % packet_store)
+        self._packet_store_type = packet_store
+        self.link_engine = link_engine
+        if routing not in ("distance_vector", "link_state"):
+            raise Exception("Unknown routing mode %s" % routing)
+        self.routing = routing
+        self.routing_oracle = None
+        if routing == "link_state" and ecmp != "off":
+            raise Exception("ECMP is not supported with link-state routing")
+        self.ecmp = ecmp
+        self.routing_metrics = routing_metrics
+        self.pacing = pacing
+        self.metrics_bin_width = metrics_bin_width
+        if isinstance(metrics_sink, basestring):
+            metrics_sink = make_sink(metrics_sink)
+        self.metrics_sink = metrics_sink
+        self.sampling = []
+        if isinstance(result_cache, basestring):
+            result_cache = ResultCache(result_cache)
+        self.result_cache = result_cache
+        # The description of the network populated, until it is run.
+        self._network = None
+
         self.flows = {}
         self.links = {}
         self.nodes = {}
+        self.node_ids = []
+        self.link_ids = []
 
         self.pq = []
-        self.data_metrics = DataMetrics()
+        self.data_metrics = self.make_data_metrics()
+        self.packet_pool = PacketPool(packet_pool_size)
+        self.packet_store = self.make_packet_store()
+        self.fast_tcp_ticker = FastTcpTicker(self)
 
         self._cur_time = 0
         self._num_active_flows = 0
@@ -71,6 +175,55 @@ class NetworkSimulator(object):
     def event_counter(self, val):
         raise Exception("Cannot modify event_counter in NetworkSimulator")
 
+    def set_sampling(self, metric, series_id=None, policy=None, **options):
+        """Sets which points of a measurement, or of one of its series, are
+        recorded, for this network and the ones populated later.
+
+        For instance, set_sampling("buffer_occupancy", interval=0.01)
+        records buffer occupancies at most every 10 ms, and
+        set_sampling("window_size", "F1", enabled=False) stops recording
+        the window size of F1. A SamplingPolicy can be given instead of
+        its arguments, e.g. set_sampling("link_rate",
+        SamplingPolicy(every=10)).
+
+        Args:
+            metric (str): the name of a DataMetrics measurement, such as
+                "link_rate".
+            series_id (str): the id of a link, flow or router, None for all
+                of them.
+            policy (SamplingPolicy): the policy, None to make one from the
+                options.
+            options: the arguments of SamplingPolicy: enabled, every,
+                threshold and interval.
+
+        """
+        if isinstance(series_id, SamplingPolicy) and policy is None:
+            series_id, policy = None, series_id
+        if series_id is not None and not isinstance(series_id, basestring):
+            raise Exception("Invalid series id %r" % (series_id,))
+        if policy is None:
+            policy = SamplingPolicy(**options)
+        elif options:
+            raise Exception("Sampling options given with a SamplingPolicy")
+        self.sampling.append((metric, series_id, policy))
+        self.data_metrics.set_sampling(metric, policy, series_id)
+
+    def make_data_metrics(self):
+        """Returns new, empty data metrics following the sampling policies
+        set on the simulator.
+
+        """
+        data_metrics = DataMetrics(self.metrics_bin_width, self.metrics_sink)
+        for metric, series_id, policy in self.sampling:
+            data_metrics.set_sampling(metric, policy, series_id)
+        return data_metrics
+
+    def make_packet_store(self):
+        """Returns a new, empty packet store of the configured type."""
+        if self._packet_store_type == "columnar":
+            return ColumnarPacketStore(self.packet_pool)
+        return ObjectPacketStore()
+
     def add_host(self, host_id, link, flows):
         """Adds a new host to the network.
 
@@ -81,19 +234,30 @@ class NetworkSimulator(object):
 
         """
         host = Host(self, host_id)
+        host.index = len(self.node_ids)
         self.nodes[host_id] = host
+        self.node_ids.append(host_id)
 
-    def add_router(self, router_id):
+    def add_router(self, router_id, ecmp=None):
         """Adds a new router to the network.
 
         Args:
             router_id (str): id of the router
+            ecmp (str): "off", "hash" or "weighted". Defaults to the
+                simulator's ecmp.
 
         """
-        router = Router(self, router_id)
+        if ecmp is None:
+            ecmp = self.ecmp
+        if self.routing == "link_state" and ecmp != "off":
+            raise Exception("ECMP is not supported with link-state routing")
+        router = Router(self, router_id, ecmp)
+        router.index = len(self.node_ids)
         self.nodes[router_id] = router
+        self.node_ids.append(router_id)
 
-    def add_link(self, link_id, max_buffer_size, prop_delay, capacity, nodes):
+    def add_link(self, link_id, max_buffer_size, prop_delay, capacity, nodes,
+                 engine=None, duplex=False, queue=None, scheduler=None):
         """Adds a new link to the network.
 
         Args:
@@ -102,6 +266,16 @@ class NetworkSimulator(object):
             prop_delay (float): propogation delay of the link in ms
             capacity (float): the maximum link rate in Mbps
             nodes (array): an array of the 2 nodes connected with this link
+            engine (str): "event" or "analytic". Defaults to the simulator's
+                link_engine.
+            duplex (bool): if true, each direction of the link gets its own
+                buffer of max_buffer_size and its own data series.
+            queue (str or dict): the queue discipline of the link buffers,
+                e.g. "red" or {"type": "codel", "ecn": true}. Defaults to
+                drop-tail.
+            scheduler (str or dict): "fifo" (default), "drr" or "fq_codel",
+                or a dict such as {"type": "drr", "quantum": 1024}. With fair
+                queueing, queue is the discipline of each flow's sub-queue.
 
         """
         # convert units into bits and seconds
@@ -109,10 +283,15 @@ class NetworkSimulator(object):
         prop_delay_s = prop_delay * MS_TO_S
         capacity_bps = capacity * MEGABIT_TO_BIT
 
-        link = Link(self, link_id, size_bits, prop_delay_s, capacity_bps, nodes)
+        if engine is None:
+            engine = self.link_engine
+
+        link = Link(self, link_id, size_bits, prop_delay_s, capacity_bps, nodes,
+                    engine, duplex, queue, scheduler)
         self.links[link_id] = link
 
-    def add_flow(self, flow_id, src, dest, data_amount, start_time, flowtype):
+    def add_flow(self, flow_id, src, dest, data_amount, start_time, flowtype,
+                 pacing=None):
         """Adds a new flow to the network.
 
         Args:
@@ -122,22 +301,20 @@ class NetworkSimulator(object):
             data_amount (float): amount of data to be sent in MB
             start_time (float): when the flow starts sending packets in seconds
             flowtype (str): the type of congestion control algorithm the flow
-                will use. Valid parameters are "fast", "reno", or None, which
-                defaults to TCP Tahoe.
+                will use: "tahoe", "reno", "fast", "cubic" or "bbr" (see
+                FLOW_TYPES), or None, which defaults to TCP Tahoe.
+            pacing (bool): whether the flow paces its packets, None for the
+                simulator's default.
 
         """
         # Convert data_amount from megabytes to bits
         num_bits = data_amount * BYTE_TO_BIT * MEGABIT_TO_BIT
-        if flowtype is not None:
-            if "fast" == flowtype.lower():
-                flow = FAST_TCP(self, flow_id, src, dest, num_bits, start_time)
-            elif "reno" == flowtype.lower():
-                flow = FlowReno(self, flow_id, src, dest, num_bits, start_time)
-            else:
-                flow = Flow(self, flow_id, src, dest, num_bits, start_time)
-        else:
-            flow = Flow(self, flow_id, src, dest, num_bits, start_time)
-        
+        if pacing is None:
+            pacing = self.pacing
+        flow = make_flow(self, flow_id, src, dest, num_bits, start_time,
+            flowtype, pacing)
+        self.data_metrics.set_flow_type(flow_id, flow_type_name(flowtype))
+
         self.flows[flow_id] = flow
         self._num_active_flows += 1
 
@@ -155,6 +332,8 @@ class NetworkSimulator(object):
 
         """
         self._num_active_flows -= 1
+        self.data_metrics.record_flow_completion(flow_id,
+            self.cur_time - self.flows[flow_id].start_time)
         print flow_id, "has completed at time", self.cur_time
 
     def populate(self, network_description):
@@ -174,6 +353,12 @@ class NetworkSimulator(object):
 
         if network is None:
             raise Exception("Failed to load network description")
+        self._network = network
+
+        # Sampling policies of the description only apply to this network.
+        for spec in network.get("sampling", []):
+            self.data_metrics.set_sampling(spec["metric"],
+                SamplingPolicy.from_spec(spec), spec.get("series", None))
 
         for host in network["hosts"]:
             host_id = host["id"]
@@ -182,7 +367,7 @@ class NetworkSimulator(object):
 
         for router in network.get("routers", []):
             router_id = router["id"]
-            self.add_router(router_id)
+            self.add_router(router_id, router.get("ecmp", None))
             print "Router %s added to network." % router_id
 
         for link in network["links"]:
@@ -202,7 +387,11 @@ class NetworkSimulator(object):
                 max_buffer_size,
                 prop_delay,
                 capacity,
-                connected_nodes
+                connected_nodes,
+                link.get("engine", None),
+                link.get("duplex", False),
+                link.get("queue", None),
+                link.get("scheduler", None)
             )
             print "Link %s added to network." % link_id
 
@@ -221,7 +410,8 @@ class NetworkSimulator(object):
             else:
                 flowtype = None
 
-            self.add_flow(flow_id, src, dest, data_amt, start_time, flowtype)
+            self.add_flow(flow_id, src, dest, data_amt, start_time, flowtype,
+                flow.get("pacing", None))
             print "Flow %s added to network." % flow_id
 
         # Add links to hosts
@@ -238,11 +428,37 @@ class NetworkSimulator(object):
             self.nodes[router_id].add_links(links)
             print "Links %s added to Router %s." % (router["links"], router_id)
 
+        self.compile_topology()
+
         print "Network successfully populated."
 
+    def compile_topology(self):
+        """Compiles the network into integer-indexed lookup tables used on
+        the forwarding hot path. Must be called once every node and link has
+        been added and connected; populate() does so.
+
+        String ids are still used for I/O and for the data metrics.
+
+        """
+        self.link_ids = sorted(self.links)
+        for index, link_id in enumerate(self.link_ids):
+            self.links[link_id].compile(index)
+
+        for node in self.nodes.itervalues():
+            node.compile(len(self.node_ids))
+
+        if self.routing == "link_state":
+            self.routing_oracle = RoutingOracle(self)
+            self.routing_oracle.start()
+
     def run(self, duration=sys.float_info.max, verbose=True):
         """Runs the simulation for the given duration.
 
+        A populated network run until termination is looked up in the result
+        cache, if there is one. If its results are cached, they are loaded
+        instead of simulating it, and otherwise they are cached once it has
+        run.
+
         Args:
             duration (float): the duration of the simulation in seconds.
                 By default, the simulation runs until termination.
@@ -250,6 +466,16 @@ class NetworkSimulator(object):
                 of the queue items as it executes them.
 
         """
+        key = self.result_cache_key(duration)
+        self._network = None
+        if key is not None:
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                self.load_results(*cached)
+                print "Loaded cached results %s." % key
+                print "Simulation finished."
+                return
+
         while self.pq and self.num_active_flows > 0 and self.cur_time < duration:
             event_time, _, description, f = heapq.heappop(self.pq)
             self.cur_time = event_time
@@ -258,8 +484,52 @@ class NetworkSimulator(object):
                 print "Description: ", description
             f()
 
+        self.data_metrics.flush()
+        if key is not None:
+            self.result_cache.put(key, self.data_metrics, {
+                "end_time": self.cur_time,
+                "event_counter": self.event_counter,
+                "num_active_flows": self.num_active_flows,
+            })
         print "Simulation finished."
 
+    def result_cache_key(self, duration=sys.float_info.max):
+        """Returns the key of the results of running the populated network
+        in the result cache, or None if they are not cached: without a
+        cache, with a metric sink, for runs with a duration, and for
+        networks that did not come from populate() or already ran.
+        Changes made to the network after populate() are not part of the
+        key.
+
+        """
+        if self.result_cache is None or self._network is None or \
+            self.metrics_sink is not None or duration != sys.float_info.max:
+            return None
+        options = {
+            "packet_store": self._packet_store_type,
+            "link_engine": self.link_engine,
+            "routing": self.routing,
+            "ecmp": self.ecmp,
+            "routing_metrics": self.routing_metrics,
+            "pacing": self.pacing,
+            "metrics_bin_width": self.metrics_bin_width,
+            "sampling": [(metric, series_id, repr(policy))
+                for metric, series_id, policy in self.sampling],
+        }
+        return self.result_cache.key(self._network, options)
+
+    def load_results(self, data_metrics, results):
+        """Replaces the state of a run with cached results, see
+        ResultCache.get. The network is left as populated, with no events
+        left to run.
+
+        """
+        self.data_metrics = data_metrics
+        self.pq = []
+        self._cur_time = results["end_time"]
+        self._event_counter = results["event_counter"]
+        self._num_active_flows = results["num_active_flows"]
+
     def add_event(self, f, description="", delay=0.0):
         """Adds an event to the priority queue.
 
@@ -274,30 +544,57 @@ class NetworkSimulator(object):
         heapq.heappush(self.pq, event)
         self._event_counter += 1
 
+    def add_event_at(self, f, description, time):
+        """Adds an event to the priority queue at an absolute time.
+
+        Args:
+            f (func): the function to be run during this event.
+            description (str): description of the event
+            time (float): the time at which this event should be executed in
+                seconds. Must not be before the current time.
+
+        """
+        assert time >= self.cur_time
+        event = (time, self.event_counter, description, f)
+        heapq.heappush(self.pq, event)
+        self._event_counter += 1
+
     def clear_network(self):
         """Clears all network data."""
         self.flows = {}
         self.links = {}
         self.nodes = {}
+        self.node_ids = []
+        self.link_ids = []
 
         self.pq = []
+        self._network = None
 
         self._cur_time = 0
         self._num_active_flows = 0
         self._event_counter = 0
 
-        self.data_metrics = DataMetrics()
+        self.data_metrics = self.make_data_metrics()
+        self.packet_store = self.make_packet_store()
+        self.routing_oracle = None
+        self.fast_tcp_ticker = FastTcpTicker(self)
 
-    def record_buffer_occupancy(self, link_id, buffer_occupancy):
+    def record_buffer_occupancy(self, link_id, buffer_occupancy, time=None):
         """Records a buffer occupancy data point.
 
         Args:
             link_id (str): the link id of the link this point belongs to.
             buffer_occupancy (int): number of packets in the link buffer at cur_time.
+            time (float): the time of the point if it is not cur_time. Used by
+                links that update their buffers lazily.
 
         """
+        if "buffer_occupancy" in self.data_metrics.disabled:
+            return
+        if time is None:
+            time = self.cur_time
         self.data_metrics.update_buffer_occupancy(link_id, \
-            buffer_occupancy, self.cur_time)
+            buffer_occupancy, time)
 
     def record_packet_loss(self, link_id):
         """Records a packet loss data point.
@@ -306,6 +603,8 @@ class NetworkSimulator(object):
             link_id (str): the link id of the link that dropped a packet.
 
         """
+        if "packet_loss" in self.data_metrics.disabled:
+            return
         self.data_metrics.update_packet_loss(link_id, self.cur_time)
 
     def record_link_rate(self, link_id, amt_sent):
@@ -316,8 +615,94 @@ class NetworkSimulator(object):
             amt_sent (float): num of bits sent by the link at cur_time.
 
         """
+        if "link_rate" in self.data_metrics.disabled:
+            return
         self.data_metrics.update_link_rate(link_id, amt_sent, self.cur_time)
 
+    def record_queueing_delay(self, link_id, delay):
+        """Records how long a packet waited in a link buffer before its
+        transmission started.
+
+        Args:
+            link_id (str): the id of the link series the buffer belongs to.
+            delay (float): the time the packet spent queued in seconds.
+
+        """
+        self.data_metrics.record_queueing_delay(link_id, delay)
+
+    def record_flow_queueing_delay(self, link_id, flow_id, delay):
+        """Records how long a packet of a flow waited in a link buffer.
+
+        Args:
+            link_id (str): the id of the link series the buffer belongs to.
+            flow_id (str): the id of the packet's flow.
+            delay (float): the time the packet spent queued in seconds.
+
+        """
+        self.data_metrics.record_flow_queueing_delay(link_id, flow_id, delay,
+            self.cur_time)
+
+    def record_flow_link_rate(self, link_id, flow_id, amt_sent):
+        """Records the data of a flow sent by a link.
+
+        Args:
+            link_id (str): the id of the link series.
+            flow_id (str): the id of the flow the data belongs to.
+            amt_sent (float): num of bits of the flow sent at cur_time.
+
+        """
+        if "flow_link_rate" in self.data_metrics.disabled:
+            return
+        self.data_metrics.update_flow_link_rate(link_id, flow_id, amt_sent,
+            self.cur_time)
+
+    def record_routing_packet_sent(self, router_id, amt_sent):
+        """Records a routing packet sent by a router.
+
+        Args:
+            router_id (str): the id of the router.
+            amt_sent (float): the size of the packet in bits.
+
+        """
+        if "routing_packets_sent" in self.data_metrics.disabled and \
+            "routing_data_sent" in self.data_metrics.disabled:
+            return
+        self.data_metrics.update_routing_packets_sent(router_id, amt_sent,
+            self.cur_time)
+
+    def record_routing_packet_received(self, router_id):
+        """Records a routing packet received by a router."""
+        if "routing_packets_received" in self.data_metrics.disabled:
+            return
+        self.data_metrics.update_routing_packets_received(router_id,
+            self.cur_time)
+
+    def record_routing_table_changes(self, router_id, num_changes):
+        """Records the number of routes a router changed at cur_time."""
+        if "routing_table_changes" in self.data_metrics.disabled:
+            return
+        self.data_metrics.update_routing_table_changes(router_id, num_changes,
+            self.cur_time)
+
+    def record_routing_loop(self, router_id):
+        """Records a packet found in a forwarding loop by a router."""
+        if "routing_loops" in self.data_metrics.disabled:
+            return
+        self.data_metrics.update_routing_loops(router_id, self.cur_time)
+
+    def record_hop_count(self, flow_id, hops):
+        """Records the number of routers a delivered data packet went
+        through.
+
+        Args:
+            flow_id (str): the id of the packet's flow.
+            hops (int): the packet's hop count.
+
+        """
+        if "flow_hop_count" in self.data_metrics.disabled:
+            return
+        self.data_metrics.record_flow_hop_count(flow_id, hops, self.cur_time)
+
     def record_window_size(self, flow_id, window_size):
         """Records a window size data point.
 
@@ -326,6 +711,8 @@ class NetworkSimulator(object):
             window_size (int): the window size of the flow at cur_time.
 
         """
+        if "window_size" in self.data_metrics.disabled:
+            return
         self.data_metrics.update_window_size(flow_id, \
             window_size, self.cur_time)
 
@@ -338,6 +725,8 @@ class NetworkSimulator(object):
             amt_sent (float): num of bits sent by the flow at cur_time.
 
         """
+        if "flow_rate" in self.data_metrics.disabled:
+            return
         self.data_metrics.update_flow_rate(flow_id, amt_sent, self.cur_time)
 
     def record_packet_rtt_time(self, flow_id, rtt):
@@ -6,6 +6,8 @@ class Node(object):
     Attributes:
         ns (NetworkSimulator): An instance of the NetworkSimulator class.
         node_id (string): The network address of the host or router.
+        index (int): The dense integer id of the node, assigned by the
+            NetworkSimulator when the node is added.
 
     """
     __metaclass__ = abc.ABCMeta
@@ -13,6 +15,7 @@ class Node(object):
     def __init__(self, ns, node_id):
         self.ns = ns
         self._node_id = node_id
+        self.index = None
 
     @property
     def node_id(self):
@@ -22,6 +25,16 @@ class Node(object):
     def node_id(self, value):
         raise AttributeError("Cannot modify node id")
 
+    def compile(self, num_nodes):
+        """Precomputes the node's integer-indexed lookup tables once the
+        topology is complete. Nodes without tables need not override this.
+
+        Args:
+            num_nodes (int): The number of nodes in the network.
+
+        """
+        return
+
     @abc.abstractmethod
     def send_packet(self, packet):
         """Sends a packet to another node. Must be implemented by host or
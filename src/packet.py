@@ -1,9 +1,14 @@
 from constants import *
 
 class Packet(object):
-    """A packet class that represents a packet being sent from a source to a 
+    """A packet class that represents a packet being sent from a source to a
     destination.
 
+    Packets are slotted and immutable by convention: the attributes below are
+    plain attributes for fast access on the hot path, and should never be
+    modified once the packet is sent (only a PacketPool may reinitialize a
+    packet that is no longer in use).
+
     Attributes:
         packet_id (int): An id identifying the packet
         src (string): The flow's source node id
@@ -11,67 +16,32 @@ class Packet(object):
         packet_size (float): The packet's size in bits
         flow_id (string): Unique id indicating flow
         timestamp (float): Time the packet was sent
+        dest_index (int): The integer index of the destination node, used by
+            routers to forward the packet
+        ecn (int): The packet's ECN codepoint (ECN_NOT_ECT, ECN_ECT or ECN_CE)
+        hops (int): The number of routers that forwarded the packet, counted
+            only when routing metrics are recorded
     """
 
-    def __init__(self, packet_id, src, dest, packet_size, flow_id, timestamp):
-        self._packet_id = packet_id
-        self._src = src
-        self._dest = dest
-        self._packet_size = packet_size
-        self._flow_id = flow_id
-        self._timestamp = timestamp
-
-    @property
-    def packet_id(self):
-        return self._packet_id
-
-    @packet_id.setter
-    def packet_id(self, packet_id):
-        raise AttributeError("Cannot modify id of a packet.")
-
-    @property
-    def src(self):
-        return self._src
-
-    @src.setter
-    def src(self, src):
-        raise AttributeError("Cannot modify a packet's source node.")
-
-    @property
-    def dest(self):
-        return self._dest
-
-    @dest.setter
-    def dest(self, dest):
-        raise AttributeError("Cannot modify a packet's destination node.")
-
-    @property
-    def packet_size(self):
-        return self._packet_size
-
-    @packet_size.setter
-    def packet_size(self, packet_size):
-        raise AttributeError("Cannot modify a packet's size.")
-
-    @property
-    def flow_id(self):
-        return self._flow_id
-
-    @flow_id.setter
-    def flow_id(self, flow_id):
-        raise AttributeError("Cannot modify a packet's flow id.")
-
-    @property
-    def timestamp(self):
-        return self._timestamp
+    __slots__ = ('packet_id', 'src', 'dest', 'packet_size', 'flow_id',
+                 'timestamp', 'dest_index', 'ecn', 'hops')
 
-    @timestamp.setter
-    def timestamp(self, timestamp):
-        raise AttributeError("Cannot modify timestamp of a packet.")
+    def __init__(self, packet_id, src, dest, packet_size, flow_id, timestamp,
+                 dest_index=-1):
+        self.packet_id = packet_id
+        self.src = src
+        self.dest = dest
+        self.packet_size = packet_size
+        self.flow_id = flow_id
+        self.timestamp = timestamp
+        self.dest_index = dest_index
+        self.ecn = ECN_NOT_ECT
+        self.hops = 0
 
 
 class DataPacket(Packet):
-    """A class that will represent data packets.
+    """A class that will represent data packets. Data packets are ECN capable,
+    so queues that use ECN mark them instead of dropping them.
 
     Attributes:
         packet_id (string): Unique id identifying the packet
@@ -81,26 +51,36 @@ class DataPacket(Packet):
         data (string): Data string being stored in the packet
     """
 
-    def __init__(self, packet_id, src, dest, flow_id, timestamp, data=""):
+    __slots__ = ('data',)
+
+    def __init__(self, packet_id, src, dest, flow_id, timestamp, data="",
+                 dest_index=-1):
         Packet.__init__(self, packet_id, src, dest, DATA_PACKET_SIZE, flow_id, \
-            timestamp)
+            timestamp, dest_index)
+        self.ecn = ECN_ECT
         self.data = data
 
 class RoutingPacket(Packet):
-    """A class that will represent routing table packets.
+    """A class that will represent routing table packets. The packet size
+    grows with the number of routes carried.
 
     Attributes:
         packet_id (string): An id identifying the packet
         src (string): The flow's source node id
         dest (string): The flow's destination node id
         flow_id (string): Unique id indicating flow
-        routing_table (dict): Routing table
+        entries (tuple): The advertised routes, an immutable snapshot of
+            (node_id, cost) tuples
     """
 
-    def __init__(self, packet_id, src, dest, flow_id, routing_table, timestamp):
-        Packet.__init__(self, packet_id, src, dest, ROUT_PACKET_SIZE, flow_id, \
-            timestamp)
-        self.routing_table = routing_table
+    __slots__ = ('entries',)
+
+    def __init__(self, packet_id, src, dest, flow_id, entries, timestamp,
+                 dest_index=-1):
+        Packet.__init__(self, packet_id, src, dest, \
+            ROUT_HEADER_SIZE + len(entries) * ROUT_ENTRY_SIZE, flow_id, \
+            timestamp, dest_index)
+        self.entries = tuple(entries)
 
 class AcknowledgementPacket(Packet):
     """A class that will represent acknowledgement packets.
@@ -110,8 +90,114 @@ class AcknowledgementPacket(Packet):
         src (string): The flow's source node id
         dest (string): The flow's destination node id
         flow_id (string): Unique id indicating flow
+        ece (bool): ECN echo, true if the acknowledged packet was marked
     """
 
-    def __init__(self, packet_id, src, dest, flow_id, timestamp):
+    __slots__ = ('ece',)
+
+    def __init__(self, packet_id, src, dest, flow_id, timestamp, dest_index=-1,
+                 ece=False):
         Packet.__init__(self, packet_id, src, dest, ACK_PACKET_SIZE, flow_id, \
-            timestamp)
+            timestamp, dest_index)
+        self.ece = ece
+
+
+class PacketPool(object):
+    """A free list that recycles data and acknowledgement packets once the
+    flow receiving them has consumed them.
+
+    A pool with a max_size of 0 never keeps released packets, so every
+    packet is freshly allocated.
+
+    Attributes:
+        max_size (int): The maximum number of free packets kept of each type.
+        num_allocated (int): Number of packets allocated by the pool.
+        num_reused (int): Number of packets handed out from the free lists.
+
+    """
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.num_allocated = 0
+        self.num_reused = 0
+        self._free_data = []
+        self._free_acks = []
+
+    def data_packet(self, packet_id, src, dest, flow_id, timestamp,
+                    dest_index=-1):
+        """Returns a data packet, reusing a released one if possible.
+
+        Args:
+            packet_id (int): Unique id identifying the packet
+            src (string): The flow's source node id
+            dest (string): The flow's destination node id
+            flow_id (string): Unique id indicating flow
+            timestamp (float): Time the packet was sent
+            dest_index (int): The integer index of the destination node
+
+        """
+        if self._free_data:
+            packet = self._free_data.pop()
+            packet.packet_id = packet_id
+            packet.src = src
+            packet.dest = dest
+            packet.flow_id = flow_id
+            packet.timestamp = timestamp
+            packet.dest_index = dest_index
+            packet.ecn = ECN_ECT
+            packet.hops = 0
+            packet.data = ""
+            self.num_reused += 1
+        else:
+            packet = DataPacket(packet_id, src, dest, flow_id, timestamp,
+                dest_index=dest_index)
+            self.num_allocated += 1
+        return packet
+
+    def acknowledgement_packet(self, packet_id, src, dest, flow_id, timestamp,
+                               dest_index=-1, ece=False):
+        """Returns an acknowledgement packet, reusing a released one if
+        possible.
+
+        Args:
+            packet_id (int): Unique id identifying the packet
+            src (string): The flow's source node id
+            dest (string): The flow's destination node id
+            flow_id (string): Unique id indicating flow
+            timestamp (float): Time the acknowledged packet was sent
+            dest_index (int): The integer index of the destination node
+            ece (bool): ECN echo, true if the acknowledged packet was marked
+
+        """
+        if self._free_acks:
+            packet = self._free_acks.pop()
+            packet.packet_id = packet_id
+            packet.src = src
+            packet.dest = dest
+            packet.flow_id = flow_id
+            packet.timestamp = timestamp
+            packet.dest_index = dest_index
+            packet.hops = 0
+            packet.ece = ece
+            self.num_reused += 1
+        else:
+            packet = AcknowledgementPacket(packet_id, src, dest, flow_id, \
+                timestamp, dest_index, ece)
+            self.num_allocated += 1
+        return packet
+
+    def release(self, packet):
+        """Returns a consumed packet to the pool. The caller must not keep any
+        reference to the packet afterwards.
+
+        Args:
+            packet (Packet): The packet that is no longer in use.
+
+        """
+        packet_type = type(packet)
+        if packet_type is DataPacket:
+            if len(self._free_data) < self.max_size:
+                self._free_data.append(packet)
+        elif packet_type is AcknowledgementPacket:
+            if len(self._free_acks) < self.max_size:
+                self._free_acks.append(packet)
@@ -0,0 +1,308 @@
+from array import array
+
+import numpy as np
+
+from constants import *
+from packet import DataPacket, RoutingPacket, AcknowledgementPacket
+
+# Packet type codes used by the columnar store.
+DATA_PACKET = 0
+ACKNOWLEDGEMENT_PACKET = 1
+ROUTING_PACKET = 2
+
+class ObjectPacketStore(object):
+    """The default packet backend. Packets stay regular Python objects and a
+    packet reference is simply the (packet, destination) tuple.
+
+    Links only access buffered packets through this interface, so the
+    columnar backend can be swapped in without changing them.
+
+    """
+
+    def put(self, packet, destination):
+        """Stores a packet that is about to wait on a link. The packet may
+        be recycled, so its fields must be read before it is stored.
+
+        Args:
+            packet (Packet): The packet to store.
+            destination (Node): The node the packet is travelling to.
+
+        Returns:
+            The reference of the stored packet.
+
+        """
+        return (packet, destination)
+
+    def take(self, ref):
+        """Removes a packet from the store.
+
+        Args:
+            ref: The reference of the stored packet.
+
+        Returns:
+            (packet, destination) tuple.
+
+        """
+        return ref
+
+    def packet_size(self, ref):
+        return ref[0].packet_size
+
+    def flow_id(self, ref):
+        return ref[0].flow_id
+
+    def mark_ecn(self, ref):
+        """Marks a stored packet as having experienced congestion.
+
+        Returns:
+            marked (bool): false if the packet is not ECN capable.
+
+        """
+        packet = ref[0]
+        if packet.ecn == ECN_NOT_ECT:
+            return False
+        packet.ecn = ECN_CE
+        return True
+
+
+class ColumnarPacketStore(object):
+    """A packet backend that keeps the fields of every buffered or in-flight
+    packet in preallocated, growable columns. A packet reference is an integer
+    handle (a row index), so links hold no per-packet Python objects.
+
+    Strings (node ids and flow ids) and destination nodes are interned into
+    integer codes. Routing entries and data payloads are kept aside since
+    they are not fixed-width.
+
+    Attributes:
+        packet_pool (PacketPool): pool used to rebuild packets taken out of
+            the store and to recycle the packets put into it.
+        packet_ids (array): packet id column.
+        srcs (array): source node id code column.
+        dests (array): destination node id code column.
+        dest_indices (array): destination node index column.
+        flows (array): flow id code column.
+        packet_sizes (array): packet size column in bits.
+        timestamps (array): timestamp column.
+        packet_types (array): packet type code column.
+        ecns (array): ECN codepoint column, or the ECN echo flag of
+            acknowledgement packets.
+        hops (array): hop count column.
+        destinations (array): code of the node the packet is travelling to.
+        live (array): 1 for rows that hold a packet, 0 for free rows.
+        num_live (int): number of packets currently in the store.
+
+    """
+
+    def __init__(self, packet_pool, capacity=1024):
+        self.packet_pool = packet_pool
+        self.num_live = 0
+
+        self.packet_ids = array('l')
+        self.srcs = array('i')
+        self.dests = array('i')
+        self.dest_indices = array('i')
+        self.flows = array('i')
+        self.packet_sizes = array('d')
+        self.timestamps = array('d')
+        self.packet_types = array('b')
+        self.ecns = array('b')
+        self.hops = array('i')
+        self.destinations = array('i')
+        self.live = array('b')
+
+        self._payload = {}
+        self._free = []
+
+        self._values = []
+        self._codes = {}
+        self._nodes = []
+        self._node_codes = {}
+
+        self._grow(capacity)
+
+    def _columns(self):
+        return (self.packet_ids, self.srcs, self.dests, self.dest_indices,
+                self.flows, self.packet_sizes, self.timestamps,
+                self.packet_types, self.ecns, self.hops, self.destinations,
+                self.live)
+
+    def _grow(self, extra):
+        """Adds extra free rows to every column."""
+        size = len(self.live)
+        for column in self._columns():
+            column.extend(array(column.typecode, [0]) * extra)
+        # Pop from the end so that low handles get reused first.
+        self._free.extend(range(size + extra - 1, size - 1, -1))
+
+    def _intern(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._values)
+            self._codes[value] = code
+            self._values.append(value)
+        return code
+
+    def _intern_node(self, node):
+        code = self._node_codes.get(node)
+        if code is None:
+            code = len(self._nodes)
+            self._node_codes[node] = code
+            self._nodes.append(node)
+        return code
+
+    def put(self, packet, destination):
+        """Writes a packet into a free row and recycles the packet object.
+
+        Args:
+            packet (Packet): The packet to store.
+            destination (Node): The node the packet is travelling to.
+
+        Returns:
+            handle (int): The row holding the packet.
+
+        """
+        if not self._free:
+            self._grow(len(self.live))
+        handle = self._free.pop()
+
+        self.packet_ids[handle] = packet.packet_id
+        self.srcs[handle] = self._intern(packet.src)
+        self.dests[handle] = self._intern(packet.dest)
+        self.dest_indices[handle] = packet.dest_index
+        self.flows[handle] = self._intern(packet.flow_id)
+        self.packet_sizes[handle] = packet.packet_size
+        self.timestamps[handle] = packet.timestamp
+        self.hops[handle] = packet.hops
+        self.destinations[handle] = self._intern_node(destination)
+        self.live[handle] = 1
+        self.num_live += 1
+
+        if isinstance(packet, RoutingPacket):
+            self.packet_types[handle] = ROUTING_PACKET
+            self.ecns[handle] = packet.ecn
+            self._payload[handle] = packet.entries
+        elif isinstance(packet, AcknowledgementPacket):
+            self.packet_types[handle] = ACKNOWLEDGEMENT_PACKET
+            self.ecns[handle] = packet.ece
+            self.packet_pool.release(packet)
+        else:
+            self.packet_types[handle] = DATA_PACKET
+            self.ecns[handle] = packet.ecn
+            if packet.data:
+                self._payload[handle] = packet.data
+            self.packet_pool.release(packet)
+
+        return handle
+
+    def take(self, handle):
+        """Rebuilds the packet stored in a row and frees the row.
+
+        Args:
+            handle (int): The row holding the packet.
+
+        Returns:
+            (packet, destination) tuple.
+
+        """
+        assert self.live[handle]
+        values = self._values
+        packet_id = self.packet_ids[handle]
+        src = values[self.srcs[handle]]
+        dest = values[self.dests[handle]]
+        dest_index = self.dest_indices[handle]
+        flow_id = values[self.flows[handle]]
+        timestamp = self.timestamps[handle]
+        packet_type = self.packet_types[handle]
+        ecn = self.ecns[handle]
+
+        if packet_type == DATA_PACKET:
+            packet = self.packet_pool.data_packet(packet_id, src, dest,
+                flow_id, timestamp, dest_index)
+            packet.data = self._payload.pop(handle, "")
+            packet.ecn = ecn
+        elif packet_type == ACKNOWLEDGEMENT_PACKET:
+            packet = self.packet_pool.acknowledgement_packet(packet_id, src,
+                dest, flow_id, timestamp, dest_index, bool(ecn))
+        else:
+            packet = RoutingPacket(packet_id, src, dest, flow_id,
+                self._payload.pop(handle), timestamp, dest_index)
+            packet.ecn = ecn
+        packet.hops = self.hops[handle]
+        destination = self._nodes[self.destinations[handle]]
+
+        self.live[handle] = 0
+        self.num_live -= 1
+        self._free.append(handle)
+
+        return packet, destination
+
+    def packet_size(self, handle):
+        return self.packet_sizes[handle]
+
+    def flow_id(self, handle):
+        return self._values[self.flows[handle]]
+
+    def mark_ecn(self, handle):
+        """Marks a stored packet as having experienced congestion.
+
+        Returns:
+            marked (bool): false if the packet is not ECN capable.
+
+        """
+        if self.packet_types[handle] == ACKNOWLEDGEMENT_PACKET or \
+            self.ecns[handle] == ECN_NOT_ECT:
+            return False
+        self.ecns[handle] = ECN_CE
+        return True
+
+    def column(self, name):
+        """Returns a zero-copy NumPy view of a column. The view is only valid
+        until the store grows, so it should not be kept across events.
+
+        Args:
+            name (str): the column name, e.g. "packet_sizes".
+
+        """
+        column = getattr(self, name)
+        return np.frombuffer(column, dtype=np.dtype(column.typecode))
+
+    def total_size(self, handles):
+        """Returns the total size in bits of the given packets.
+
+        Args:
+            handles (iterable): the handles of the packets, e.g. the contents
+                of a link buffer.
+
+        """
+        handles = np.fromiter(handles, dtype=np.intp)
+        return self.column("packet_sizes")[handles].sum()
+
+    def live_size(self):
+        """Returns the total size in bits of every packet in the store, i.e.
+        of every packet buffered or in flight on a link.
+
+        """
+        live = self.column("live").astype(bool)
+        return self.column("packet_sizes")[live].sum()
+
+    def snapshot(self):
+        """Returns a copy of the columns of every live packet.
+
+        Returns:
+            snapshot (dict): column name to NumPy array, plus "handle" for the
+                row of each packet. Code columns can be decoded with
+                decode().
+
+        """
+        live = self.column("live").astype(bool)
+        snapshot = {"handle": np.nonzero(live)[0]}
+        for name in ("packet_ids", "srcs", "dests", "dest_indices", "flows",
+                     "packet_sizes", "timestamps", "packet_types", "ecns",
+                     "hops", "destinations"):
+            snapshot[name] = self.column(name)[live].copy()
+        return snapshot
+
+    def decode(self, code):
+        """Returns the string interned as code."""
+        return self._values[code]
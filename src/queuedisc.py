@@ -0,0 +1,361 @@
+import abc
+import math
+import random
+
+from constants import *
+
+# Verdicts returned by queue disciplines
+ACCEPT = 0
+DROP = 1
+MARK = 2
+
+class QueueDiscipline(object):
+    """The active queue management policy of a link buffer.
+
+    A transmitter asks its queue discipline whether to accept, drop or ECN
+    mark every packet it enqueues, and, if decides_on_dequeue is set, every
+    packet it is about to start transmitting. A packet that is not ECN
+    capable is dropped instead of marked.
+
+    Every discipline also enforces the link's byte-based max_buffer_size, so
+    a full buffer always drops.
+
+    Attributes:
+        link (Link): the link whose buffer is managed.
+        ecn (bool): if true, congestion is signalled by marking packets
+            rather than dropping them.
+        decides_on_dequeue (bool): true if dequeue() must be called.
+
+    """
+    __metaclass__ = abc.ABCMeta
+
+    decides_on_dequeue = False
+
+    def __init__(self, link, ecn=False):
+        self.link = link
+        self.ecn = ecn
+
+    def fits(self, packet, buffer_size):
+        """Returns true if the packet fits in the buffer.
+
+        Args:
+            packet (Packet): the packet being enqueued.
+            buffer_size (float): the amount of data in the buffer in bits.
+
+        """
+        return buffer_size + packet.packet_size <= self.link.max_buffer_size
+
+    def congestion_verdict(self):
+        """Returns the verdict signalling congestion for a packet."""
+        return MARK if self.ecn else DROP
+
+    @abc.abstractmethod
+    def enqueue(self, packet, buffer_size, queue_length, now):
+        """Decides what to do with a packet arriving at the buffer.
+
+        Args:
+            packet (Packet): the arriving packet.
+            buffer_size (float): the amount of data in the buffer in bits.
+            queue_length (int): the number of packets in the buffer.
+            now (float): the current time.
+
+        Returns:
+            verdict (int): ACCEPT, DROP or MARK.
+
+        """
+        return ACCEPT
+
+    def dequeue(self, sojourn_time, buffer_size, now):
+        """Decides what to do with the packet at the head of the buffer when
+        its transmission is about to start.
+
+        Args:
+            sojourn_time (float): how long the packet has waited.
+            buffer_size (float): the amount of data left behind the packet.
+                The analytic link engine decides when the packet is
+                enqueued, before anything has arrived behind it, and passes
+                the data queued ahead of the packet instead.
+            now (float): the time the packet is dequeued.
+
+        Returns:
+            verdict (int): ACCEPT, DROP or MARK.
+
+        """
+        return ACCEPT
+
+
+class DropTail(QueueDiscipline):
+    """Accepts packets until the buffer is full."""
+
+    def enqueue(self, packet, buffer_size, queue_length, now):
+        if self.fits(packet, buffer_size):
+            return ACCEPT
+        return DROP
+
+
+class RED(QueueDiscipline):
+    """Random Early Detection (Floyd and Jacobson, 1993).
+
+    Keeps an exponentially weighted moving average of the queue length and
+    signals congestion with a probability that grows linearly between the
+    minimum and maximum thresholds.
+
+    Attributes:
+        min_threshold (float): average queue length in packets below which
+            no packet is dropped.
+        max_threshold (float): average queue length in packets above which
+            every packet is dropped.
+        max_probability (float): drop probability at max_threshold.
+        weight (float): weight of the newest sample in the average.
+        average (float): the average queue length in packets.
+        count (int): packets accepted since the last drop or mark.
+        idle_since (float): when the last packet was dequeued, or when the
+            last packet arrived at an empty queue if that was later.
+
+    """
+
+    # Dequeues are only watched to notice when the queue becomes empty. An
+    # arrival at an empty queue follows the dequeue of the last packet, so
+    # the time of the last dequeue is when the queue went idle, under both
+    # link engines.
+    decides_on_dequeue = True
+
+    def __init__(self, link, ecn=False, min_threshold=RED_MIN_THRESHOLD,
+                 max_threshold=RED_MAX_THRESHOLD,
+                 max_probability=RED_MAX_PROBABILITY,
+                 weight=RED_QUEUE_WEIGHT):
+        QueueDiscipline.__init__(self, link, ecn)
+        self.min_threshold = float(min_threshold)
+        self.max_threshold = float(max_threshold)
+        self.max_probability = float(max_probability)
+        self.weight = float(weight)
+        self.average = 0.0
+        self.count = -1
+        self.idle_since = 0.0
+        self._random = random.Random(link.link_id)
+
+    def enqueue(self, packet, buffer_size, queue_length, now):
+        if queue_length > 0:
+            self.average += self.weight * (queue_length - self.average)
+        else:
+            # Decay the average as if small packets had been sent while idle.
+            idle_packets = (now - self.idle_since) * self.link.capacity \
+                / DATA_PACKET_SIZE
+            self.average *= (1 - self.weight) ** idle_packets
+            self.idle_since = now
+
+        if not self.fits(packet, buffer_size):
+            return DROP
+
+        if self.average < self.min_threshold:
+            self.count = -1
+            return ACCEPT
+        if self.average >= self.max_threshold:
+            self.count = 0
+            return DROP
+
+        self.count += 1
+        base = self.max_probability * (self.average - self.min_threshold) \
+            / (self.max_threshold - self.min_threshold)
+        if self.count * base >= 1:
+            probability = 1.0
+        else:
+            probability = base / (1 - self.count * base)
+        if self._random.random() < probability:
+            self.count = 0
+            return self.congestion_verdict()
+        return ACCEPT
+
+    def dequeue(self, sojourn_time, buffer_size, now):
+        self.idle_since = now
+        return ACCEPT
+
+
+class CoDel(QueueDiscipline):
+    """Controlled Delay (RFC 8289).
+
+    Signals congestion at dequeue time once packets have spent more than
+    target in the queue for a whole interval, then at a rate that grows with
+    the square root of the number of signals.
+
+    Attributes:
+        target (float): acceptable standing queue delay in seconds.
+        interval (float): how long the delay must persist in seconds.
+        dropping (bool): true while in the dropping state.
+        count (int): packets dropped or marked in the dropping state.
+        last_count (int): count when the last dropping state was left.
+        first_above_time (float): when the sojourn time will have been above
+            target for an interval, or 0.
+        drop_next (float): when the next packet will be dropped or marked.
+
+    """
+
+    decides_on_dequeue = True
+
+    def __init__(self, link, ecn=False, target=CODEL_TARGET * S_TO_MS,
+                 interval=CODEL_INTERVAL * S_TO_MS):
+        QueueDiscipline.__init__(self, link, ecn)
+        self.target = target * MS_TO_S
+        self.interval = interval * MS_TO_S
+        self.dropping = False
+        self.count = 0
+        self.last_count = 0
+        self.first_above_time = 0.0
+        self.drop_next = 0.0
+
+    def enqueue(self, packet, buffer_size, queue_length, now):
+        if self.fits(packet, buffer_size):
+            return ACCEPT
+        return DROP
+
+    def control_law(self, t):
+        return t + self.interval / math.sqrt(self.count)
+
+    def ok_to_drop(self, sojourn_time, buffer_size, now):
+        if sojourn_time < self.target or buffer_size <= DATA_PACKET_SIZE:
+            self.first_above_time = 0.0
+            return False
+        if self.first_above_time == 0.0:
+            self.first_above_time = now + self.interval
+            return False
+        return now >= self.first_above_time
+
+    def dequeue(self, sojourn_time, buffer_size, now):
+        ok_to_drop = self.ok_to_drop(sojourn_time, buffer_size, now)
+        if self.dropping:
+            if not ok_to_drop:
+                self.dropping = False
+            elif now >= self.drop_next:
+                self.count += 1
+                self.drop_next = self.control_law(self.drop_next)
+                return self.congestion_verdict()
+            return ACCEPT
+
+        if ok_to_drop:
+            self.dropping = True
+            delta = self.count - self.last_count
+            if delta > 1 and now - self.drop_next < 16 * self.interval:
+                self.count = delta
+            else:
+                self.count = 1
+            self.last_count = self.count
+            self.drop_next = self.control_law(now)
+            return self.congestion_verdict()
+        return ACCEPT
+
+
+class PIE(QueueDiscipline):
+    """Proportional Integral controller Enhanced (RFC 8033).
+
+    Periodically updates a drop probability from the queueing delay, which
+    is estimated from the amount of data in the buffer and the link
+    capacity, and drops or marks arriving packets with that probability.
+    The periodic updates are applied lazily when packets arrive.
+
+    Attributes:
+        target (float): target queueing delay in seconds.
+        update_period (float): time between probability updates in seconds.
+        alpha (float): weight of the delay error in Hz.
+        beta (float): weight of the delay trend in Hz.
+        max_burst (float): how long bursts are let through in seconds.
+        probability (float): the current drop probability.
+        burst_allowance (float): time left in the current burst allowance.
+        qdelay_old (float): the queueing delay at the previous update.
+        next_update (float): when the probability is next updated.
+
+    """
+
+    def __init__(self, link, ecn=False, target=PIE_TARGET * S_TO_MS,
+                 update_period=PIE_UPDATE_PERIOD * S_TO_MS, alpha=PIE_ALPHA,
+                 beta=PIE_BETA, max_burst=PIE_MAX_BURST * S_TO_MS):
+        QueueDiscipline.__init__(self, link, ecn)
+        self.target = target * MS_TO_S
+        self.update_period = update_period * MS_TO_S
+        self.alpha = alpha
+        self.beta = beta
+        self.max_burst = max_burst * MS_TO_S
+        self.probability = 0.0
+        self.burst_allowance = self.max_burst
+        self.qdelay_old = 0.0
+        self.next_update = self.update_period
+        self._random = random.Random(link.link_id)
+
+    def update_probability(self, qdelay):
+        """Runs one periodic update of the drop probability.
+
+        Args:
+            qdelay (float): the current queueing delay in seconds.
+
+        """
+        delta = self.alpha * (qdelay - self.target) \
+            + self.beta * (qdelay - self.qdelay_old)
+        # Scale the adjustment down while the probability is small so it
+        # does not jump from 0 to a large value.
+        for threshold, scale in ((0.000001, 2048), (0.00001, 512),
+                                 (0.0001, 128), (0.001, 32), (0.01, 8),
+                                 (0.1, 2)):
+            if self.probability < threshold:
+                delta /= scale
+                break
+        self.probability += delta
+
+        if qdelay == 0 and self.qdelay_old == 0:
+            self.probability *= 0.98
+        self.probability = min(max(self.probability, 0.0), 1.0)
+
+        if self.burst_allowance > 0:
+            self.burst_allowance = max(self.burst_allowance \
+                - self.update_period, 0.0)
+        if self.probability == 0 and qdelay < self.target / 2 \
+            and self.qdelay_old < self.target / 2:
+            self.burst_allowance = self.max_burst
+        self.qdelay_old = qdelay
+
+    def enqueue(self, packet, buffer_size, queue_length, now):
+        qdelay = buffer_size / self.link.capacity
+        while now >= self.next_update:
+            self.update_probability(qdelay)
+            self.next_update += self.update_period
+
+        if not self.fits(packet, buffer_size):
+            return DROP
+        if self.burst_allowance > 0 or self.probability == 0:
+            return ACCEPT
+        if self.qdelay_old < self.target / 2 and self.probability < 0.2:
+            return ACCEPT
+        if buffer_size <= 2 * DATA_PACKET_SIZE:
+            return ACCEPT
+        if self._random.random() < self.probability:
+            if self.ecn and self.probability <= PIE_MAX_ECN_PROBABILITY:
+                return MARK
+            return DROP
+        return ACCEPT
+
+
+QUEUE_DISCIPLINES = {
+    "droptail": DropTail,
+    "red": RED,
+    "codel": CoDel,
+    "pie": PIE,
+}
+
+def make_queue_discipline(link, spec):
+    """Creates a queue discipline from its description.
+
+    Args:
+        link (Link): the link whose buffer is managed.
+        spec (str or dict): None or the name of the discipline, or a dict
+            with the name under "type" and the discipline's parameters, e.g.
+            {"type": "codel", "ecn": true, "target": 5, "interval": 100}.
+            Times are in ms and RED thresholds in packets.
+
+    """
+    if spec is None:
+        spec = {}
+    elif not isinstance(spec, dict):
+        spec = {"type": spec}
+    params = dict(spec)
+    name = params.pop("type", "droptail").lower()
+    if name not in QUEUE_DISCIPLINES:
+        raise Exception("Unknown queue discipline %s" % name)
+    return QUEUE_DISCIPLINES[name](link, **params)
@@ -0,0 +1,183 @@
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from constants import *
+
+# The figure each process draws on, reused from one plot to the next.
+_figure = None
+
+def lttb(x, y, num_points):
+    """Downsamples a line with Largest-Triangle-Three-Buckets (Steinarsson,
+    2013), which keeps the points that most change the shape of the line,
+    so that peaks and drops survive.
+
+    The first and last points are kept, and the points between are split
+    into num_points - 2 buckets of the same size. From each bucket, the
+    point kept is the one forming the largest triangle with the point kept
+    from the bucket before and the mean of the bucket after.
+
+    Args:
+        x (ndarray): the x coordinates of the line, in order.
+        y (ndarray): the y coordinates of the line.
+        num_points (int): the number of points to keep, at least 3.
+
+    Returns:
+        (x, y) of the points kept, or the line itself if it has no more
+        than num_points points.
+
+    """
+    size = len(x)
+    if num_points >= size or num_points < 3:
+        return x, y
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # bounds[i]:bounds[i + 1] is bucket i of the points between the ends.
+    bounds = (1 + np.arange(num_points - 1) * (size - 2.0) /
+        (num_points - 2)).astype(int)
+    bounds[-1] = size - 1
+    counts = np.diff(bounds)
+    means_x = np.add.reduceat(x[1:size - 1], bounds[:-1] - 1) / counts
+    means_y = np.add.reduceat(y[1:size - 1], bounds[:-1] - 1) / counts
+    # The bucket after the last one is the last point.
+    means_x = np.append(means_x[1:], x[-1])
+    means_y = np.append(means_y[1:], y[-1])
+
+    kept = np.empty(num_points, dtype=int)
+    kept[0] = 0
+    kept[-1] = size - 1
+    previous = 0
+    for bucket in xrange(num_points - 2):
+        start = bounds[bucket]
+        stop = bounds[bucket + 1]
+        previous_x = x[previous]
+        previous_y = y[previous]
+        # Twice the area of the triangle, which has the same maximum.
+        areas = np.abs((previous_x - means_x[bucket]) *
+            (y[start:stop] - previous_y) -
+            (previous_x - x[start:stop]) * (means_y[bucket] - previous_y))
+        previous = start + int(areas.argmax())
+        kept[bucket + 1] = previous
+    return x[kept], y[kept]
+
+def downsample(lines, max_points=PLOT_MAX_POINTS):
+    """Returns the (label, x, y) lines of a plot with each line downsampled
+    to at most max_points points with lttb(), or unchanged if max_points is
+    None.
+
+    """
+    if max_points is None:
+        return lines
+    return [(label,) + lttb(x, y, max_points) for label, x, y in lines]
+
+def get_figure():
+    """Returns the figure of this process, cleared, creating it on the Agg
+    canvas the first time. Reusing it saves setting up a figure and its
+    canvas for every plot.
+
+    """
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=PLOT_FIGURE_SIZE)
+        FigureCanvasAgg(_figure)
+    else:
+        _figure.clf()
+    return _figure
+
+def render_plot(job):
+    """Draws a plot to a file, the way the DataMetrics plot methods show it.
+
+    Args:
+        job (tuple): (path, ylabel, lines), where path is the file to write,
+            whose extension sets the format, e.g. .png or .svg, ylabel the
+            label of the y axis, and lines a list of (label, x, y) lines.
+
+    Returns:
+        The path of the file.
+
+    """
+    path, ylabel, lines = job
+    figure = get_figure()
+    axes = figure.add_subplot(111)
+    for _, x, y in lines:
+        axes.plot(x, y, '--', linewidth=2.0, dashes=(4, 1.5))
+    axes.legend([label for label, _, _ in lines], fontsize=30)
+    axes.set_xlabel('Time (s)', fontsize=30)
+    axes.set_ylabel(ylabel, fontsize=30)
+    axes.tick_params(labelsize=25)
+    figure.savefig(path, dpi=PLOT_DPI)
+    return path
+
+def draw_heatmap(figure, series_ids, edges, matrix, label):
+    """Draws a series x time heatmap on a figure, one row per series and one
+    column per time bin, with a color bar. Rows are labeled by series id if
+    there are at most HEATMAP_MAX_LABELS of them.
+
+    Args:
+        figure (Figure): the figure to draw on.
+        series_ids (list): the ids of the rows.
+        edges (ndarray): the edges of the time bins.
+        matrix (ndarray): the value of each series in each bin.
+        label (str): the label of the color bar.
+
+    """
+    axes = figure.add_subplot(111)
+    axes.set_xlabel('Time (s)', fontsize=30)
+    axes.tick_params(labelsize=25)
+    if not series_ids:
+        return
+    image = axes.imshow(matrix, aspect='auto', interpolation='nearest', \
+        cmap='viridis', extent=(edges[0], edges[-1], len(series_ids), 0))
+    colorbar = figure.colorbar(image, ax=axes)
+    colorbar.set_label(label, fontsize=30)
+    colorbar.ax.tick_params(labelsize=25)
+    if len(series_ids) <= HEATMAP_MAX_LABELS:
+        axes.set_yticks(np.arange(len(series_ids)) + 0.5)
+        # Rows get smaller with more of them, and so do their labels.
+        axes.set_yticklabels(series_ids, \
+            fontsize=min(25, 500.0 / len(series_ids)))
+    else:
+        axes.set_ylabel('Links', fontsize=30)
+
+def render_heatmap(job):
+    """Draws a heatmap to a file.
+
+    Args:
+        job (tuple): (path, series_ids, edges, matrix, label), see
+            draw_heatmap().
+
+    Returns:
+        The path of the file.
+
+    """
+    path, series_ids, edges, matrix, label = job
+    figure = get_figure()
+    draw_heatmap(figure, series_ids, edges, matrix, label)
+    figure.savefig(path, dpi=PLOT_DPI)
+    return path
+
+def render_plots(jobs, processes=None):
+    """Draws plots to files in a pool of processes, each reusing its figure.
+
+    Args:
+        jobs (list): the jobs of render_plot().
+        processes (int): the number of processes, by default one per CPU. A
+            single process draws every plot itself.
+
+    Returns:
+        The paths of the files, in the order of the jobs.
+
+    """
+    if processes is None:
+        processes = cpu_count()
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [render_plot(job) for job in jobs]
+    pool = Pool(processes)
+    try:
+        return pool.map(render_plot, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,192 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import constants
+from constants import *
+from datametrics import DataMetrics
+
+# The hash of the simulator source, computed once per process.
+_source_hash = None
+
+def source_hash():
+    """Returns a hash of the source files of the simulator, so that results
+    cached by another version of the code are not reused.
+
+    """
+    global _source_hash
+    if _source_hash is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+            digest.update(os.path.basename(path))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        _source_hash = digest.hexdigest()
+    return _source_hash
+
+def effective_constants():
+    """Returns the current value of every constant in constants.py that can
+    be written as JSON, by name.
+
+    """
+    values = {}
+    for name, value in vars(constants).iteritems():
+        if name.isupper():
+            try:
+                json.dumps(value)
+            except TypeError:
+                continue
+            values[name] = value
+    return values
+
+class ResultCache(object):
+    """An on-disk cache of simulation results, so that running a scenario
+    that already ran loads its results instead of simulating it again.
+
+    A result is keyed by a hash of the network description, normalized by
+    sorting its keys, the simulator options, the values of the constants
+    and the source of the simulator, so changing any of them misses the
+    cache. Each result is two files in the cache directory: the data
+    metrics as a trace file, see DataMetrics.save, which is memory-mapped
+    when loaded, and a JSON file with the flow and link summaries and the
+    state of the simulator at the end of the run.
+
+    The cache is kept under max_bytes by deleting the results used least
+    recently. A result is marked as used by updating the modification time
+    of its files.
+
+    Attributes:
+        directory (str): the directory of the cached results
+        max_bytes (int): the most bytes the cached results may take
+        hits (int): the number of results found in the cache
+        misses (int): the number of results not found in the cache
+
+    """
+
+    def __init__(self, directory, max_bytes=RESULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, network, options):
+        """Returns the key of the results of a simulation.
+
+        Args:
+            network (dict): the "network" of the network description.
+            options (dict): anything else the results depend on, such as
+                the options of the simulator. Must be serializable as JSON.
+
+        """
+        scenario = {
+            "network": network,
+            "options": options,
+            "constants": effective_constants(),
+            "source": source_hash(),
+        }
+        return hashlib.sha256(json.dumps(scenario, sort_keys=True,
+            separators=(",", ":"))).hexdigest()
+
+    def paths(self, key):
+        """Returns the paths of the trace and JSON files of a result."""
+        path = os.path.join(self.directory, key)
+        return path + ".trace", path + ".json"
+
+    def get(self, key):
+        """Returns the (data_metrics, results) of a cached result, where
+        results is the dict given to put(), or None if it is not cached. A
+        result that cannot be read, e.g. with a truncated trace, is deleted.
+
+        """
+        trace_path, results_path = self.paths(key)
+        if not os.path.exists(results_path):
+            self.misses += 1
+            return None
+        try:
+            with open(results_path) as f:
+                results = json.load(f)
+            data_metrics = DataMetrics.open(trace_path)
+        except (IOError, OSError, ValueError):
+            self.remove(key)
+            self.misses += 1
+            return None
+        now = time.time()
+        for path in (trace_path, results_path):
+            os.utime(path, (now, now))
+        self.hits += 1
+        return data_metrics, results
+
+    def put(self, key, data_metrics, results):
+        """Caches the results of a simulation, then deletes the results used
+        least recently until the cache fits in max_bytes.
+
+        Args:
+            key (str): the key of the results.
+            data_metrics (DataMetrics): the data metrics of the simulation.
+            results (dict): anything else to cache, as JSON.
+
+        """
+        trace_path, results_path = self.paths(key)
+        results = dict(results)
+        results["summary"] = data_metrics.summary()
+        results["link_summary"] = data_metrics.link_summary()
+        # The trace goes first, so a result with a JSON file is complete.
+        data_metrics.save(trace_path)
+        fd, temporary = tempfile.mkstemp(suffix=".tmp", prefix=key + ".",
+            dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(results, f)
+            os.rename(temporary, results_path)
+        except:
+            os.remove(temporary)
+            raise
+        self.evict()
+
+    def entries(self):
+        """Returns (last used, bytes, key) of each cached result."""
+        entries = []
+        for results_path in glob.glob(os.path.join(self.directory, "*.json")):
+            key = os.path.basename(results_path)[:-len(".json")]
+            size = 0
+            used = 0
+            for path in self.paths(key):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                size += stat.st_size
+                used = max(used, stat.st_mtime)
+            entries.append((used, size, key))
+        return entries
+
+    def evict(self):
+        """Deletes the results used least recently until the cache fits in
+        max_bytes.
+
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        """Deletes a cached result."""
+        # The JSON file goes first, so a result is never half present.
+        for path in reversed(self.paths(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Deletes every cached result."""
+        for _, _, key in self.entries():
+            self.remove(key)
@@ -1,3 +1,8 @@
+import math
+import random
+import zlib
+
+from indexedheap import IndexedMinHeap
 from node import Node
 from packet import RoutingPacket
 from constants import *
@@ -12,19 +17,64 @@ class Router(Node):
         routing_table (dict): The routing table for the router.
             { node_id : (link, cost) }
         cost_table (dict): The table detailing the cost of taking a specific
-            link to a specific destination.
-            { node_id : {link_id : cost}}
+            link to a specific destination. The links of each destination
+            are kept in an indexed min-heap, so the best link is found in
+            O(1) and a cost is changed in O(log links).
+            { node_id : IndexedMinHeap {link_id : cost}}
+        link_destinations (dict): The destinations each link has a cost for
+            in the cost table, so a change in the link's cost only touches
+            them.
+            { link_id : set(node_id) }
+        dirty_routes (set): The destinations whose costs changed since the
+            routing table was last updated.
         adj_link_costs (dict): The table of adjacent link costs.
             { link_id : cost }
+        next_hop (list): The routing table compiled into an array of outgoing
+            links indexed by destination node index.
+        router_links (list): The links to adjacent routers, with the adjacent
+            router. [ (link, router) ]
+        ecmp (string): "off" to send every packet for a destination on the
+            link of its route, "hash" to spread flows over every equal-cost
+            link, or "weighted" to also use loop-free links whose path costs
+            at most ECMP_MAX_STRETCH times the best, with shares inversely
+            proportional to the path costs.
+        routing_metrics (bool): True if the router records routing metrics.
+        max_hops (int): The number of routers in the network. A packet
+            forwarded by more routers than this is in a loop.
+        multipath (list): For each destination node index, None if the
+            destination has a single next hop, otherwise a (links, weights)
+            tuple that flows are hashed onto. The weights are None for equal
+            shares.
+        changed_routes (set): The destinations whose routes changed since the
+            router last advertised them.
+        update_pending (bool): True while a triggered update is scheduled.
+        last_update_time (float): When the last triggered update was sent.
+        hold_downs (dict): The routes that got worse and are held down.
+            { node_id : (hold down end time, cost before getting worse) }
 
     """
 
-    def __init__(self, ns, node_id):
+    def __init__(self, ns, node_id, ecmp="off"):
         Node.__init__(self, ns, node_id)
+        if ecmp not in ("off", "hash", "weighted"):
+            raise Exception("Unknown ECMP mode %s" % ecmp)
+        self.ecmp = ecmp
+        self.multipath = []
+        self.routing_metrics = ns.routing_metrics
+        self.max_hops = 0
         self.links = {}
         self.routing_table = {}
         self.cost_table = {}
+        self.link_destinations = {}
+        self.dirty_routes = set()
         self.adj_link_costs = {}
+        self.next_hop = []
+        self.router_links = []
+        self.changed_routes = set()
+        self.update_pending = False
+        self.last_update_time = -TRIGGERED_UPDATE_INTERVAL
+        self.hold_downs = {}
+        self._random = random.Random(node_id)
 
     def add_links(self, links):
         """Add a dictionary of links to the router.
@@ -38,10 +88,36 @@ class Router(Node):
             # Add the link to the link dictionary.
             self.links[link.link_id] = link
 
-        # Now that we have links, we can start the first routing cycle
-        event = lambda: self.start_routing_cycle()
-        description = "Router.start_routing_cycle on router %s" % self.node_id
-        self.ns.add_event(event, description)
+        # Now that we have links, we can start the first routing cycle. In
+        # link-state mode, the simulator's routing oracle routes instead.
+        if self.ns.routing == "distance_vector":
+            event = lambda: self.start_routing_cycle()
+            description = \
+                "Router.start_routing_cycle on router %s" % self.node_id
+            self.ns.add_event(event, description)
+
+    def compile(self, num_nodes):
+        """Builds the next hop array and the list of links to adjacent
+        routers.
+
+        Args:
+            num_nodes (int): The number of nodes in the network.
+
+        """
+        self.next_hop = [None] * num_nodes
+        self.multipath = [None] * num_nodes
+        for node_id, (link, cost) in self.routing_table.iteritems():
+            self.next_hop[self.ns.nodes[node_id].index] = link
+
+        self.max_hops = len([node for node in self.ns.nodes.itervalues()
+            if isinstance(node, Router)])
+
+        self.router_links = []
+        for link in self.links.itervalues():
+            other_node = link.nodes[1] if link.nodes[0] is self \
+                else link.nodes[0]
+            if isinstance(other_node, Router):
+                self.router_links.append((link, other_node))
 
     def send_packet(self, packet):
         """Sends a packet to another node.
@@ -51,10 +127,19 @@ class Router(Node):
 
         """
 
-        # Use the routing table to send a packet to the right node
-        link = self.routing_table[packet.dest][0]
+        # Use the next hop array to send a packet to the right node
+        paths = self.multipath[packet.dest_index]
+        if paths is None:
+            link = self.next_hop[packet.dest_index]
+        else:
+            link = self.select_path(paths, packet.flow_id)
+
+        if self.routing_metrics:
+            packet.hops += 1
+            if packet.hops == self.max_hops + 1:
+                self.ns.record_routing_loop(self.node_id)
 
-        event = lambda: link.add_packet(packet, self.node_id)
+        event = lambda: link.add_packet(packet, self.index)
         description = "Link.add_packet() with packet %d" % packet.packet_id
         self.ns.add_event(event, description)
 
@@ -78,12 +163,13 @@ class Router(Node):
             self.send_packet(packet)
 
     def start_routing_cycle(self):
-        """Begins a routing cycle."""
+        """Begins a routing cycle, which advertises the whole routing table."""
 
         self.update_adj_link_costs()
         self.update_routing_table()
 
         self.send_routing_packets()
+        self.changed_routes.clear()
 
         next_cycle_event = lambda: self.start_routing_cycle()
         next_description = \
@@ -92,22 +178,68 @@ class Router(Node):
             next_description,
             delay=REROUTE_PERIOD)
 
-    def send_routing_packets(self):
-        """Sends out the routing table to all of the router's links."""
+    def send_routing_packets(self, node_ids=None):
+        """Sends out routes to all of the router's adjacent routers.
 
-        for link in self.links.itervalues():
+        Poison reverse - To improve convergence rates, a route that goes
+        through the adjacent router is advertised to it with an infinite
+        cost, to avoid cycles.
+
+        Args:
+            node_ids (iterable): The destinations to advertise, or None to
+                advertise the whole routing table.
+
+        """
+        if node_ids is None:
+            node_ids = self.routing_table
+        routes = [(node_id, self.routing_table[node_id])
+            for node_id in sorted(node_ids)]
+
+        for link, router in self.router_links:
             src = self.node_id
-            dest = link.get_other_node_id(self.node_id)
-            if dest[0] == "H":
-                continue
-            packet = RoutingPacket(-1, src, dest, None, self.routing_table, \
-                self.ns.cur_time)
+            dest = router.node_id
+            entries = tuple((node_id, float('inf') if route_link is link
+                else cost) for node_id, (route_link, cost) in routes)
+            packet = RoutingPacket(-1, src, dest, None, entries, \
+                self.ns.cur_time, router.index)
+            if self.routing_metrics:
+                self.ns.record_routing_packet_sent(self.node_id,
+                    packet.packet_size)
             event = lambda link=link, packet=packet: \
-                link.add_packet(packet, self.node_id)
+                link.add_packet(packet, self.index)
             description = "Link.add_packet() with routing packet from %s to %s"\
                 % (src, dest)
             self.ns.add_event(event, description)
 
+    def trigger_update(self):
+        """Schedules a triggered update advertising the routes that changed.
+
+        Triggered updates are rate limited to one every
+        TRIGGERED_UPDATE_INTERVAL, and delayed by a random jitter so that
+        neighbouring routers do not update in lockstep. Changes made while an
+        update is pending are sent with it.
+
+        """
+        if self.update_pending:
+            return
+        self.update_pending = True
+
+        earliest = max(self.ns.cur_time,
+            self.last_update_time + TRIGGERED_UPDATE_INTERVAL)
+        delay = earliest - self.ns.cur_time + \
+            self._random.uniform(0, TRIGGERED_UPDATE_JITTER)
+        event = lambda: self.send_triggered_update()
+        description = "Router.send_triggered_update on router %s" % self.node_id
+        self.ns.add_event(event, description, delay)
+
+    def send_triggered_update(self):
+        """Sends the routes that changed since they were last advertised."""
+        self.update_pending = False
+        if self.changed_routes:
+            self.last_update_time = self.ns.cur_time
+            self.send_routing_packets(self.changed_routes)
+            self.changed_routes.clear()
+
     def receive_routing_packet(self, routing_packet, adj_link_id):
         """Receives a routing packet and updates the routing table if necessary.
 
@@ -118,60 +250,194 @@ class Router(Node):
 
         """
 
+        if self.routing_metrics:
+            self.ns.record_routing_packet_received(self.node_id)
         adj_cost = self.adj_link_costs[adj_link_id]
-        
-        for node_id, (link, cost) in routing_packet.routing_table.iteritems():
+
+        for node_id, cost in routing_packet.entries:
             # No need to put self in routing table
             if node_id == self.node_id:
                 continue
 
-            # Poison reverse - To improve convergence rates
-            # If the path used by the adjacent node to get to destination
-            # includes current node (self), then we set cost to infinity
-            # to avoid cycles.
-            if link.link_id == adj_link_id:
-                cost = float('inf')
-
-            if node_id not in self.cost_table:
-                self.cost_table[node_id] = {}
-
-            new_cost = cost + adj_cost
-            self.cost_table[node_id][adj_link_id] = new_cost
+            self.set_cost(node_id, adj_link_id, cost + adj_cost)
 
         changed = self.update_routing_table()
 
-        # If we do update the routing table, send out routing packets
+        # If we do update the routing table, advertise the changes
         if changed:
-            self.send_routing_packets()
+            self.trigger_update()
+
+    def end_hold_down(self, node_id):
+        """Releases a held down route, and advertises it if it changed."""
+        self.dirty_routes.add(node_id)
+        if self.update_routing_table():
+            self.trigger_update()
+
+    def set_cost(self, node_id, link_id, cost):
+        """Sets the cost of reaching a destination through a link.
+
+        Args:
+            node_id (string): The destination.
+            link_id (string): The id of the adjacent link.
+            cost (float): The total cost of the path.
+
+        """
+        link_costs = self.cost_table.get(node_id)
+        if link_costs is None:
+            link_costs = self.cost_table[node_id] = IndexedMinHeap()
+        elif link_id in link_costs and link_costs[link_id] == cost:
+            return
+        link_costs[link_id] = cost
+        self.link_destinations.setdefault(link_id, set()).add(node_id)
+        self.dirty_routes.add(node_id)
 
     def update_routing_table(self):
         """Updates the routing table, if necessary, according to the
-        cost table.
+        cost table. Only the destinations whose costs changed are looked at.
+
+        A route whose cost increases is held down for ROUTE_HOLD_DOWN,
+        starting before its link is chosen: until then, it keeps its link at
+        the new cost, and only switches to another link that is cheaper than
+        the route was before it got worse, or if its link is poisoned.
 
         Returns:
             changed (bool): true if the routing table changed, false otherwise.
 
         """
-        changed = False
+        num_changes = 0
+        now = self.ns.cur_time
 
-        for node_id in self.cost_table:
+        dirty_routes = self.dirty_routes
+        self.dirty_routes = set()
+        for node_id in dirty_routes:
             # Find the minimum cost and corresponding link in the cost table.
-            # The lambda function means that the link_cost_pairs are minimized
-            # first with respect to the cost (x[1]), and then link_id (x[0]).
-            # The link_id is used for consistent tie-breaking.
-            link_cost_pairs = self.cost_table[node_id].iteritems()
-            min_link_id, min_cost = \
-                min(link_cost_pairs, key=lambda x:(x[1], x[0]))
+            # The heap is ordered first by cost, and then by link_id for
+            # consistent tie-breaking.
+            min_link_id, min_cost = self.cost_table[node_id].min()
             min_link = self.links[min_link_id]
 
+            route = self.routing_table.get(node_id)
+            if route is not None:
+                cur_link, cur_cost = route
+                hold_down = self.hold_downs.get(node_id)
+                if hold_down is not None and hold_down[0] <= now:
+                    del self.hold_downs[node_id]
+                    hold_down = None
+
+                # The route got worse: hold it down before choosing a link,
+                # so that it does not switch to a worse alternative at once.
+                if min_cost > cur_cost and hold_down is None:
+                    hold_down = (now + ROUTE_HOLD_DOWN, cur_cost)
+                    self.hold_downs[node_id] = hold_down
+                    event = lambda node_id=node_id: self.end_hold_down(node_id)
+                    description = "Router.end_hold_down on router %s for %s" \
+                        % (self.node_id, node_id)
+                    self.ns.add_event(event, description, ROUTE_HOLD_DOWN)
+
+                # Keep a held down route unless the alternative is cheaper
+                # than the route was before it got worse, or the route has
+                # been poisoned.
+                held_cost = self.cost_table[node_id][cur_link.link_id]
+                if hold_down is not None and min_link is not cur_link and \
+                    min_cost >= hold_down[1] and held_cost < float('inf'):
+                    min_link = cur_link
+                    min_cost = held_cost
+
             # Compare best link in the cost table with routing table entry
-            if node_id not in self.routing_table or \
-                self.routing_table[node_id] != (min_link, min_cost):
-                
-                changed = True
+            if route != (min_link, min_cost):
+                num_changes += 1
                 self.routing_table[node_id] = (min_link, min_cost)
+                self.next_hop[self.ns.nodes[node_id].index] = min_link
+                self.changed_routes.add(node_id)
+
+            if self.ecmp != "off":
+                self.multipath[self.ns.nodes[node_id].index] = \
+                    self.get_multipath(node_id, min_link, min_cost)
+
+        if self.routing_metrics and num_changes > 0:
+            self.ns.record_routing_table_changes(self.node_id, num_changes)
+        return num_changes > 0
+
+    def get_multipath(self, node_id, min_link, min_cost):
+        """Finds the links that flows to a destination are spread over.
+
+        Only links to neighbours that are closer to the destination than this
+        router are used, so that multipath routes cannot loop.
 
-        return changed
+        Args:
+            node_id (string): The destination.
+            min_link (Link): The link of the destination's route.
+            min_cost (float): The cost of the destination's route.
+
+        Returns:
+            None if the destination has a single next hop, otherwise a
+            (links, weights) tuple.
+
+        """
+        link_costs = self.cost_table[node_id]
+        # A held down route keeps its single link.
+        if min_cost == float('inf') or link_costs.min()[0] != min_link.link_id:
+            return None
+
+        bound = min_cost + ECMP_COST_TOLERANCE
+        if self.ecmp == "weighted":
+            bound = min_cost * ECMP_MAX_STRETCH + ECMP_COST_TOLERANCE
+        paths = sorted((link_id, cost) for link_id, cost in
+            link_costs.within(bound)
+            if cost - self.adj_link_costs[link_id] < min_cost)
+        if len(paths) < 2:
+            return None
+
+        links = tuple(self.links[link_id] for link_id, _ in paths)
+        if self.ecmp == "hash":
+            return links, None
+        return links, tuple(1.0 / cost for _, cost in paths)
+
+    def select_path(self, paths, flow_id):
+        """Hashes a flow onto one of the links of a multipath route, so all
+        packets of the flow take the same path.
+
+        Uses rendezvous hashing: each link gets a score from a hash of the
+        flow and the link, and the flow takes the link with the highest
+        score. A flow only moves when its own link leaves the route, not
+        when other links join or leave it. Weighted routes scale the scores
+        so that each link gets a share of flows proportional to its weight.
+
+        Args:
+            paths (tuple): The (links, weights) of the route.
+            flow_id (string): The flow of the packet being forwarded.
+
+        """
+        links, weights = paths
+        # Seed the hash with the router index so that routers downstream do
+        # not all make the same choice.
+        flow_hash = zlib.crc32(str(flow_id), self.index)
+        best_link = None
+        best_score = None
+        for i, link in enumerate(links):
+            score = zlib.crc32(link.link_id, flow_hash) & 0xffffffff
+            if weights is not None:
+                score = -weights[i] / math.log((score + 1) / 4294967297.0)
+            if best_score is None or score > best_score:
+                best_link = link
+                best_score = score
+        return best_link
+
+    def set_route(self, node_id, link, cost):
+        """Installs a route computed outside of the router, e.g. by the
+        RoutingOracle.
+
+        Args:
+            node_id (string): The destination of the route.
+            link (Link): The link to send packets for the destination on.
+            cost (float): The cost of the route.
+
+        """
+        if self.routing_metrics and \
+            self.routing_table.get(node_id) != (link, cost):
+            self.ns.record_routing_table_changes(self.node_id, 1)
+        self.routing_table[node_id] = (link, cost)
+        self.next_hop[self.ns.nodes[node_id].index] = link
 
     def get_link_cost(self, link):
         """Returns the cost of a link.
@@ -184,7 +450,7 @@ class Router(Node):
         static_cost = link.prop_delay
         
         # The cost to get all packets in the buffer through the link
-        dynamic_cost = len(link.link_buffer)
+        dynamic_cost = link.queue_length(self.index)
 
         return static_cost + dynamic_cost
 
@@ -204,18 +470,20 @@ class Router(Node):
         if len(self.adj_link_costs) == 0:
             for link_id, link in self.links.iteritems():
                 other_node_id = link.get_other_node_id(self.node_id)
-                self.cost_table[other_node_id] = {}
-                self.cost_table[other_node_id][link_id] = \
-                    new_link_costs[link_id]
+                self.set_cost(other_node_id, link_id, new_link_costs[link_id])
 
-        # Otherwise, update the entire cost table using the difference between
-        # the previous adjacent link cost and the new cost.
+        # Otherwise, shift the costs of the destinations reached through each
+        # link whose cost changed by the difference between the previous
+        # adjacent link cost and the new cost.
         else:
-            for node_id in self.cost_table:
-                for link_id in self.cost_table[node_id]:
-                    diff = new_link_costs[link_id] \
-                        - self.adj_link_costs[link_id]
-                    self.cost_table[node_id][link_id] += diff
+            for link_id, new_cost in new_link_costs.iteritems():
+                diff = new_cost - self.adj_link_costs[link_id]
+                if diff == 0:
+                    continue
+                for node_id in self.link_destinations.get(link_id, ()):
+                    link_costs = self.cost_table[node_id]
+                    link_costs[link_id] += diff
+                    self.dirty_routes.add(node_id)
 
         # Overwrite the adjacent link cost table with the new costs.
         self.adj_link_costs = new_link_costs
@@ -0,0 +1,242 @@
+import heapq
+
+from constants import *
+from router import Router
+
+class RoutingOracle(object):
+    """Centralized link-state routing. Instead of simulating routing packets,
+    the oracle sees the whole topology and computes every router's shortest
+    paths with Dijkstra over the current Router.get_link_cost values, then
+    installs them straight into the routers' routing tables.
+
+    One shortest path tree is kept per destination, over the reversed graph,
+    so that a change in the cost of a router's outgoing link only affects the
+    routers whose paths use that router. Every REROUTE_PERIOD the oracle
+    measures every link cost and repairs the trees incrementally (dynamic
+    SPF) for the costs that changed: a cheaper link propagates improvements
+    upstream, and a more expensive tree link only recomputes the routers
+    whose paths went through it.
+
+    Ties are broken by link id, as the distance-vector routers do.
+
+    Attributes:
+        ns (NetworkSimulator): the simulator whose routers are routed.
+        nodes (list): every node, indexed by node index.
+        out_edges (list): the outgoing (link, node index) edges of each node.
+            Only routers forward packets, so hosts have none.
+        in_edges (list): the incoming (router index, link) edges of each
+            node.
+        costs (dict): the cost of every edge, keyed by
+            (router index, link index).
+        keys (list): for each destination index, the (cost, link id) of the
+            best path of every node to the destination.
+        next_link (list): for each destination index, the first link of the
+            best path of every node to the destination.
+
+    """
+
+    def __init__(self, ns):
+        self.ns = ns
+        self.nodes = [ns.nodes[node_id] for node_id in ns.node_ids]
+        num_nodes = len(self.nodes)
+
+        self.out_edges = [[] for _ in range(num_nodes)]
+        self.in_edges = [[] for _ in range(num_nodes)]
+        for node in self.nodes:
+            if not isinstance(node, Router):
+                continue
+            for link_id in sorted(node.links):
+                link = node.links[link_id]
+                other_node = link.nodes[1] if link.nodes[0] is node \
+                    else link.nodes[0]
+                self.out_edges[node.index].append((link, other_node.index))
+                self.in_edges[other_node.index].append((node.index, link))
+
+        self.costs = {}
+        self.keys = []
+        self.next_link = []
+
+    def measure_costs(self):
+        """Returns the current cost of every edge, keyed by
+        (router index, link index).
+
+        """
+        costs = {}
+        for node_index, edges in enumerate(self.out_edges):
+            node = self.nodes[node_index]
+            for link, _ in edges:
+                costs[(node_index, link.index)] = node.get_link_cost(link)
+        return costs
+
+    def start(self):
+        """Computes every shortest path tree from scratch, installs the
+        routes and schedules the periodic updates.
+
+        """
+        self.costs = self.measure_costs()
+        num_nodes = len(self.nodes)
+        for dest_index in range(num_nodes):
+            keys = [(float('inf'), "")] * num_nodes
+            next_link = [None] * num_nodes
+            keys[dest_index] = (0.0, "")
+            self.keys.append(keys)
+            self.next_link.append(next_link)
+            self._propagate(dest_index, [dest_index])
+
+            for node_index in range(num_nodes):
+                self._install(dest_index, node_index)
+
+        self.schedule_next_update()
+
+    def schedule_next_update(self):
+        """Schedules the next routing update in the network simulator."""
+        event = lambda: self.update()
+        self.ns.add_event(event, "RoutingOracle.update", delay=REROUTE_PERIOD)
+
+    def update(self):
+        """Measures the link costs, repairs the shortest path trees for the
+        costs that changed, and installs the routes that changed.
+
+        """
+        new_costs = self.measure_costs()
+        changed = set()
+        for node_index, edges in enumerate(self.out_edges):
+            for link, other_index in edges:
+                edge = (node_index, link.index)
+                old_cost = self.costs[edge]
+                new_cost = new_costs[edge]
+                if new_cost == old_cost:
+                    continue
+                self.costs[edge] = new_cost
+                for dest_index in range(len(self.nodes)):
+                    changed.update((dest_index, index) for index in
+                        self._update_edge(dest_index, node_index, link,
+                            other_index, old_cost, new_cost))
+
+        for dest_index, node_index in changed:
+            self._install(dest_index, node_index)
+
+        self.schedule_next_update()
+
+    def _update_edge(self, dest_index, node_index, link, other_index,
+                     old_cost, new_cost):
+        """Repairs the shortest path tree of a destination after the cost of
+        one edge changed.
+
+        Returns:
+            The indices of the nodes whose best path may have changed.
+
+        """
+        keys = self.keys[dest_index]
+        next_link = self.next_link[dest_index]
+        candidate = (new_cost + keys[other_index][0], link.link_id)
+
+        if next_link[node_index] is link:
+            if new_cost < old_cost:
+                keys[node_index] = candidate
+                return self._propagate(dest_index, [node_index])
+            return self._recompute(dest_index, node_index)
+
+        if candidate < keys[node_index]:
+            keys[node_index] = candidate
+            next_link[node_index] = link
+            return self._propagate(dest_index, [node_index])
+        return []
+
+    def _propagate(self, dest_index, sources):
+        """Runs Dijkstra upstream from nodes whose paths just improved,
+        relaxing the edges into them.
+
+        Returns:
+            The indices of the nodes whose best path improved.
+
+        """
+        keys = self.keys[dest_index]
+        next_link = self.next_link[dest_index]
+        costs = self.costs
+        heap = [(keys[index][0], index) for index in sources]
+        heapq.heapify(heap)
+        improved = list(sources)
+        while heap:
+            cost, index = heapq.heappop(heap)
+            if cost > keys[index][0]:
+                continue
+            for node_index, link in self.in_edges[index]:
+                candidate = (cost + costs[(node_index, link.index)],
+                    link.link_id)
+                if candidate < keys[node_index]:
+                    keys[node_index] = candidate
+                    next_link[node_index] = link
+                    heapq.heappush(heap, (candidate[0], node_index))
+                    improved.append(node_index)
+        return improved
+
+    def _recompute(self, dest_index, node_index):
+        """Recomputes the best paths of every node whose path went through a
+        node whose tree link got more expensive.
+
+        Returns:
+            The indices of the recomputed nodes.
+
+        """
+        keys = self.keys[dest_index]
+        next_link = self.next_link[dest_index]
+        costs = self.costs
+
+        # Collect the subtree hanging off the node.
+        affected = set([node_index])
+        stack = [node_index]
+        while stack:
+            index = stack.pop()
+            for upstream_index, link in self.in_edges[index]:
+                if next_link[upstream_index] is link and \
+                    upstream_index not in affected:
+                    affected.add(upstream_index)
+                    stack.append(upstream_index)
+
+        # Seed each affected node with its best edge out of the subtree.
+        heap = []
+        for index in affected:
+            keys[index] = (float('inf'), "")
+            next_link[index] = None
+            for link, other_index in self.out_edges[index]:
+                if other_index in affected:
+                    continue
+                candidate = (costs[(index, link.index)] + keys[other_index][0],
+                    link.link_id)
+                if candidate < keys[index]:
+                    keys[index] = candidate
+                    next_link[index] = link
+            if next_link[index] is not None:
+                heap.append((keys[index][0], index))
+        heapq.heapify(heap)
+
+        # Run Dijkstra inside the subtree.
+        done = set()
+        while heap:
+            cost, index = heapq.heappop(heap)
+            if index in done or cost > keys[index][0]:
+                continue
+            done.add(index)
+            for upstream_index, link in self.in_edges[index]:
+                if upstream_index not in affected or upstream_index in done:
+                    continue
+                candidate = (cost + costs[(upstream_index, link.index)],
+                    link.link_id)
+                if candidate < keys[upstream_index]:
+                    keys[upstream_index] = candidate
+                    next_link[upstream_index] = link
+                    heapq.heappush(heap, (candidate[0], upstream_index))
+        return affected
+
+    def _install(self, dest_index, node_index):
+        """Installs a node's best path to a destination if the node is a
+        router and the destination is reachable.
+
+        """
+        link = self.next_link[dest_index][node_index]
+        if link is None or dest_index == node_index:
+            return
+        node = self.nodes[node_index]
+        node.set_route(self.nodes[dest_index].node_id, link,
+            self.keys[dest_index][node_index][0])
@@ -0,0 +1,222 @@
+from series import SUM, MEAN
+from sinks import StreamedSeries
+
+class SamplingPolicy(object):
+    """Decides which of the points sent to a series are recorded, to cut the
+    cost and memory of series that get a point on every packet.
+
+    A point is recorded when it satisfies every condition the policy sets:
+    at least `every` - 1 points were skipped since the last recorded point,
+    it comes at least `interval` seconds after it, and it differs from it by
+    at least `threshold`. A disabled policy records nothing.
+
+    Attributes:
+        enabled (bool): false if the series is not recorded at all
+        every (int): record at most one point out of every this many
+        threshold (float): the change from the last recorded value a point
+            needs to be recorded, None for any change
+        interval (float): the shortest time in seconds between recorded
+            points, None for no limit
+
+    """
+
+    def __init__(self, enabled=True, every=1, threshold=None, interval=None):
+        if every < 1:
+            raise Exception("Sampling every %s points" % every)
+        self.enabled = enabled
+        self.every = every
+        self.threshold = threshold
+        self.interval = interval
+
+    def __repr__(self):
+        return "SamplingPolicy(enabled=%r, every=%r, threshold=%r, " \
+            "interval=%r)" % (self.enabled, self.every, self.threshold,
+            self.interval)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Returns the policy described by a dict of a network description,
+        such as {"every": 10} or {"enabled": false}. The keys "metric" and
+        "series", which say what the policy applies to, are ignored.
+
+        """
+        return cls(spec.get("enabled", True), spec.get("every", 1),
+            spec.get("threshold", None), spec.get("interval", None))
+
+class SampledSeries(object):
+    """A series that only records the points its SamplingPolicy accepts.
+
+    Amounts sent to a SUM series, such as bits sent, are carried forward
+    while they are skipped and added to the next recorded point, so that
+    totals and rates stay right. Skipped points of other series are
+    dropped. Everything but recording is done by the wrapped series, so a
+    SampledSeries can be plotted and analyzed like any series.
+
+    Attributes:
+        series (Series or BinnedSeries): the series the points are recorded to
+        policy (SamplingPolicy): decides which points are recorded
+        kind (str): SUM, MEAN or LEVEL, see BinnedSeries
+        count (int): the number of points sent to the series
+        recorded_time (float): the time of the last recorded point
+        recorded_value (float): the last recorded value
+        carried (float): the amount of a SUM series skipped since the last
+            recorded point
+        carried_time (float): the time of the last skipped point
+
+    """
+
+    def __init__(self, series, policy, kind):
+        self.series = series
+        self.policy = policy
+        self.kind = kind
+        self.count = 0
+        self.recorded_time = None
+        self.recorded_value = None
+        self.carried = 0.0
+        self.carried_time = None
+        # The policy is copied into plain attributes for the hot path.
+        self._additive = kind == SUM
+        self._samples = kind == MEAN
+        self._every = policy.every
+        self._countdown = 0
+        self._interval = policy.interval
+        self._threshold = policy.threshold
+
+    def __getattr__(self, name):
+        if name.startswith("__") or "series" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.series, name)
+
+    def __len__(self):
+        return len(self.series)
+
+    def __iter__(self):
+        return iter(self.series)
+
+    def __getitem__(self, index):
+        return self.series[index]
+
+    def __array__(self, dtype=None):
+        return self.series.__array__(dtype)
+
+    def add(self, time, value):
+        """Records a point if the policy accepts it, with Series.append for
+        MEAN series and with Series.add for the others, which is how
+        DataMetrics records them.
+
+        """
+        self.count += 1
+        if self._additive:
+            value += self.carried
+        accepted = True
+        if self._countdown:
+            self._countdown -= 1
+            accepted = False
+        elif self._interval is not None and self.recorded_time is not None \
+            and time - self.recorded_time < self._interval:
+            accepted = False
+        elif self._threshold is not None:
+            if self._additive:
+                accepted = abs(value) >= self._threshold
+            elif self.recorded_value is not None:
+                accepted = abs(value - self.recorded_value) >= self._threshold
+
+        if not accepted:
+            if self._additive:
+                self.carried = value
+                self.carried_time = time
+            return
+        self._countdown = self._every - 1
+        if self._samples:
+            self.series.append(time, value)
+        else:
+            self.series.add(time, value)
+        self.recorded_time = time
+        self.recorded_value = value
+        if self._additive:
+            self.carried = 0.0
+            self.carried_time = None
+
+    append = add
+
+    def flush(self):
+        """Records the amount carried forward at the time of the last skipped
+        point, so that a SUM series ends with the right total.
+
+        """
+        if self.carried_time is not None:
+            self.series.add(self.carried_time, self.carried)
+            self.recorded_time = self.carried_time
+            self.carried = 0.0
+            self.carried_time = None
+
+class DisabledSeries(SampledSeries):
+    """A SampledSeries whose policy is disabled, which ignores every point
+    it is sent.
+
+    """
+
+    def add(self, time, value):
+        pass
+
+    def append(self, time, value):
+        pass
+
+    def flush(self):
+        pass
+
+class SeriesTable(dict):
+    """The series of one measurement, keyed by link, flow or router id, and
+    created the first time they are recorded to.
+
+    Attributes:
+        kind (str): SUM, MEAN or LEVEL, see BinnedSeries
+        factory (callable): makes a new, empty series
+        name (str): the name of the measurement, e.g. "link_rate"
+        sink (MetricSink): if not None, new series are StreamedSeries that
+            write their points to this sink
+        policy (SamplingPolicy): the sampling policy of the series, None to
+            record every point
+        policies (dict): sampling policies of particular series, by series
+            id. The policy of a duplex link applies to both directions.
+
+    """
+
+    def __init__(self, kind, factory):
+        dict.__init__(self)
+        self.kind = kind
+        self.factory = factory
+        self.name = None
+        self.sink = None
+        self.policy = None
+        self.policies = {}
+
+    def policy_of(self, series_id):
+        """Returns the sampling policy of a series, None if it has none."""
+        policies = self.policies
+        if series_id in policies:
+            return policies[series_id]
+        link_id = series_id.split(":", 1)[0]
+        return policies.get(link_id, self.policy)
+
+    def wrap(self, series_id, series):
+        """Returns a series wrapped to follow its sampling policy, or the
+        series itself if it has none.
+
+        """
+        policy = self.policy_of(series_id) if \
+            self.policy is not None or self.policies else None
+        if policy is None:
+            return series
+        if not policy.enabled:
+            return DisabledSeries(series, policy, self.kind)
+        return SampledSeries(series, policy, self.kind)
+
+    def __missing__(self, series_id):
+        if self.sink is None:
+            series = self.factory()
+        else:
+            series = StreamedSeries(self.sink, self.name, series_id)
+        series = self.wrap(series_id, series)
+        self[series_id] = series
+        return series
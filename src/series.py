@@ -0,0 +1,421 @@
+from array import array
+from itertools import izip
+
+import numpy as np
+
+from constants import *
+
+class Series(object):
+    """The (time, value) points of one measured series, kept in a pair of
+    float64 NumPy columns.
+
+    A point costs 16 bytes, against more than 100 bytes for a tuple of two
+    floats in a list. New points are staged in a pair of small arrays, which
+    are cheap to append to, and moved into the columns SERIES_BLOCK_SIZE at
+    a time. The columns double in size when full, so appending is amortized
+    O(1), and times and values are views into them that analysis code can
+    use without copying. A view stays valid when the series grows, it just
+    does not see the points appended after it was taken.
+
+    For compatibility with code written against lists of tuples, a series
+    can also be iterated and indexed as (time, value) tuples, and np.array
+    turns it into an n x 2 array.
+
+    Attributes:
+        times (ndarray): view of the time column
+        values (ndarray): view of the value column
+        last_time (float): the time of the last point, None while empty
+
+    """
+
+    def __init__(self, capacity=SERIES_INITIAL_CAPACITY):
+        self._times = np.empty(capacity)
+        self._values = np.empty(capacity)
+        self._capacity = capacity
+        self._size = 0
+        self._new_times = array('d')
+        self._new_values = array('d')
+        self.last_time = None
+        # The number of points known to be in order.
+        self._sorted_size = 0
+
+    @classmethod
+    def from_columns(cls, times, values, ordered=False):
+        """Returns a series that uses two arrays as its columns without
+        copying them, e.g. memory-mapped columns of a trace file.
+
+        Args:
+            times (ndarray): the times of the points.
+            values (ndarray): the values of the points.
+            ordered (bool): true if the points are known to be sorted as
+                columns() sorts them, which saves checking.
+
+        """
+        series = cls(0)
+        series._times = times
+        series._values = values
+        series._capacity = series._size = len(times)
+        if ordered:
+            series._sorted_size = len(times)
+        return series
+
+    def __len__(self):
+        return self._size + len(self._new_times)
+
+    def __iter__(self):
+        self.flush()
+        size = self._size
+        return izip(self._times[:size].tolist(), self._values[:size].tolist())
+
+    def __getitem__(self, index):
+        self.flush()
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("series index out of range")
+        return float(self._times[index]), float(self._values[index])
+
+    def __array__(self, dtype=None):
+        points = np.column_stack((self.times, self.values))
+        return points if dtype is None else points.astype(dtype)
+
+    def __repr__(self):
+        return "Series(%r)" % list(self)
+
+    @property
+    def times(self):
+        self.flush()
+        return self._times[:self._size]
+
+    @property
+    def values(self):
+        self.flush()
+        return self._values[:self._size]
+
+    def flush(self):
+        """Moves the staged points into the columns, growing them as
+        needed.
+
+        """
+        new_times = self._new_times
+        count = len(new_times)
+        if count == 0:
+            return
+        size = self._size
+        if size + count > self._capacity:
+            capacity = max(self._capacity, SERIES_INITIAL_CAPACITY)
+            while size + count > capacity:
+                capacity *= 2
+            for name in ("_times", "_values"):
+                column = np.empty(capacity)
+                column[:size] = getattr(self, name)[:size]
+                setattr(self, name, column)
+            self._capacity = capacity
+        self._times[size:size + count] = np.frombuffer(new_times)
+        self._values[size:size + count] = np.frombuffer(self._new_values)
+        self._size = size + count
+        # The arrays must not be resized while NumPy reads their buffers.
+        self._new_times = array('d')
+        self._new_values = array('d')
+
+    def append(self, time, value):
+        """Adds a point at the end of the series."""
+        new_times = self._new_times
+        new_times.append(time)
+        self._new_values.append(value)
+        self.last_time = time
+        if len(new_times) >= SERIES_BLOCK_SIZE:
+            self.flush()
+
+    def add(self, time, amount):
+        """Adds a point, or adds amount to the last point if it has the same
+        time.
+
+        """
+        if self.last_time == time:
+            if self._new_values:
+                self._new_values[-1] += amount
+            else:
+                self._values[self._size - 1] += amount
+            return
+        new_times = self._new_times
+        new_times.append(time)
+        self._new_values.append(amount)
+        self.last_time = time
+        if len(new_times) >= SERIES_BLOCK_SIZE:
+            self.flush()
+
+    def columns(self):
+        """Returns (times, values) sorted by time, then by value as sorting
+        the (time, value) tuples would. They are views into the columns when
+        the series is already sorted, which is the case unless points were
+        recorded out of order.
+
+        """
+        times = self.times
+        values = self.values
+        size = len(times)
+        if size < 2 or self._sorted_size == size or \
+            (times[1:] > times[:-1]).all():
+            self._sorted_size = size
+            return times, values
+        order = np.lexsort((values, times))
+        return times[order], values[order]
+
+    def between(self, start, end):
+        """Returns (times, values) of the points with start <= time < end,
+        found by binary search in the sorted columns.
+
+        """
+        times, values = self.columns()
+        first, last = np.searchsorted(times, [start, end])
+        return times[first:last], values[first:last]
+
+    def nbytes(self):
+        """Returns the memory held by the series in bytes."""
+        return self._times.nbytes + self._values.nbytes + \
+            self._new_times.itemsize * 2 * len(self._new_times)
+
+    def total(self):
+        """Returns the sum of the values."""
+        return float(self.values.sum())
+
+    def count(self):
+        """Returns the number of points."""
+        return len(self)
+
+    def maximum(self):
+        """Returns the largest value."""
+        return float(self.values.max())
+
+SUM = "sum"
+MEAN = "mean"
+LEVEL = "level"
+
+class BinnedSeries(object):
+    """A series aggregated online into fixed-width time bins, for runs too
+    long to keep every point of.
+
+    Bins are aligned on multiples of bin_width and only the aggregates of
+    each bin are kept, so memory grows with the duration of the run rather
+    than with the number of points recorded. How points are aggregated
+    depends on the kind of the series:
+
+        SUM: points are amounts, such as bits sent or packets dropped, and
+            a bin holds their total.
+        MEAN: points are samples, such as round trip times, and a bin holds
+            their mean and maximum.
+        LEVEL: points are the new value of a quantity that holds until the
+            next point, such as a buffer occupancy, and a bin holds its
+            time-weighted average over the part of the bin after the first
+            point. A later point at the same time is added to the earlier
+            one, as Series.add does.
+
+    The bin being filled is kept in plain floats, and moved into NumPy
+    columns, which double in size as needed, when a point falls in a later
+    bin. A BinnedSeries reads like a Series whose points are the bins that
+    received data, each at the middle of its bin, so the plots and analyses
+    of DataMetrics work on either. Points recorded before the last point of
+    a LEVEL series are taken to happen at the time of the last point, and
+    replace its value.
+
+    Attributes:
+        bin_width (float): the width of the bins in seconds
+        kind (str): SUM, MEAN or LEVEL
+        first_bin (int): the number of the first bin since time 0, None
+            while empty
+        last_time (float): the time of the last point, None while empty
+        level (float): the current value of a LEVEL series
+
+    """
+
+    def __init__(self, bin_width, kind=SUM, capacity=SERIES_INITIAL_CAPACITY):
+        self.bin_width = bin_width
+        self.kind = kind
+        self.first_bin = None
+        self.last_time = None
+        self.level = 0.0
+        self._sums = np.zeros(capacity)
+        self._weights = np.zeros(capacity)
+        self._peaks = np.full(capacity, -np.inf)
+        self._num_bins = 0
+        # The bin being filled, relative to first_bin.
+        self._bin = 0
+        self._sum = 0.0
+        self._weight = 0.0
+        self._peak = -np.inf
+
+    def __len__(self):
+        self.flush()
+        return int(np.count_nonzero(self._weights[:self._num_bins]))
+
+    def __iter__(self):
+        times, values = self.columns()
+        return izip(times.tolist(), values.tolist())
+
+    def __getitem__(self, index):
+        times, values = self.columns()
+        return float(times[index]), float(values[index])
+
+    def __array__(self, dtype=None):
+        points = np.column_stack(self.columns())
+        return points if dtype is None else points.astype(dtype)
+
+    def __repr__(self):
+        return "BinnedSeries(%r, %r, %r)" % (self.bin_width, self.kind,
+            list(self))
+
+    @property
+    def times(self):
+        return self.columns()[0]
+
+    @property
+    def values(self):
+        return self.columns()[1]
+
+    def _reserve(self, num_bins):
+        """Grows the columns to hold at least num_bins bins."""
+        capacity = len(self._sums)
+        if num_bins <= capacity:
+            return
+        while num_bins > capacity:
+            capacity *= 2
+        for name, fill in (("_sums", 0.0), ("_weights", 0.0),
+                           ("_peaks", -np.inf)):
+            column = np.full(capacity, fill)
+            column[:self._num_bins] = getattr(self, name)[:self._num_bins]
+            setattr(self, name, column)
+
+    def flush(self):
+        """Moves the bin being filled into the columns. Points can still be
+        added to it afterwards.
+
+        """
+        if self._weight == 0:
+            return
+        index = self._bin
+        self._reserve(index + 1)
+        self._sums[index] += self._sum
+        self._weights[index] += self._weight
+        if self._peak > self._peaks[index]:
+            self._peaks[index] = self._peak
+        self._num_bins = max(self._num_bins, index + 1)
+        self._sum = 0.0
+        self._weight = 0.0
+        self._peak = -np.inf
+
+    def _move_to(self, index):
+        """Makes bin index the bin being filled."""
+        if index != self._bin:
+            self.flush()
+            self._bin = index
+
+    def append(self, time, value):
+        """Adds a point to the bin it falls in."""
+        width = self.bin_width
+        if self.first_bin is None:
+            self.first_bin = int(time // width)
+            self.last_time = time
+        index = int(time // width) - self.first_bin
+
+        if self.kind == LEVEL:
+            if time > self.last_time:
+                self._integrate(self.last_time, time)
+                self.last_time = time
+                self.level = value
+            elif time == self.last_time:
+                self.level += value
+            else:
+                index = self._bin
+                self.level = value
+            self._move_to(index)
+            return
+
+        if index < 0:
+            index = 0
+        if index != self._bin:
+            if index < self._bin:
+                # A point older than the bin being filled goes straight
+                # into the columns.
+                self._reserve(index + 1)
+                self._sums[index] += value
+                self._weights[index] += 1
+                self._peaks[index] = max(self._peaks[index], value)
+                return
+            self._move_to(index)
+        self._sum += value
+        self._weight += 1
+        if value > self._peak:
+            self._peak = value
+        if time > self.last_time:
+            self.last_time = time
+
+    add = append
+
+    def _integrate(self, start, end):
+        """Adds the current level from start to end to the bins."""
+        width = self.bin_width
+        level = self.level
+        first = int(start // width) - self.first_bin
+        last = int(end // width) - self.first_bin
+        if first == last:
+            self._sum += level * (end - start)
+            self._weight += end - start
+            return
+        split = (self.first_bin + first + 1) * width
+        self._sum += level * max(split - start, 0.0)
+        self._weight += max(split - start, 0.0)
+        self.flush()
+        if last > first + 1:
+            self._reserve(last)
+            self._sums[first + 1:last] = level * width
+            self._weights[first + 1:last] = width
+            self._num_bins = max(self._num_bins, last)
+        self._bin = last
+        split = (self.first_bin + last) * width
+        self._sum += level * max(end - split, 0.0)
+        self._weight += max(end - split, 0.0)
+
+    def columns(self):
+        """Returns (times, values) of the bins that received data, at the
+        middle of each bin. The values are totals for SUM, means for MEAN
+        and time-weighted averages for LEVEL.
+
+        """
+        self.flush()
+        num_bins = self._num_bins
+        weights = self._weights[:num_bins]
+        bins = np.flatnonzero(weights)
+        times = (self.first_bin + bins + 0.5) * self.bin_width
+        sums = self._sums[bins]
+        if self.kind == SUM:
+            return times, sums
+        return times, sums / weights[bins]
+
+    def between(self, start, end):
+        """Returns (times, values) of the bins whose middle is in
+        [start, end).
+
+        """
+        times, values = self.columns()
+        first, last = np.searchsorted(times, [start, end])
+        return times[first:last], values[first:last]
+
+    def total(self):
+        """Returns the sum of the points of a SUM or MEAN series."""
+        self.flush()
+        return float(self._sums[:self._num_bins].sum())
+
+    def count(self):
+        """Returns the number of points of a SUM or MEAN series."""
+        self.flush()
+        return int(self._weights[:self._num_bins].sum())
+
+    def maximum(self):
+        """Returns the largest point of a SUM or MEAN series."""
+        self.flush()
+        return float(self._peaks[:self._num_bins].max())
+
+    def nbytes(self):
+        """Returns the memory held by the series in bytes."""
+        return self._sums.nbytes + self._weights.nbytes + self._peaks.nbytes
@@ -0,0 +1,347 @@
+import abc
+import csv
+import os
+import sqlite3
+from itertools import izip
+
+import numpy as np
+
+from constants import *
+from series import Series
+
+class MetricSink(object):
+    """Where DataMetrics streams the points of its series during a run, so
+    that they do not all have to be held in memory.
+
+    Points are handed to a sink a chunk of one series at a time. Every write
+    the sink makes is complete on disk once it returns, so if the run
+    crashes, the points written so far can still be read back, by this
+    sink or by a new one on the same path.
+
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def write(self, metric, series_id, times, values):
+        """Stores a chunk of points of a series.
+
+        Args:
+            metric (str): the name of the measurement, e.g. "link_rate".
+            series_id (str): the id of the series in the measurement.
+            times (ndarray): the times of the points.
+            values (ndarray): the values of the points.
+
+        """
+
+    @abc.abstractmethod
+    def read(self, metric, series_id):
+        """Returns the (times, values) arrays of every point stored for a
+        series, in the order they were written.
+
+        """
+
+    @abc.abstractmethod
+    def series(self):
+        """Returns the sorted (metric, series_id) pairs the sink holds."""
+
+    def flush(self):
+        """Writes out any points the sink is holding back."""
+        pass
+
+    def close(self):
+        """Flushes the sink and releases its files."""
+        self.flush()
+
+class NpzSink(MetricSink):
+    """Stores points in a directory of NumPy .npz segments.
+
+    Chunks are buffered until SINK_SEGMENT_SIZE points are waiting, then
+    written together as one segment. A segment is written under a temporary
+    name and renamed when complete, so the directory never holds a partial
+    segment. A sink opened on a directory that already has segments adds
+    new ones after them.
+
+    Attributes:
+        directory (str): the directory of the segments
+        compressed (bool): whether segments are compressed
+        num_segments (int): the number of segments in the directory
+
+    """
+
+    def __init__(self, directory, compressed=False):
+        self.directory = directory
+        self.compressed = compressed
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.num_segments = len(self.segment_paths())
+        self._chunks = []
+        self._buffered = 0
+
+    def segment_paths(self):
+        """Returns the paths of the segments, in the order they were
+        written.
+
+        """
+        return [os.path.join(self.directory, name)
+            for name in sorted(os.listdir(self.directory))
+            if name.startswith("segment-") and name.endswith(".npz")]
+
+    def write(self, metric, series_id, times, values):
+        self._chunks.append(("%s\t%s" % (metric, series_id), times, values))
+        self._buffered += len(times)
+        if self._buffered >= SINK_SEGMENT_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._chunks:
+            return
+        arrays = {"names": np.array([name for name, _, _ in self._chunks])}
+        for i, (name, times, values) in enumerate(self._chunks):
+            arrays["times_%d" % i] = times
+            arrays["values_%d" % i] = values
+        path = os.path.join(self.directory,
+            "segment-%06d.npz" % self.num_segments)
+        # np.savez adds .npz to names without it.
+        temporary = path + ".tmp.npz"
+        if self.compressed:
+            np.savez_compressed(temporary, **arrays)
+        else:
+            np.savez(temporary, **arrays)
+        os.rename(temporary, path)
+        self.num_segments += 1
+        self._chunks = []
+        self._buffered = 0
+
+    def read(self, metric, series_id):
+        self.flush()
+        name = "%s\t%s" % (metric, series_id)
+        times = []
+        values = []
+        for path in self.segment_paths():
+            segment = np.load(path)
+            for i in np.flatnonzero(segment["names"] == name):
+                times.append(segment["times_%d" % i])
+                values.append(segment["values_%d" % i])
+            segment.close()
+        if not times:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
+
+    def series(self):
+        self.flush()
+        names = set()
+        for path in self.segment_paths():
+            segment = np.load(path)
+            names.update(segment["names"].tolist())
+            segment.close()
+        return sorted(tuple(name.split("\t", 1)) for name in names)
+
+class CsvSink(MetricSink):
+    """Stores points as "metric,series_id,time,value" rows of a CSV file.
+    Each chunk is written in one batch and flushed to the file. A sink
+    opened on an existing file appends to it.
+
+    Attributes:
+        path (str): the path of the CSV file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        self._writer = csv.writer(self._file)
+        self._points = None
+        if new:
+            self._writer.writerow(["metric", "series_id", "time", "value"])
+            self._file.flush()
+
+    def write(self, metric, series_id, times, values):
+        self._writer.writerows((metric, series_id, repr(time), repr(value))
+            for time, value in izip(times.tolist(), values.tolist()))
+        self._file.flush()
+        self._points = None
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def rows(self):
+        """Yields the rows of the file after the header."""
+        self.flush()
+        with open(self.path, "rb") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                yield row
+
+    def load(self):
+        """Returns the times and values of each (metric, series_id) in the
+        file, parsing it only once until the next write.
+
+        """
+        if self._points is None:
+            points = {}
+            for metric, series_id, time, value in self.rows():
+                times, values = points.setdefault((metric, series_id),
+                    ([], []))
+                times.append(float(time))
+                values.append(float(value))
+            self._points = points
+        return self._points
+
+    def read(self, metric, series_id):
+        times, values = self.load().get((metric, series_id), ([], []))
+        return np.array(times, dtype=float), np.array(values, dtype=float)
+
+    def series(self):
+        return sorted(self.load())
+
+class SqliteSink(MetricSink):
+    """Stores points in the points table of an SQLite database, with an
+    index on (metric, series_id). Each chunk is inserted and committed as
+    one transaction.
+
+    Attributes:
+        path (str): the path of the database
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS points "
+            "(metric TEXT, series_id TEXT, time REAL, value REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS points_series "
+            "ON points (metric, series_id)")
+        self._connection.commit()
+
+    def write(self, metric, series_id, times, values):
+        with self._connection:
+            self._connection.executemany("INSERT INTO points VALUES "
+                "(?, ?, ?, ?)", ((metric, series_id, time, value)
+                for time, value in izip(times.tolist(), values.tolist())))
+
+    def close(self):
+        self._connection.close()
+
+    def read(self, metric, series_id):
+        rows = self._connection.execute("SELECT time, value FROM points "
+            "WHERE metric = ? AND series_id = ? ORDER BY rowid",
+            (metric, series_id)).fetchall()
+        if not rows:
+            return np.empty(0), np.empty(0)
+        points = np.array(rows, dtype=float)
+        return points[:, 0].copy(), points[:, 1].copy()
+
+    def series(self):
+        return sorted(self._connection.execute("SELECT DISTINCT metric, "
+            "series_id FROM points").fetchall())
+
+def make_sink(path):
+    """Returns the sink for a path by its extension: a CsvSink for .csv, a
+    SqliteSink for .sqlite and .db, and an NpzSink for a directory
+    otherwise.
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return CsvSink(path)
+    if extension in (".sqlite", ".db"):
+        return SqliteSink(path)
+    return NpzSink(path)
+
+class StreamedSeries(Series):
+    """A Series that hands its points to a MetricSink SINK_CHUNK_SIZE at a
+    time, and only keeps the points not yet written in memory. Reading the
+    series reads the written points back from the sink.
+
+    The last point stays in memory when a chunk is written, so that points
+    added at its time are still coalesced with it, until the final write at
+    the end of the run.
+
+    Attributes:
+        sink (MetricSink): where the points are written
+        metric (str): the name of the measurement of the series
+        series_id (str): the id of the series in the measurement
+        num_written (int): the number of points written to the sink
+
+    """
+
+    def __init__(self, sink, metric, series_id):
+        Series.__init__(self)
+        self.sink = sink
+        self.metric = metric
+        self.series_id = series_id
+        self.num_written = 0
+
+    def __len__(self):
+        return self.num_written + Series.__len__(self)
+
+    def __iter__(self):
+        times, values = self.points()
+        return izip(times.tolist(), values.tolist())
+
+    def __getitem__(self, index):
+        times, values = self.points()
+        return float(times[index]), float(values[index])
+
+    @property
+    def times(self):
+        return self.points()[0]
+
+    @property
+    def values(self):
+        return self.points()[1]
+
+    def flush(self):
+        """Moves the staged points into the columns, and writes the columns
+        to the sink once they hold a chunk.
+
+        """
+        Series.flush(self)
+        if self._size >= SINK_CHUNK_SIZE:
+            self.write(keep_last=True)
+
+    def write(self, keep_last=False):
+        """Writes the points held in memory to the sink.
+
+        Args:
+            keep_last (bool): if true, the last point is kept in memory.
+
+        """
+        Series.flush(self)
+        size = self._size - 1 if keep_last else self._size
+        if size <= 0:
+            return
+        self.sink.write(self.metric, self.series_id,
+            self._times[:size].copy(), self._values[:size].copy())
+        self.num_written += size
+        if keep_last:
+            self._times[0] = self._times[size]
+            self._values[0] = self._values[size]
+            self._size = 1
+        else:
+            self._size = 0
+            # The last point is on disk and can no longer be added to.
+            self.last_time = None
+
+    def points(self):
+        """Returns (times, values) of every point in the order recorded."""
+        Series.flush(self)
+        size = self._size
+        if self.num_written == 0:
+            return self._times[:size], self._values[:size]
+        times, values = self.sink.read(self.metric, self.series_id)
+        return np.concatenate((times, self._times[:size])), \
+            np.concatenate((values, self._values[:size]))
+
+    def columns(self):
+        times, values = self.points()
+        if len(times) < 2 or (times[1:] > times[:-1]).all():
+            return times, values
+        order = np.lexsort((values, times))
+        return times[order], values[order]
@@ -0,0 +1,167 @@
+from math import ceil
+
+from constants import *
+
+class QuantileSketch(object):
+    """A KLL sketch (Karnin, Lang and Liberty, 2016) that estimates the
+    quantiles of a stream of numbers in O(k) memory, whatever the length of
+    the stream.
+
+    The sketch is a stack of compactors. New values go into the bottom one,
+    and a value at level h stands for 2 ** h values of the stream. When a
+    compactor is over its capacity, it is sorted and every other value is
+    promoted to the level above, alternating between the odd and the even
+    values, so that each compaction halves the values it holds without
+    biasing the ranks. Capacities shrink by 2/3 from the top level down, so
+    that most of the memory goes to the levels that stand for the most
+    values. The rank error is about 1.7 / k of the count.
+
+    Sketches of the same k can be merged, so sketches built by separate runs
+    of a sweep can be combined into one for the whole sweep.
+
+    Attributes:
+        k (int): the capacity of the top compactor, which sets the accuracy
+        compactors (list): the values held at each level
+        count (int): the number of values added
+        min (float): the smallest value added
+        max (float): the largest value added
+
+    """
+
+    def __init__(self, k=SKETCH_K):
+        self.k = k
+        self.compactors = [[]]
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._offsets = [0]
+        self._size = 0
+        self._max_size = self.capacity(0)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "QuantileSketch(k=%d, count=%d)" % (self.k, self.count)
+
+    def capacity(self, level):
+        """Returns the number of values a compactor may hold."""
+        depth = len(self.compactors) - level - 1
+        return int(ceil(self.k * (2.0 / 3.0) ** depth)) + 1
+
+    def update(self, value):
+        """Adds a value to the sketch."""
+        self.compactors[0].append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self._size += 1
+        if self._size >= self._max_size:
+            self.compress()
+
+    def compress(self):
+        """Compacts the lowest compactor that is over its capacity, as many
+        times as needed to get the sketch back under its total capacity.
+
+        """
+        level = 0
+        while self._size >= self._max_size and level < len(self.compactors):
+            items = self.compactors[level]
+            if len(items) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                    self._offsets.append(0)
+                    self._max_size = sum(self.capacity(h)
+                        for h in range(len(self.compactors)))
+                items.sort()
+                # An odd value out stays behind for the next compaction.
+                kept = [items.pop()] if len(items) % 2 else []
+                offset = self._offsets[level]
+                self._offsets[level] = 1 - offset
+                self.compactors[level + 1].extend(items[offset::2])
+                self._size -= len(items) - len(items) // 2
+                self.compactors[level] = kept
+            level += 1
+
+    def merge(self, other):
+        """Adds the values of another sketch with the same k to this one."""
+        if other.k != self.k:
+            raise Exception("Cannot merge sketches with k %d and %d" %
+                (self.k, other.k))
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+            self._offsets.append(0)
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._size = sum(len(items) for items in self.compactors)
+        self._max_size = sum(self.capacity(h)
+            for h in range(len(self.compactors)))
+        while self._size >= self._max_size:
+            self.compress()
+            self._max_size = sum(self.capacity(h)
+                for h in range(len(self.compactors)))
+
+    def quantiles(self, fractions):
+        """Returns the estimated quantiles of the values added.
+
+        Args:
+            fractions (list): the quantiles to estimate, between 0 and 1.
+
+        Returns:
+            A list of the values of the quantiles, None for each if the
+            sketch is empty.
+
+        """
+        if self.count == 0:
+            return [None] * len(fractions)
+        weighted = sorted((value, 2 ** level)
+            for level, items in enumerate(self.compactors)
+            for value in items)
+        total = sum(weight for value, weight in weighted)
+        results = []
+        for fraction in fractions:
+            if fraction <= 0:
+                results.append(self.min)
+                continue
+            if fraction >= 1:
+                results.append(self.max)
+                continue
+            rank = fraction * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= rank:
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, fraction):
+        """Returns the estimated value of a quantile between 0 and 1."""
+        return self.quantiles([fraction])[0]
+
+    def state(self):
+        """Returns the sketch as a dict of numbers and lists, e.g. to save it
+        as JSON.
+
+        """
+        return {"k": self.k, "compactors": self.compactors,
+                "count": self.count, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_state(cls, state):
+        """Returns the sketch saved by state()."""
+        sketch = cls(state["k"])
+        sketch.compactors = [list(items) for items in state["compactors"]]
+        sketch._offsets = [0] * len(sketch.compactors)
+        sketch.count = state["count"]
+        sketch.min = state["min"]
+        sketch.max = state["max"]
+        sketch._size = sum(len(items) for items in sketch.compactors)
+        sketch._max_size = sum(sketch.capacity(h)
+            for h in range(len(sketch.compactors)))
+        return sketch
@@ -0,0 +1,103 @@
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+# A trace file starts with a header: the magic string, the format version,
+# and the offset and length in bytes of the series index. The columns of
+# each series follow, times then values, as little-endian float64. The
+# index is a JSON document at the end of the file.
+TRACE_MAGIC = "NSTRACE\0"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<8sIIQQ")
+
+def write_trace(path, series, metadata):
+    """Writes a trace file. The file is written under a unique temporary
+    name in the same directory and renamed when complete, so that a reader
+    never sees a partial trace.
+
+    Args:
+        path (str): the path of the trace file.
+        series (iterable): (metric, series_id, kind, times, values) tuples,
+            with the points sorted by time. Only one series is read into
+            memory at a time.
+        metadata (dict): anything else to save in the index, as JSON.
+
+    """
+    directory, name = os.path.split(path)
+    fd, temporary = tempfile.mkstemp(suffix=".tmp", prefix=name + ".",
+        dir=directory or ".")
+    entries = []
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write("\0" * TRACE_HEADER.size)
+            offset = TRACE_HEADER.size
+            for metric, series_id, kind, times, values in series:
+                count = len(times)
+                entries.append({"metric": metric, "series_id": series_id,
+                    "kind": kind, "count": count, "times": offset,
+                    "values": offset + 8 * count})
+                np.ascontiguousarray(times, dtype="<f8").tofile(f)
+                np.ascontiguousarray(values, dtype="<f8").tofile(f)
+                offset += 16 * count
+
+            index = dict(metadata)
+            index["series"] = entries
+            index = json.dumps(index)
+            f.write(index)
+            f.seek(0)
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0, offset,
+                len(index)))
+        os.rename(temporary, path)
+    except:
+        os.remove(temporary)
+        raise
+
+def read_trace(path):
+    """Opens a trace file, memory-mapping its columns. Raises IOError if the
+    file cannot be read, and ValueError if it is not a trace file or is
+    truncated.
+
+    Args:
+        path (str): the path of the trace file.
+
+    Returns:
+        (index, series) tuple. index is the JSON index of the trace, and
+        series a list of (metric, series_id, kind, times, values) tuples
+        whose times and values are read-only memory-mapped arrays.
+
+    """
+    with open(path, "rb") as f:
+        header = f.read(TRACE_HEADER.size)
+        if len(header) < TRACE_HEADER.size:
+            raise ValueError("%s is not a trace file" % path)
+        magic, version, _, index_offset, index_length = \
+            TRACE_HEADER.unpack(header)
+        if magic != TRACE_MAGIC:
+            raise ValueError("%s is not a trace file" % path)
+        if version != TRACE_VERSION:
+            raise ValueError("Unsupported trace version %d" % version)
+        if os.fstat(f.fileno()).st_size < index_offset + index_length:
+            raise ValueError("%s is truncated" % path)
+        f.seek(index_offset)
+        index = json.loads(f.read(index_length))
+
+    series = []
+    columns = None
+    if index_offset > TRACE_HEADER.size:
+        columns = np.memmap(path, dtype="<f8", mode="r",
+            shape=(index_offset // 8,))
+    for entry in index["series"]:
+        count = entry["count"]
+        if count:
+            start = entry["times"] // 8
+            times = columns[start:start + count]
+            start = entry["values"] // 8
+            values = columns[start:start + count]
+        else:
+            times = values = np.empty(0)
+        series.append((entry["metric"], entry["series_id"], entry["kind"],
+            times, values))
+    return index, series
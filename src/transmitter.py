@@ -0,0 +1,496 @@
+from collections import deque
+
+from constants import *
+from queuedisc import ACCEPT, DROP, MARK
+from fairqueue import make_fair_queue
+
+class Transmitter(object):
+    """The event engine of a link. Packets wait in the link buffer and are
+    serialized onto the wire one at a time, with one event at the end of each
+    packet's transmission and one at the end of its propagation.
+
+    Attributes:
+        ns (NetworkSimulator): stores the simulator class running the simulation
+        link (Link): the link the transmitter sends packets on
+        series_id (string): the id under which the transmitter's buffer
+                            occupancy, link rate and packet loss are recorded
+        queue_discipline (QueueDiscipline): decides which packets the buffer
+                                            accepts, drops or marks
+        packets (PacketStore): the simulator's packet backend, which turns
+                               packets into the references held in the buffer
+        link_buffer (Deque): stores references to packets waiting to be sent
+                             on the link, including the packet currently
+                             being transmitted
+        enqueue_times (Deque): the time each packet in link_buffer arrived
+        packets_in_route (Deque): stores references to all packets being
+                                  propagated on the link
+        buffer_size (float): the amount of data waiting in the link buffer
+
+    """
+
+    def __init__(self, link, series_id, queue_discipline):
+        self.ns = link.ns
+        self.link = link
+        self.series_id = series_id
+        self.queue_discipline = queue_discipline
+        self.packets = link.packets
+
+        self.link_buffer = deque()
+        self.enqueue_times = deque()
+        self._buffer_size = 0.0
+        self.packets_in_route = deque()
+
+    @property
+    def buffer_size(self):
+        return self._buffer_size
+
+    @buffer_size.setter
+    def buffer_size(self, value):
+        raise AttributeError("Buffer size should not be changed externally")
+
+    def queue_length(self):
+        """Returns the number of packets in the link buffer."""
+        return len(self.link_buffer)
+
+    def admit(self, packet):
+        """Asks the queue discipline whether to accept an arriving packet,
+        marking it if the discipline asks for it.
+
+        Args:
+            packet (Packet): the arriving packet
+
+        Returns:
+            accepted (bool): false if the packet must be dropped.
+
+        """
+        verdict = self.queue_discipline.enqueue(packet, self._buffer_size,
+            len(self.link_buffer), self.ns.cur_time)
+        return self.apply_verdict(packet, verdict)
+
+    def apply_verdict(self, packet, verdict):
+        """Marks the packet if the verdict is MARK and the packet is ECN
+        capable.
+
+        Returns:
+            accepted (bool): false if the packet must be dropped.
+
+        """
+        if verdict == ACCEPT:
+            return True
+        if verdict == MARK and packet.ecn != ECN_NOT_ECT:
+            packet.ecn = ECN_CE
+            return True
+        return False
+
+    def drop(self, packet, reason):
+        """Drops a packet and records the loss.
+
+        Args:
+            packet (Packet): the dropped packet
+            reason (string): why the packet is dropped
+
+        """
+        if reason == "full":
+            print "Link %s is full; packet %s is dropped @ t=%f" \
+                % (self.link.link_id, packet.packet_id, self.ns.cur_time)
+        else:
+            print "Link %s %s drops packet %s @ t=%f" % (self.link.link_id,
+                reason, packet.packet_id, self.ns.cur_time)
+        self.ns.record_packet_loss(self.series_id)
+
+    def drop_reason(self, packet):
+        """Returns "full" if the packet was dropped because it did not fit in
+        the buffer, or the name of the queue discipline otherwise.
+
+        """
+        if self.queue_discipline.fits(packet, self._buffer_size):
+            return type(self.queue_discipline).__name__
+        return "full"
+
+    def add_packet(self, packet, destination):
+        """Add a packet to be sent
+
+        Puts the packet in the packet buffer to be sent to the destination.
+        If no other packets are in the buffer, sends the packet.
+        If the buffer is full, or the queue discipline decides to, the packet
+        is dropped.
+
+        Args:
+            packet (Packet): the packet being sent
+            destination (Node): the node at the other end of the link
+
+        """
+        if self.admit(packet):
+            # The store may recycle the packet, so read it before.
+            packet_size = packet.packet_size
+            self.link_buffer.append(self.packets.put(packet, destination))
+            self.enqueue_times.append(self.ns.cur_time)
+            self._buffer_size += packet_size
+
+            self.ns.record_buffer_occupancy(self.series_id,
+                len(self.link_buffer))
+
+            if len(self.link_buffer) == 1:
+                self.start_packet_transmission()
+        else:
+            self.drop(packet, self.drop_reason(packet))
+
+    def dequeue_head(self):
+        """Asks the queue discipline about the packet at the head of the
+        buffer before it is transmitted, and drops packets until one is
+        accepted.
+
+        Returns:
+            remaining (bool): false if every packet was dropped.
+
+        """
+        discipline = self.queue_discipline
+        now = self.ns.cur_time
+        while self.link_buffer:
+            ref = self.link_buffer[0]
+            packet_size = self.packets.packet_size(ref)
+            verdict = discipline.dequeue(now - self.enqueue_times[0],
+                self._buffer_size - packet_size, now)
+            if verdict == ACCEPT or \
+                (verdict == MARK and self.packets.mark_ecn(ref)):
+                return True
+
+            self.link_buffer.popleft()
+            self.enqueue_times.popleft()
+            self._buffer_size -= packet_size
+            packet, destination = self.packets.take(ref)
+            self.ns.record_buffer_occupancy(self.series_id,
+                len(self.link_buffer))
+            self.drop(packet, type(discipline).__name__)
+            self.ns.packet_pool.release(packet)
+        return False
+
+    def start_packet_transmission(self):
+        """Transmit a packet into the link
+
+        Starts transmitting the first packet in link buffer, after letting
+        the queue discipline drop or mark it. Calls the
+        start_packet_propagation function to start propagating the packet after
+        the transmission delay.
+
+        """
+        assert len(self.link_buffer) > 0
+        if self.queue_discipline.decides_on_dequeue and \
+            not self.dequeue_head():
+            return
+        packet_size = self.packets.packet_size(self.link_buffer[0])
+        self.ns.record_queueing_delay(self.series_id,
+            self.ns.cur_time - self.enqueue_times[0])
+
+        event = lambda: self.start_packet_propagation()
+        trans_delay = 1.0 * packet_size / self.link.capacity
+
+        self.ns.add_event(event, "Link.start_packet_propagation() with"
+                          " link_id = %s" % (self.link.link_id), trans_delay)
+
+    def start_packet_propagation(self):
+        """Begin propagating a packet on the wire
+
+        Starts propagating the packet. If there is another packet on the buffer
+        to be sent, calls start_packet_transmission.
+        Calls finish_packet_transfer after the propagation delay.
+
+        """
+        ref = self.link_buffer.popleft()
+        self.enqueue_times.popleft()
+        self._buffer_size -= self.packets.packet_size(ref)
+        self.ns.record_buffer_occupancy(self.series_id, len(self.link_buffer))
+
+        self.packets_in_route.append(ref)
+
+        event = lambda: self.finish_packet_transfer()
+        self.ns.add_event(event, "Link.finish_packet_transfer() with"
+                          " link_id = %s" % self.link.link_id,
+                          self.link.prop_delay)
+
+        if len(self.link_buffer) > 0:
+            self.start_packet_transmission()
+
+    def finish_packet_transfer(self):
+        """Hand off the packet to the node it was going to.
+
+        When this method is called, the packet will be transferred to the
+        correct node. The link records that it sent the data of this packet.
+
+        """
+        assert len(self.packets_in_route) > 0
+        packet, destination = self.packets.take(self.packets_in_route.popleft())
+        link_id = self.link.link_id
+
+        event = lambda: destination.receive_packet(packet, link_id)
+        self.ns.add_event(event, "Node.receive_packet() with node_id = %s, "
+                          "cur_packet = %s, link_id = %s" \
+                          % (destination.node_id, packet.packet_id, link_id))
+
+        self.ns.record_link_rate(self.series_id, packet.packet_size)
+
+
+class AnalyticTransmitter(Transmitter):
+    """The analytic engine of a link. Since the link is FIFO, the time at
+    which a packet leaves the buffer is fully determined when it is enqueued:
+    it starts transmitting once the link is free and takes
+    packet_size / capacity to transmit. Only the arrival at the far node is
+    scheduled as an event. Queue disciplines that decide on dequeue are asked
+    about the packet when it is enqueued, with the time its transmission will
+    start.
+
+    The buffer is drained lazily: packets whose departure time has passed are
+    removed (and their buffer occupancy points recorded at their departure
+    times) whenever the buffer is next looked at.
+
+    Attributes:
+        free_at (float): the time at which the link finishes transmitting the
+                         last packet in its buffer
+        departures (Deque): the departure time of each packet in link_buffer
+
+    Inherited Attributes:
+        ns (NetworkSimulator): stores the simulator class running the simulation
+        link (Link): the link the transmitter sends packets on
+        series_id (string): the id under which the transmitter's data is
+                            recorded
+        queue_discipline (QueueDiscipline): decides which packets the buffer
+                                            accepts, drops or marks
+        packets (PacketStore): the simulator's packet backend
+        link_buffer (Deque): stores references to packets that have not
+                             finished transmitting as of the last drain
+        enqueue_times (Deque): the time each packet in link_buffer arrived
+        packets_in_route (Deque): stores references to packets that have
+                                  departed but not yet arrived
+        buffer_size (float): the amount of data in the link buffer as of the
+                             last drain
+
+    """
+
+    def __init__(self, link, series_id, queue_discipline):
+        Transmitter.__init__(self, link, series_id, queue_discipline)
+        self.free_at = 0.0
+        self.departures = deque()
+
+    @property
+    def buffer_size(self):
+        self.drain()
+        return self._buffer_size
+
+    def queue_length(self):
+        """Returns the number of packets in the link buffer."""
+        self.drain()
+        return len(self.link_buffer)
+
+    def drain(self):
+        """Moves every packet whose departure time has passed from the link
+        buffer to the packets in route.
+
+        """
+        departures = self.departures
+        now = self.ns.cur_time
+        while departures and departures[0] <= now:
+            departure = departures.popleft()
+            ref = self.link_buffer.popleft()
+            self.enqueue_times.popleft()
+            self._buffer_size -= self.packets.packet_size(ref)
+            self.ns.record_buffer_occupancy(self.series_id,
+                len(self.link_buffer), departure)
+            self.packets_in_route.append(ref)
+
+    def add_packet(self, packet, destination):
+        """Add a packet to be sent
+
+        Computes when the packet leaves the buffer and schedules its arrival
+        at the destination. If the buffer is full, or the queue discipline
+        decides to, the packet is dropped.
+
+        Args:
+            packet (Packet): the packet being sent
+            destination (Node): the node at the other end of the link
+
+        """
+        self.drain()
+        if not self.admit(packet):
+            self.drop(packet, self.drop_reason(packet))
+            return
+
+        link = self.link
+        now = self.ns.cur_time
+        start = max(now, self.free_at)
+        discipline = self.queue_discipline
+        if discipline.decides_on_dequeue:
+            # What will be left behind the packet at start has not arrived
+            # yet, so the discipline is given the data ahead of it, see
+            # QueueDiscipline.dequeue.
+            verdict = discipline.dequeue(start - now, self._buffer_size, start)
+            if not self.apply_verdict(packet, verdict):
+                self.drop(packet, type(discipline).__name__)
+                return
+
+        # The store may recycle the packet, so read it before.
+        packet_size = packet.packet_size
+        self.link_buffer.append(self.packets.put(packet, destination))
+        self.enqueue_times.append(now)
+        self._buffer_size += packet_size
+
+        self.ns.record_buffer_occupancy(self.series_id, len(self.link_buffer))
+        self.ns.record_queueing_delay(self.series_id, start - now)
+
+        self.free_at = start + 1.0 * packet_size / link.capacity
+        self.departures.append(self.free_at)
+
+        event = lambda: self.finish_packet_transfer()
+        self.ns.add_event_at(event, "Link.finish_packet_transfer() with"
+                             " link_id = %s" % link.link_id,
+                             self.free_at + link.prop_delay)
+
+    def finish_packet_transfer(self):
+        """Hands the first packet in route to the node it was going to, and
+        records that the link sent its data.
+
+        """
+        self.drain()
+        assert len(self.packets_in_route) > 0
+        packet, destination = self.packets.take(self.packets_in_route.popleft())
+        link_id = self.link.link_id
+
+        self.ns.record_link_rate(self.series_id, packet.packet_size)
+        destination.receive_packet(packet, link_id)
+
+
+class FairQueueTransmitter(Transmitter):
+    """An event engine whose buffer is split into per-flow sub-queues served
+    by deficit round robin, so that one aggressive flow cannot starve the
+    others sharing the link. Since packets do not leave in arrival order, it
+    is always event driven, whatever the link's engine.
+
+    Also records the queueing delay and the amount of data sent of every flow
+    on the link.
+
+    Attributes:
+        fair_queue (FairQueue): the per-flow sub-queues
+        transmitting (ref): the reference of the packet being transmitted, or
+                            None if the link is idle
+
+    Inherited Attributes:
+        ns (NetworkSimulator): stores the simulator class running the simulation
+        link (Link): the link the transmitter sends packets on
+        series_id (string): the id under which the transmitter's data is
+                            recorded
+        packets (PacketStore): the simulator's packet backend
+        packets_in_route (Deque): stores references to all packets being
+                                  propagated on the link
+        buffer_size (float): the amount of data waiting in the link buffer,
+                             including the packet being transmitted
+
+    """
+
+    def __init__(self, link, series_id, scheduler, queue):
+        Transmitter.__init__(self, link, series_id, None)
+        self.fair_queue = make_fair_queue(link, self.discard, scheduler, queue)
+        self.transmitting = None
+        self._transmitting_size = 0.0
+
+    def queue_length(self):
+        """Returns the number of packets in the link buffer."""
+        return len(self.fair_queue) + (self.transmitting is not None)
+
+    def discard(self, packet, reason):
+        """Drops a packet that the scheduler removed from its sub-queues."""
+        self._buffer_size = self.fair_queue.size + self._transmitting_size
+        self.ns.record_buffer_occupancy(self.series_id, self.queue_length())
+        self.drop(packet, reason)
+        self.ns.packet_pool.release(packet)
+
+    def add_packet(self, packet, destination):
+        """Add a packet to be sent
+
+        Puts the packet in the sub-queue of its flow. If the link is idle,
+        sends the next packet. If the buffer overflows, the head packet of the
+        flow with the most queued data is dropped.
+
+        Args:
+            packet (Packet): the packet being sent
+            destination (Node): the node at the other end of the link
+
+        """
+        limit = self.link.max_buffer_size - self._transmitting_size
+        if not self.fair_queue.enqueue(packet, destination, self.ns.cur_time,
+                                       limit):
+            self.drop(packet, self.drop_reason(packet))
+            return
+
+        self._buffer_size = self.fair_queue.size + self._transmitting_size
+        self.ns.record_buffer_occupancy(self.series_id, self.queue_length())
+
+        if self.transmitting is None:
+            self.start_packet_transmission()
+
+    def drop_reason(self, packet):
+        """Returns "full" if the packet did not fit in the sub-queue of its
+        flow, or the name of the queue discipline of the flows otherwise.
+
+        """
+        return self.fair_queue.drop_reason(packet)
+
+    def start_packet_transmission(self):
+        """Transmit a packet into the link
+
+        Starts transmitting the packet picked by the scheduler, and records
+        how long it waited. Calls the start_packet_propagation function to
+        start propagating the packet after the transmission delay.
+
+        """
+        item = self.fair_queue.dequeue(self.ns.cur_time)
+        if item is None:
+            self._buffer_size = self.fair_queue.size
+            return
+        ref, flow_id, sojourn_time = item
+        self.transmitting = ref
+        self._transmitting_size = self.packets.packet_size(ref)
+        self._buffer_size = self.fair_queue.size + self._transmitting_size
+        # Routing packets have no flow and are left out of the flow metrics.
+        if flow_id is not None:
+            self.ns.record_flow_queueing_delay(self.series_id, flow_id,
+                sojourn_time)
+
+        event = lambda: self.start_packet_propagation()
+        trans_delay = 1.0 * self._transmitting_size / self.link.capacity
+
+        self.ns.add_event(event, "Link.start_packet_propagation() with"
+                          " link_id = %s" % (self.link.link_id), trans_delay)
+
+    def start_packet_propagation(self):
+        """Begin propagating a packet on the wire
+
+        Starts propagating the packet. If there is another packet on the buffer
+        to be sent, calls start_packet_transmission.
+        Calls finish_packet_transfer after the propagation delay.
+
+        """
+        self.packets_in_route.append(self.transmitting)
+        self.transmitting = None
+        self._transmitting_size = 0.0
+        self._buffer_size = self.fair_queue.size
+        self.ns.record_buffer_occupancy(self.series_id, self.queue_length())
+
+        event = lambda: self.finish_packet_transfer()
+        self.ns.add_event(event, "Link.finish_packet_transfer() with"
+                          " link_id = %s" % self.link.link_id,
+                          self.link.prop_delay)
+
+        if len(self.fair_queue) > 0:
+            self.start_packet_transmission()
+
+    def finish_packet_transfer(self):
+        """Hand off the packet to the node it was going to, and record the
+        data sent by its flow.
+
+        """
+        ref = self.packets_in_route[0]
+        flow_id = self.packets.flow_id(ref)
+        packet_size = self.packets.packet_size(ref)
+        Transmitter.finish_packet_transfer(self)
+        if flow_id is not None:
+            self.ns.record_flow_link_rate(self.series_id, flow_id,
+                packet_size)
@@ -0,0 +1,12 @@
+from src import *
+
+ns = NetworkSimulator()
+ns.populate("network_descriptions/test3_mixed.json")
+ns.run(verbose=False)
+
+ns.data_metrics.plot_link_rate(["L5"])
+ns.data_metrics.plot_buffer_occupancy(["L5"])
+ns.data_metrics.plot_packet_loss(["L5"])
+ns.data_metrics.plot_flow_rate()
+ns.data_metrics.plot_flow_window_size()
+ns.data_metrics.plot_flow_packet_delay()